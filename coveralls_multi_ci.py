@@ -26,36 +26,124 @@ COVERALLS_REPO_TOKEN is the only mandatory variable, the others help though.
     CI_BRANCH -- git branch name being built (master, feature, tag's name).
     CI_PULL_REQUEST -- pull request number or "false".
 
+To submit several coverage files at once (e.g. one per package in a monorepo)
+use submit-many with a JSON manifest listing them. Relative paths are relative
+to the manifest, missing "source"/"git" keys default to the options below:
+    [{"coverage": "pkg1/.coverage", "source": "pkg1", "git": "."}, ...]
+An "lcov" list of LCOV tracefiles per entry works like --lcov.
+
+Running submit many times on one machine (e.g. a build farm) is faster with a
+serve daemon running: submit hands its job to the daemon over --socket and
+only falls back to doing the work itself if no daemon is listening or the
+daemon's queue is full.
+
+To check a payload file kept with --no-delete (e.g. after the API rejected
+it), run inspect. It reads --output as a stream, so it works on payloads too
+large to load, and lists every file with its size, lines and coverage.
+
+Submissions are recorded per commit and file with --history FILE. Running
+history with the same option lists the files whose coverage dropped at HEAD
+against the merge base of --since (or the commit recorded before HEAD) and
+exits with 1 if there are any. Given a file name it shows that file's
+coverage over the last --top recorded commits instead.
+
 Usage:
     coveralls_multi_ci submit [options]
+    coveralls_multi_ci submit-many <manifest> [options]
+    coveralls_multi_ci serve [options]
+    coveralls_multi_ci inspect [options]
+    coveralls_multi_ci history [<name>] [options]
     coveralls_multi_ci -h | --help
     coveralls_multi_ci -V | --version
 
 Options:
-    -c --coverage=FILE  Path to the coverage file generated by Coverage.
+    -b --bandwidth=NUM  Upload bandwidth in Mbit/s used by --dry-run to
+                        estimate upload time. [default: 10]
+    -c --coverage=FILE  Path to the coverage file generated by Coverage. Files
+                        ending with .json or .xml are read as reports from
+                        "coverage json" or Cobertura XML reports instead.
                         [default: .coverage]
+    -d --dry-run        Don't write the payload file or POST to the API, only
+                        print its size, where the bytes come from and coverage
+                        totals.
+    --fingerprints=FILE
+                        Index of fingerprints of earlier successful
+                        submissions. Identical submissions (same coverage
+                        file, git HEAD, CI job and source files) are skipped.
+    -f --force          Submit even if an identical submission was made.
     -g --git=DIR        Path to the root git repo directory.
                         [default: cwd]
+    --heavy=RULES       What to send of generated, minified and binary source
+                        files: comma separated CLASS=ACTION rules, classes
+                        binary, generated and minified, actions exclude,
+                        digest (MD5 only), truncate (lines cut to 1000
+                        characters) or keep. A bare ACTION applies to every
+                        class, e.g. digest,binary=exclude.
     -h --help           Show this screen.
+    --history=FILE      SQLite database recording line coverage of every
+                        file per git commit on each successful submission.
+    -j --jobs=NUM       Number of concurrent submissions for submit-many and
+                        serve, or of shards uploaded at once. [default: 4]
+    --lcov=FILES        Comma separated LCOV tracefiles (e.g. of C extensions
+                        or JavaScript) merged into the coverage data of
+                        --coverage, summing hits of files in both.
+    --max-memory=MB     Keep at most about this many MB of coverage results in
+                        memory, spill the rest to a temporary file.
+    --no-daemon         Don't hand the submission to a serve daemon.
     --no-delete         Don't delete the temporary payload file after POSTing.
     -o --output=FILE    Temporary payload file to write/read. Dumps all source
                         code into this file and reads it during POST to API.
+                        If the upload is interrupted FILE.checkpoint is left
+                        next to it and running again sends FILE again.
                         [default: coveralls_multi_ci_payload.txt]
+    --queue=NUM         Number of jobs serve accepts while all workers are
+                        busy. [default: 16]
     -q --quiet          Print nothing to console.
+    --remap=RULES       Rewrite path prefixes of measured files, e.g. for
+                        coverage collected in a container: /app=/builds/x.
+                        Comma separated FROM=TO rules, longest FROM wins. Use
+                        @FILE to read one rule per line from FILE.
+    --resume            Resume an interrupted upload where the API left off
+                        instead of sending it again in full. Only for APIs
+                        supporting Content-Range (Coveralls.io doesn't).
     -s --source=FILE    Path to source code root directory.
                         [default: cwd]
+    --shard-size=MB     Split payloads larger than this into parallel jobs of
+                        about this size, uploaded concurrently. The build is
+                        closed once all of them were accepted.
+    --since=REF         Only include files changed since the merge base of
+                        REF and HEAD (e.g. origin/master for pull requests).
+    --socket=FILE       Unix socket serve listens on and submit connects to.
+                        [default: ~/.coveralls_multi_ci.sock]
+    -t --top=NUM        Number of largest files listed by --dry-run.
+                        [default: 10]
+    --trace             Like --verbose, also logs every file read or written.
     -v --verbose        Print debug information to console.
     -V --version        Show version.
 """
 
 from base64 import b64decode, b64encode
+from contextlib import contextmanager
 from datetime import datetime
+import hashlib
+import heapq
 import json
 import logging
+import mmap
+from multiprocessing import TimeoutError as PoolTimeoutError
+from multiprocessing.pool import ThreadPool
 import os
 import re
+import shutil
 import signal
+import socket
+import sqlite3
+import struct
 import sys
+import tempfile
+import threading
+import time
+import uuid
 
 from coverage import coverage
 from docopt import docopt
@@ -66,19 +154,66 @@ try:
 except ImportError:
     import subprocess as subprocess32
 
+try:
+    from queue import Full, Queue
+except ImportError:
+    from Queue import Full, Queue
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
 __author__ = '@Robpol86'
 __license__ = 'MIT'
 __version__ = '1.0.0'
+_FINGERPRINTS_LOCK = threading.Lock()  # Serializes store_fingerprint() between submit_many()/serve threads.
+_HISTORY_LOCK = threading.Lock()  # Serializes record_history() between submit_many()/serve threads.
+_RE_BRACKET = re.compile(r'[\[\]"{]')  # Array brackets and what can't be in JSONTokenizer.array().
+_RE_GENERATED = re.compile(br'@generated|DO NOT EDIT|Generated by the protocol buffer compiler|auto-?generated',
+                           re.IGNORECASE)
+_RE_LITERAL = re.compile(r'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?|true|false|null')
+_RE_LITERAL_END = re.compile(r'[ \t\n\r,\]}]')  # What may follow a literal.
+_RE_PATH_PART = re.compile(r'[^/\\]+')
+_RE_SKIP = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}"]')  # Whole strings, brackets or an unterminated string.
 _RE_SPLIT = re.compile(r'(PLACEHOLDER_(?:[A-Za-z0-9+/]{4})*(?:[A-Za-z0-9+/]{2}==|[A-Za-z0-9+/]{3}=)?_)')
+_RE_WHITESPACE = re.compile(r'[ \t\n\r]*')
 API_URL = 'https://coveralls.io/api/v1/jobs'
+CHECKPOINT_SUFFIX = '.checkpoint'
+CHUNK_SIZE = 1024 * 1024
 CWD = os.getcwd()
+FINGERPRINTS_KEEP = 1000
+GIT_DEADLINE = 30  # Seconds all git commands of one git_stats() call may take.
+GIT_HEAD_FIELDS = ('id', 'author_name', 'author_email', 'committer_name', 'committer_email', 'message')
+GIT_STATS_CACHE = 'coveralls_multi_ci_git_stats.json'  # Written to the repo's git directory by git_stats().
+GIT_THREADS = 4  # Git commands GitRunner runs at once.
+GIT_TIMEOUT = 10  # Seconds each git command may take.
+HEAVY_ACTIONS = ('digest', 'exclude', 'keep', 'truncate')
+HEAVY_CLASSES = ('binary', 'generated', 'minified')
+MAX_LINE_LENGTH = 1000  # Longer lines make a file "minified", "truncate" cuts lines to this many characters.
 OPTIONS = docopt(__doc__) if __name__ == '__main__' else dict()
-RUN_AT = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S +0000')
+PROGRESS_INTERVAL = 10  # Seconds between FileProgress messages.
+RUN_AT_FORMAT = '%Y-%m-%d %H:%M:%S +0000'
+SAMPLE_SIZE = 64 * 1024  # Bytes at the start and end of a source file scan_source() classifies it by.
+TRACE = 5  # Log level of per-file messages, below DEBUG. Enabled by --trace.
+WEBHOOK_URL = 'https://coveralls.io/webhook'
+
+logging.addLevelName(TRACE, 'TRACE')
 
 
 class Base(object):
-    """Base class for all other CI classes."""
-    REPO_TOKEN = os.environ.get('COVERALLS_REPO_TOKEN')
+    """Base class for all other CI classes.
+
+    Attributes read from environment variables are declared in ENVIRON, a dict of attribute name to a function taking
+    the environment mapping. They're None (GIT empty) on the classes themselves, select_ci() returns a subclass bound
+    to an environment with from_environ().
+
+    GIT holds the git fields (branch, remote_url and GIT_HEAD_FIELDS) the CI exports as environment variables, values
+    are None when not set. git_stats() doesn't run git for them.
+    """
+    ENVIRON = dict(REPO_TOKEN=lambda e: e.get('COVERALLS_REPO_TOKEN'))
+    GIT = dict()
+    REPO_TOKEN = None
     SERVICE_BRANCH = None
     SERVICE_BUILD_URL = None
     SERVICE_JOB_ID = None
@@ -87,7 +222,26 @@ class Base(object):
     SERVICE_PULL_REQUEST = None
 
     @classmethod
-    def payload(cls, coverage_result, git_stats_result=None):
+    def from_environ(cls, environ):
+        """Reads the ENVIRON attributes of the class and its bases from an environment.
+
+        Attributes are resolved like class attributes are: the most derived class declaring one (in ENVIRON or as a
+        plain class attribute) wins.
+
+        Positional arguments:
+        environ -- mapping of environment variables (e.g. os.environ).
+
+        Returns:
+        New subclass of cls (with the same name) holding the values.
+        """
+        values = dict()
+        for klass in reversed(cls.__mro__[:-1]):
+            values.update((k, v) for k, v in vars(klass).items() if k.isupper() and k != 'ENVIRON')
+            values.update((k, f(environ)) for k, f in vars(klass).get('ENVIRON', dict()).items())
+        return type(cls.__name__, (cls,), values)
+
+    @classmethod
+    def payload(cls, coverage_result, git_stats_result=None, run_at=None):
         """Puts together environment variable data and coverage/git data into a final dict to be submitted to the API.
 
         Positional arguments:
@@ -97,11 +251,12 @@ class Base(object):
         Keyword arguments:
         git_stats_result -- return value of git_stats(), may be an empty dict or None since API says it's optional. Is
             a dict with some data about the git repo. Will be passed to the API unchanged.
+        run_at -- time of the run in RUN_AT_FORMAT, defaults to now.
 
         Returns:
         Final dict meant to be sent as a JSON to the API.
         """
-        result = dict(source_files=coverage_result, run_at=RUN_AT)
+        result = dict(source_files=coverage_result, run_at=run_at or datetime.utcnow().strftime(RUN_AT_FORMAT))
 
         # Insert optional values.
         optional = (
@@ -123,6 +278,14 @@ class Base(object):
 
         return result
 
+    @classmethod
+    def git_fields(cls):
+        """Returns the git fields set in the environment, passed to git_stats() as known fields."""
+        fields = dict((k, v) for k, v in cls.GIT.items() if v)
+        if 'remote_url' in fields:
+            fields['remotes'] = [dict(name='origin', url=fields.pop('remote_url'))]
+        return fields
+
 
 class BaseFirstClass(Base):
     """First class CIs, officially supported by Coveralls.
@@ -132,8 +295,8 @@ class BaseFirstClass(Base):
     """
 
     @classmethod
-    def payload(cls, coverage_result, git_stats_result=None):
-        result = super(BaseFirstClass, cls).payload(coverage_result, git_stats_result)
+    def payload(cls, coverage_result, git_stats_result=None, run_at=None):
+        result = super(BaseFirstClass, cls).payload(coverage_result, git_stats_result, run_at)
 
         # Validate.
         if not result.get('service_name') or not result.get('service_job_id'):
@@ -151,15 +314,17 @@ class BaseSecondClass(Base):
     Second class CIs require the repo token to be sent to Coveralls' API. Additional information helps but is not
     mandatory.
     """
-    SERVICE_BRANCH = os.environ.get('CI_BRANCH')
-    SERVICE_BUILD_URL = os.environ.get('CI_BUILD_URL')
-    SERVICE_NAME = os.environ.get('CI_NAME', Base.SERVICE_NAME)
-    SERVICE_NUMBER = os.environ.get('CI_BUILD_NUMBER')
-    SERVICE_PULL_REQUEST = os.environ.get('CI_PULL_REQUEST')
+    ENVIRON = dict(
+        SERVICE_BRANCH=lambda e: e.get('CI_BRANCH'),
+        SERVICE_BUILD_URL=lambda e: e.get('CI_BUILD_URL'),
+        SERVICE_NAME=lambda e: e.get('CI_NAME', Base.SERVICE_NAME),
+        SERVICE_NUMBER=lambda e: e.get('CI_BUILD_NUMBER'),
+        SERVICE_PULL_REQUEST=lambda e: e.get('CI_PULL_REQUEST'),
+    )
 
     @classmethod
-    def payload(cls, coverage_result, git_stats_result=None):
-        result = super(BaseSecondClass, cls).payload(coverage_result, git_stats_result)
+    def payload(cls, coverage_result, git_stats_result=None, run_at=None):
+        result = super(BaseSecondClass, cls).payload(coverage_result, git_stats_result, run_at)
 
         # Validate.
         if not result.get('repo_token'):
@@ -173,25 +338,56 @@ class BaseSecondClass(Base):
 class TravisCI(BaseFirstClass):
     """http://docs.travis-ci.com/user/ci-environment/#Environment-variables"""
     SERVICE_NAME = 'travis-ci'
-    SERVICE_JOB_ID = os.environ.get('TRAVIS_JOB_ID')
+    ENVIRON = dict(
+        SERVICE_JOB_ID=lambda e: e.get('TRAVIS_JOB_ID'),
+        GIT=lambda e: dict(
+            id=e.get('TRAVIS_COMMIT'),
+            branch=e.get('TRAVIS_PULL_REQUEST_BRANCH') or e.get('TRAVIS_TAG') or e.get('TRAVIS_BRANCH'),
+            message=e.get('TRAVIS_COMMIT_MESSAGE'),
+        ),
+    )
 
 
 class CircleCI(BaseSecondClass):
     """https://circleci.com/docs/environment-variables"""
     SERVICE_NAME = 'circleci'
-    SERVICE_NUMBER = os.environ.get('CIRCLE_BUILD_NUM')
+    ENVIRON = dict(
+        SERVICE_NUMBER=lambda e: e.get('CIRCLE_BUILD_NUM'),
+        GIT=lambda e: dict(
+            id=e.get('CIRCLE_SHA1'),
+            branch=e.get('CIRCLE_TAG') or e.get('CIRCLE_BRANCH'),
+            remote_url=e.get('CIRCLE_REPOSITORY_URL'),
+        ),
+    )
 
 
 class Semaphore(BaseSecondClass):
     """https://semaphoreapp.com/docs/available-environment-variables.html"""
     SERVICE_NAME = 'semaphore'
-    SERVICE_NUMBER = os.environ.get('SEMAPHORE_BUILD_NUMBER')
+    ENVIRON = dict(
+        SERVICE_NUMBER=lambda e: e.get('SEMAPHORE_BUILD_NUMBER'),
+        GIT=lambda e: dict(
+            id=e.get('REVISION'),
+            branch=e.get('BRANCH_NAME'),
+        ),
+    )
 
 
 class JenkinsCI(BaseSecondClass):
     """https://wiki.jenkins-ci.org/display/JENKINS/Building+a+software+project"""
     SERVICE_NAME = 'jenkins'
-    SERVICE_NUMBER = os.environ.get('BUILD_NUMBER')
+    ENVIRON = dict(
+        SERVICE_NUMBER=lambda e: e.get('BUILD_NUMBER'),
+        GIT=lambda e: dict(  # Set by the Git plugin. GIT_BRANCH is the remote branch (e.g. origin/master).
+            id=e.get('GIT_COMMIT'),
+            branch=e.get('GIT_LOCAL_BRANCH') or re.sub(r'^[^/]+/', '', e.get('GIT_BRANCH', '')),
+            author_name=e.get('GIT_AUTHOR_NAME'),
+            author_email=e.get('GIT_AUTHOR_EMAIL'),
+            committer_name=e.get('GIT_COMMITTER_NAME'),
+            committer_email=e.get('GIT_COMMITTER_EMAIL'),
+            remote_url=e.get('GIT_URL'),
+        ),
+    )
 
 
 class GenericCI(BaseSecondClass):
@@ -202,62 +398,334 @@ class GenericCI(BaseSecondClass):
 class AppVeyor(BaseSecondClass):
     """http://www.appveyor.com/docs/environment-variables"""
     SERVICE_NAME = 'appveyor'
-    SERVICE_BRANCH = os.environ.get('APPVEYOR_REPO_BRANCH')
-    SERVICE_BUILD_URL = os.environ.get('APPVEYOR_API_URL')
-    SERVICE_JOB_ID = os.environ.get('APPVEYOR_JOB_ID')
-    SERVICE_NUMBER = os.environ.get('APPVEYOR_BUILD_NUMBER')
-    SERVICE_PULL_REQUEST = os.environ.get('APPVEYOR_PULL_REQUEST_NUMBER')
+    ENVIRON = dict(
+        SERVICE_BRANCH=lambda e: e.get('APPVEYOR_REPO_BRANCH'),
+        SERVICE_BUILD_URL=lambda e: e.get('APPVEYOR_API_URL'),
+        SERVICE_JOB_ID=lambda e: e.get('APPVEYOR_JOB_ID'),
+        SERVICE_NUMBER=lambda e: e.get('APPVEYOR_BUILD_NUMBER'),
+        SERVICE_PULL_REQUEST=lambda e: e.get('APPVEYOR_PULL_REQUEST_NUMBER'),
+        GIT=lambda e: dict(
+            id=e.get('APPVEYOR_REPO_COMMIT'),
+            branch=e.get('APPVEYOR_REPO_TAG_NAME') or e.get('APPVEYOR_REPO_BRANCH'),
+            author_name=e.get('APPVEYOR_REPO_COMMIT_AUTHOR'),
+            author_email=e.get('APPVEYOR_REPO_COMMIT_AUTHOR_EMAIL'),
+            message=e.get('APPVEYOR_REPO_COMMIT_MESSAGE'),
+        ),
+    )
 
 
 class Codeship(BaseSecondClass):
     """https://codeship.io/documentation/continuous-integration/set-environment-variables/"""
     SERVICE_NAME = 'codeship'
+    ENVIRON = dict(
+        GIT=lambda e: dict(
+            id=e.get('CI_COMMIT_ID'),
+            branch=e.get('CI_BRANCH'),
+            committer_name=e.get('CI_COMMITTER_NAME'),
+            committer_email=e.get('CI_COMMITTER_EMAIL'),
+            message=e.get('CI_MESSAGE'),
+        ),
+    )
 
 
 class Bamboo(BaseSecondClass):
     """https://confluence.atlassian.com/display/BAMBOO/Bamboo+variables"""
     SERVICE_NAME = 'bamboo'
-    SERVICE_BRANCH = os.environ.get('bamboo.planRepository.branch')
-    SERVICE_BUILD_URL = os.environ.get('bamboo.planRepository.repositoryUrl')
-    SERVICE_JOB_ID = os.environ.get('bamboo.buildKey')
-    SERVICE_NUMBER = os.environ.get('bamboo.buildNumber')
+    ENVIRON = dict(
+        SERVICE_BRANCH=lambda e: e.get('bamboo.planRepository.branch'),
+        SERVICE_BUILD_URL=lambda e: e.get('bamboo.planRepository.repositoryUrl'),
+        SERVICE_JOB_ID=lambda e: e.get('bamboo.buildKey'),
+        SERVICE_NUMBER=lambda e: e.get('bamboo.buildNumber'),
+        GIT=lambda e: dict(
+            id=e.get('bamboo.planRepository.revision'),
+            branch=e.get('bamboo.planRepository.branch'),
+            remote_url=e.get('bamboo.planRepository.repositoryUrl'),
+        ),
+    )
 
 
-def git_stats(repo_dir):
+def git_stats(repo_dir, known=None, timeout=GIT_TIMEOUT, deadline=GIT_DEADLINE):
     """Generates a dictionary with metadata about the git repo.
 
     Attempts to resolve branch name if it's HEAD to a tag or branch name if the last commit is referenced by just one
     of either.
 
+    Fields already known (usually from the CI's environment variables, see Base.git_fields()) are used as they are and
+    only the git commands needed for the missing ones are run: "git remote" for remotes, "git log" for any of the
+    GIT_HEAD_FIELDS and the show-ref/reflog/rev-parse ones for branch. Git isn't run at all if everything is known. If
+    git can't be run (not a repo, not installed) the known fields are returned on their own, as long as the commit ID
+    is one of them.
+
+    The commands are independent of each other and run concurrently through GitRunner, each limited to `timeout`
+    seconds and all of them to `deadline` seconds. Fields whose commands timed out (e.g. git hanging on a network file
+    system) are left out or taken from the known ones, and such a partial result isn't cached.
+
+    Results are cached in GIT_STATS_CACHE inside the repo's git directory, keyed on git_state() and the known fields,
+    so running again on an unchanged checkout (e.g. once per coverage file in one pipeline) doesn't run git at all.
+
     Positional arguments:
     repo_dir -- root directory of the git repository.
 
+    Keyword arguments:
+    known -- dict of already known fields: branch, remotes and/or GIT_HEAD_FIELDS.
+    timeout -- seconds each git command may take.
+    deadline -- seconds all git commands together may take.
+
     Returns:
     A nested dictionary whose structure matches the JSON data sent to the Coveralls API.
     """
-    call = lambda l: [x.decode('ascii') for x in subprocess32.check_output(l, cwd=repo_dir).splitlines()]
+    known = known or dict()
+    head = dict((f, known[f]) for f in GIT_HEAD_FIELDS if f in known)
+    branch = known.get('branch')
+    remotes = known.get('remotes')
+    if branch is not None and remotes is not None and len(head) == len(GIT_HEAD_FIELDS):
+        logging.debug('All git metadata known, not running git.')
+        return dict(head=head, branch=branch, remotes=remotes)
+
+    state = git_state(repo_dir)
+    if state is not None:
+        cache_file = os.path.join(state[0], GIT_STATS_CACHE)
+        key = hashlib.sha1(json.dumps([state[1], known], sort_keys=True).encode('utf-8')).hexdigest()
+        cached = read_git_stats_cache(cache_file, key)
+        if cached is not None:
+            logging.debug('Git repo unchanged, using cached git metadata.')
+            return cached
+
+    runner = GitRunner(repo_dir, timeout=timeout, deadline=deadline)
+    try:
+        pending = dict()
+        if remotes is None:
+            pending['remotes'] = runner.start(['git', 'remote', '-v'])
+        if len(head) < len(GIT_HEAD_FIELDS):
+            pending['log'] = runner.start(['git', '--no-pager', 'log', '-1', '--pretty=%H%n%aN%n%ae%n%cN%n%ce%n%s'])
+        if branch is None:
+            pending['heads'] = runner.start(['git', 'show-ref', '--heads'])
+            pending['refs'] = runner.start(['git', 'show-ref', '-d'])
+            pending['abbrev'] = runner.start(['git', 'rev-parse', '--symbolic-full-name', '--abbrev-ref', 'HEAD'])
+
+        # Get remotes.
+        if remotes is None:
+            output = runner.result(pending['remotes'])
+            gen = (l.split() for l in output or list())
+            remotes = [dict(name=r[0], url=r[1]) for r in gen if r[2] == '(fetch)']
+
+        # Get metadata of the last commit.
+        if 'log' in pending:
+            for field, value in zip(GIT_HEAD_FIELDS, runner.result(pending['log']) or list()):
+                head.setdefault(field, value)
+
+        if branch is None:
+            abbrev = runner.result(pending['abbrev'])
+            if abbrev is not None:
+                heads, refs = runner.result(pending['heads']), runner.result(pending['refs'])
+                branch = git_branch(runner, head.get('id'), heads or list(), refs or list(), abbrev[0])
+    except (OSError, subprocess32.CalledProcessError) as e:
+        if 'id' not in known:
+            logging.error('{0} raised, probably not in a git repo.'.format(e.__class__.__name__))
+            return dict()
+        logging.warning('Unable to run git ({0}), using known git metadata only.'.format(e.__class__.__name__))
+        head = dict((f, known[f]) for f in GIT_HEAD_FIELDS if f in known)
+        branch, remotes = known.get('branch'), known.get('remotes', list())
+        state = None  # Not cached, git may work next time.
+    finally:
+        runner.close()
+
+    if runner.timed_out:
+        if 'id' not in head:
+            logging.error('Git timed out before the commit ID was known, no git metadata.')
+            return dict()
+        logging.warning('Git timed out ({0}), using partial git metadata.'.format(', '.join(runner.timed_out)))
+        state = None  # Not cached, git may be faster next time.
+
+    result = dict(head=head, remotes=remotes)
+    if branch is not None:
+        result['branch'] = branch
+    if state is not None:
+        write_git_stats_cache(cache_file, key, result)
+    return result
+
+
+def git_state(repo_dir):
+    """Fingerprints the state of a repo's refs and remotes without running git, to key git_stats()'s cache on.
+
+    Hashes the contents of HEAD and of the loose ref it points to, and the stat (size, inode, mtime) of HEAD's reflog,
+    packed-refs, the config holding the remotes and every directory under refs. Git replaces ref files by renaming
+    lock files, so moving, adding or deleting any ref changes one of them.
+
+    Positional arguments:
+    repo_dir -- root directory of the git repository. A .git file (worktrees, submodules) is followed.
 
-    # Get remotes.
+    Returns:
+    Tuple of the git directory and the hex fingerprint, None if repo_dir has no readable .git.
+    """
+    git_dir = os.path.join(repo_dir, '.git')
+    hasher = hashlib.sha1()
     try:
-        gen = (l.split() for l in call(['git', 'remote', '-v']))
-        remotes = [dict(name=r[0], url=r[1]) for r in gen if r[2] == '(fetch)']
-    except subprocess32.CalledProcessError:
-        logging.error('CalledProcessError raised, probably not in a git repo.')
-        return dict()
+        if os.path.isfile(git_dir):
+            with open(git_dir) as f:
+                git_dir = os.path.normpath(os.path.join(repo_dir, f.read().strip()[len('gitdir:'):].strip()))
+        common_dir = git_dir
+        if os.path.isfile(os.path.join(git_dir, 'commondir')):
+            with open(os.path.join(git_dir, 'commondir')) as f:
+                common_dir = os.path.normpath(os.path.join(git_dir, f.read().strip()))
+        with open(os.path.join(git_dir, 'HEAD'), 'rb') as f:
+            head = f.read()
+        hasher.update(head)
+        ref_file = os.path.join(common_dir, head[5:].strip().decode('utf-8')) if head.startswith(b'ref: ') else None
+        if ref_file is not None and os.path.isfile(ref_file):
+            with open(ref_file, 'rb') as f:
+                hasher.update(f.read())
+        paths = [os.path.join(git_dir, 'logs', 'HEAD'), os.path.join(common_dir, 'packed-refs'),
+                 os.path.join(common_dir, 'config')]
+        for root, dirs, _ in os.walk(os.path.join(common_dir, 'refs')):
+            dirs.sort()
+            paths.append(root)
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                hasher.update('{0} missing\n'.format(path).encode('utf-8'))
+                continue
+            mtime = getattr(stat, 'st_mtime_ns', stat.st_mtime)
+            hasher.update('{0} {1} {2} {3}\n'.format(path, stat.st_size, stat.st_ino, mtime).encode('utf-8'))
+    except (IOError, OSError, UnicodeDecodeError):
+        return None
+    return git_dir, hasher.hexdigest()
 
-    # Get branches. One commit may be referenced by many branches.
-    branches = dict()  # dict(hex=[branch1, branch2, ...])
-    for branch in call(['git', 'show-ref', '--heads']):
-        branch_name = branch.split(' ', 1)[1][11:]
-        gen = (l.split() for l in call(['git', 'reflog', 'show', branch_name, '--pretty=%H %gs']))
-        for hex_ in (l[0] for l in gen if 'commit' in l[1]):
-            if hex_ not in branches:
-                branches[hex_] = set()
-            branches[hex_].add(branch_name)
+
+def read_git_stats_cache(cache_file, key):
+    """Returns the git_stats() result cached under key, None if there's none (or the cache can't be read).
+
+    Positional arguments:
+    cache_file -- path to the cache, may not exist yet.
+    key -- hex digest of git_state()'s fingerprint and the known fields.
+    """
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get('key') != key:
+        return None
+    return cached.get('result')
+
+
+def write_git_stats_cache(cache_file, key, result):
+    """Replaces the cached git_stats() result. Written to a temporary file first and renamed, so concurrent readers
+    never see a partial file. Failing to write is logged but not fatal.
+
+    Positional arguments:
+    cache_file -- path to the cache.
+    key -- hex digest of git_state()'s fingerprint and the known fields.
+    result -- return value of git_stats().
+    """
+    temporary = '{0}.{1}'.format(cache_file, uuid.uuid4().hex)
+    try:
+        with open(temporary, 'w') as f:
+            json.dump(dict(key=key, result=result), f)
+        os.rename(temporary, cache_file)
+    except (IOError, OSError) as e:
+        logging.debug('Unable to write git metadata cache {0}: {1}'.format(cache_file, e))
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+class GitRunner(object):
+    """Runs git commands in a repo concurrently for git_stats(), each with a timeout and all of them within a deadline.
+
+    Commands that time out (or are started after the deadline) are killed, logged and listed in `timed_out`, their
+    result is None. How long every command took is logged.
+
+    Positional arguments:
+    repo_dir -- root directory of the git repository.
+
+    Keyword arguments:
+    timeout -- seconds each command may take.
+    deadline -- seconds from now all commands must be done by.
+    """
+
+    def __init__(self, repo_dir, timeout=GIT_TIMEOUT, deadline=GIT_DEADLINE):
+        self.repo_dir = repo_dir
+        self.timeout = timeout
+        self.deadline = time.time() + deadline
+        self.pool = ThreadPool(GIT_THREADS)
+        self.timed_out = list()
+
+    def run(self, command):
+        """Runs a git command in a pool thread.
+
+        Positional arguments:
+        command -- list of the command and its arguments.
+
+        Returns:
+        List of output lines.
+        """
+        remaining = self.deadline - time.time()
+        if remaining <= 0:
+            raise subprocess32.TimeoutExpired(command, 0)
+        start = time.time()
+        try:
+            output = subprocess32.check_output(command, cwd=self.repo_dir, timeout=min(self.timeout, remaining))
+        finally:
+            logging.debug('{0} took {1:.3f} seconds.'.format(' '.join(command), time.time() - start))
+        return [x.decode('ascii') for x in output.splitlines()]
+
+    def start(self, command):
+        """Starts running a git command, see result().
+
+        Positional arguments:
+        command -- list of the command and its arguments.
+
+        Returns:
+        AsyncResult to pass to result().
+        """
+        async_result = self.pool.apply_async(self.run, (command,))
+        async_result.command = ' '.join(command)
+        return async_result
+
+    def result(self, async_result):
+        """Waits for a command started by start(), at most until the deadline.
+
+        Positional arguments:
+        async_result -- return value of start().
+
+        Returns:
+        List of output lines, None if the command timed out.
+
+        Raises:
+        OSError or CalledProcessError raised by the command.
+        """
+        try:
+            return async_result.get(max(self.deadline - time.time(), 0))
+        except (subprocess32.TimeoutExpired, PoolTimeoutError):
+            logging.warning('{0} timed out.'.format(async_result.command))
+            self.timed_out.append(async_result.command)
+            return None
+
+    def close(self):
+        """Lets the pool's threads exit once they're done, without waiting for commands still running."""
+        self.pool.close()
+
+
+def git_branch(runner, head_id, heads, refs, abbrev):
+    """Resolves the branch name for git_stats(). Detached HEADs are resolved to the one tag or branch pointing to them.
+
+    Positional arguments:
+    runner -- GitRunner of the repo, runs "git reflog" for each branch if HEAD is detached and not tagged.
+    head_id -- hex SHA of the last commit, None if unknown.
+    heads -- output lines of "git show-ref --heads".
+    refs -- output lines of "git show-ref -d".
+    abbrev -- HEAD's branch name from "git rev-parse --abbrev-ref", "HEAD" if detached.
+
+    Returns:
+    Branch or tag name, "HEAD" if ambiguous.
+    """
+    if abbrev != 'HEAD' or head_id is None:
+        return abbrev
 
     # Get tags. One commit may be referenced by many tags.
     tags = dict()  # dict(hex=[tag1, tag2, ...])
-    for tag in (l.split() for l in call(['git', 'show-ref', '-d']) if 'refs/tags/' in l):
+    for tag in (l.split() for l in refs if 'refs/tags/' in l):
         tag_name = tag[1][10:]
         if tag_name.endswith('^{}'):
             tag_name = tag[1][10:][:-3]
@@ -265,220 +733,3090 @@ def git_stats(repo_dir):
         if hex_ not in tags:
             tags[hex_] = set()
         tags[hex_].add(tag_name)
+    if head_id in tags and len(tags[head_id]) == 1:
+        return next(iter(tags[head_id]))
 
-    # Determine last commit.
-    git_log = call(['git', '--no-pager', 'log', '-1', '--pretty=%H%n%aN%n%ae%n%cN%n%ce%n%s'])
-    is_detached = call(['git', 'rev-parse', '--symbolic-full-name', '--abbrev-ref', 'HEAD'])[0] == 'HEAD'
-    if is_detached and git_log[0] in tags and len(tags[git_log[0]]) == 1:
-        branch = next(iter(tags[git_log[0]]))
-    elif is_detached and git_log[0] in branches and len(branches[git_log[0]]) == 1:
-        branch = next(iter(branches[git_log[0]]))
-    else:
-        branch = call(['git', 'rev-parse', '--symbolic-full-name', '--abbrev-ref', 'HEAD'])[0]
-
-    # Get metadata.
-    head = dict(
-        id=git_log[0],
-        author_name=git_log[1],
-        author_email=git_log[2],
-        committer_name=git_log[3],
-        committer_email=git_log[4],
-        message=git_log[5],
-    )
+    # Get branches. One commit may be referenced by many branches.
+    branches = dict()  # dict(hex=[branch1, branch2, ...])
+    names = [l.split(' ', 1)[1][11:] for l in heads]
+    reflogs = [runner.start(['git', 'reflog', 'show', n, '--pretty=%H %gs']) for n in names]
+    for branch_name, reflog in zip(names, reflogs):
+        gen = (l.split() for l in runner.result(reflog) or list())
+        for hex_ in (l[0] for l in gen if 'commit' in l[1]):
+            if hex_ not in branches:
+                branches[hex_] = set()
+            branches[hex_].add(branch_name)
+    if head_id in branches and len(branches[head_id]) == 1:
+        return next(iter(branches[head_id]))
+    return abbrev
 
-    return dict(head=head, branch=branch, remotes=remotes)
 
+def changed_files(repo_dir, since):
+    """Lists files changed between the merge base of `since` and HEAD, and the working tree.
 
-def coverage_report(coverage_file, source_root):
-    """Parse coverage file created before this script was executed.
+    Positional arguments:
+    repo_dir -- root directory of the git repository.
+    since -- git ref to compare to (e.g. origin/master), usually the pull request's base branch.
 
-    Looks like the author of Coverage doesn't want us subclassing his classes.
-    http://nedbatchelder.com/blog/201409/how_should_i_distribute_coveragepy_alphas.html
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
 
-    To avoid loading entire project's source code in memory, base64 encoded placeholders are used.
+    Returns:
+    Set of absolute file paths.
+    """
+    base = merge_base(repo_dir, since)
+    try:
+        output = subprocess32.check_output(['git', 'diff', '--name-only', '-z', base], cwd=repo_dir)
+    except subprocess32.CalledProcessError:
+        logging.error('Unable to diff against {0} in {1}.'.format(since, repo_dir))
+        raise RuntimeError('Unable to diff against {0} in {1}.'.format(since, repo_dir))
+    changed = set(os.path.join(repo_dir, p) for p in output.decode('utf-8').split('\0') if p)
+    logging.info('{0} file(s) changed since {1} ({2}).'.format(len(changed), since, base[:7]))
+    return changed
+
+
+def merge_base(repo_dir, since):
+    """Finds the merge base of `since` and HEAD, the commit a pull request's branch forked from.
+
+    Positional arguments:
+    repo_dir -- root directory of the git repository.
+    since -- git ref (e.g. origin/master).
 
     Raises:
     RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
 
+    Returns:
+    Hex SHA of the merge base.
+    """
+    try:
+        return subprocess32.check_output(['git', 'merge-base', since, 'HEAD'], cwd=repo_dir).strip().decode('ascii')
+    except subprocess32.CalledProcessError:
+        logging.error('Unable to find the merge base of {0} and HEAD in {1}.'.format(since, repo_dir))
+        raise RuntimeError('Unable to find the merge base of {0} and HEAD in {1}.'.format(since, repo_dir))
+
+
+def branch_coverage(possible_arcs, executed_arcs):
+    """Converts arcs into the flat "branches" list the API expects: [line, block, branch, hits, line, block, ...].
+
+    One pass groups the possible arcs by the line they start from. Lines with more than one way out are branches, each
+    way out is numbered in order of the line it jumps to, all in block 0.
+
     Positional arguments:
-    coverage_file -- file path to the coverage file.
-    source_root -- absolute path to root directory of the project's source code.
+    possible_arcs -- iterable of (from_line, to_line) tuples that could have been executed. Negative line numbers are
+        entries/exits of code objects.
+    executed_arcs -- iterable of (from_line, to_line) tuples that were executed.
 
     Returns:
-    List of dicts, each dict is one file and each dict holds API compatible coverage data.
+    List of integers, empty if there are no branches.
     """
-    if not coverage_file:
-        logging.error('No coverage file specified.')
-        raise RuntimeError('No coverage file specified.')
-    source_root = source_root.rstrip('/') + '/'
-    source_files = list()
-    logging.debug('Loading coverage file: ' + coverage_file)
-    cov = coverage(data_file=coverage_file)
-    cov.load()
+    executed = set(tuple(a) for a in executed_arcs)
+    exits = dict()  # dict(from_line=[arc1, arc2, ...])
+    for arc in possible_arcs:
+        if arc[0] > 0:
+            exits.setdefault(arc[0], list()).append(tuple(arc))
+    branches = list()
+    for line in sorted(n for n in exits if len(exits[n]) > 1):
+        for number, arc in enumerate(sorted(exits[line])):
+            branches.extend((line, 0, number, 1 if arc in executed else 0))
+    return branches
 
-    for file_path in cov.data.measured_files():
-        logging.debug('Found coverage for: {0}'.format(file_path))
-        if not os.path.isfile(file_path):
-            logging.error('Source file not found: {0}'.format(file_path))
-            raise RuntimeError('Source file not found: {0}'.format(file_path))
-        if not file_path.startswith(source_root):
-            logging.error('Source file path {0} not within source root {1}.'.format(file_path, source_root))
-            raise RuntimeError('Source file path {0} not within source root {1}.'.format(file_path, source_root))
-        with open(file_path, 'rU') as f:
-            logging.debug('Opened {0} for reading.'.format(f.name))
-            file_coverage = [None for _ in f]  # List of Nones, same length as the number of lines in the file.
-        logging.debug('Closed {0}.'.format(f.name))
-        analysis = cov.analysis(file_path)[1:-1]
-        fp_relative = file_path[len(source_root):]
-        file_path = file_path.encode('ascii')
-        fp_placeholder = '' if not os.path.getsize(file_path) else 'PLACEHOLDER_{0}_'.format(b64encode(file_path))
-
-        for i in analysis[0]:
-            file_coverage[i - 1] = 1
-        for i in analysis[1]:
-            file_coverage[i - 1] = 0
-
-        source_files.append(dict(name=fp_relative, source=fp_placeholder, coverage=file_coverage))
 
-    if not source_files:
-        logging.error('No code coverage found.')
-        raise RuntimeError('No code coverage found.')
+def coverage_vector(line_count, covered, missing):
+    """Builds the coverage list of one file: None for irrelevant lines, 1 for covered lines and 0 for missed lines.
 
-    return source_files
+    Positional arguments:
+    line_count -- number of lines in the file.
+    covered -- iterable of line numbers (starting at 1) that were executed.
+    missing -- iterable of line numbers that could have been executed but weren't. Overrides covered.
 
+    Returns:
+    List of None/0/1, line_count long.
+    """
+    file_coverage = [None] * line_count
+    for i in covered:
+        file_coverage[i - 1] = 1
+    for i in missing:
+        file_coverage[i - 1] = 0
+    return file_coverage
 
-def dump_json_to_disk(payload, target_file):
-    """Dumps payload to disk as a JSON. Replaces placeholders with the project's source code.
 
-    Raises:
-    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
-    ValueError -- raised if arguments are invalid. Should never happen, treat it as a bug in caller.
+def coverage_totals(file_coverage):
+    """Counts relevant and covered lines of a coverage list built by coverage_vector().
 
     Positional arguments:
-    payload -- dict of all data to be sent to the API minus the source code. Placeholders are used instead.
-    target_file -- file path to write dumped payload and source code to.
+    file_coverage -- list of None/0/hits.
 
     Returns:
-    Number of bytes the target_file is after dumping all data.
+    Tuple of (relevant, covered) line counts.
     """
-    if not payload or not target_file:
-        raise ValueError('"payload" or "target_file" invalid.')
-    if os.path.exists(target_file):
-        logging.error('File already exists: {0}'.format(target_file))
-        raise RuntimeError('File already exists: {0}'.format(target_file))
-    if not os.path.isdir(os.path.dirname(target_file)):
-        logging.error("Parent directory doesn't exist: {0}".format(os.path.dirname(target_file)))
-        raise RuntimeError("Parent directory doesn't exist: {0}".format(os.path.dirname(target_file)))
+    relevant = len(file_coverage) - file_coverage.count(None)
+    return relevant, relevant - file_coverage.count(0)
+
+
+def count_lines(file_path):
+    """Counts the lines of a source file the same way the API counts them (universal newlines).
+
+    Positional arguments:
+    file_path -- path to the source file.
+
+    Returns:
+    Number of lines.
+    """
+    with open(file_path, 'rU') as f:
+        logging.log(TRACE, 'Opened %s for reading.', f.name)
+        line_count = sum(1 for _ in f)
+    logging.log(TRACE, 'Closed %s.', f.name)
+    return line_count
 
+
+def escape_source(file_path):
+    """Reads a source file and JSON escapes it, without the surrounding double quotes.
+
+    Positional arguments:
+    file_path -- path to the source file.
+
+    Returns:
+    String of the escaped source code.
+    """
     encoder = json.JSONEncoder()
-    payload_string = json.dumps(payload)
-    with open(target_file, 'w') as f_target:
-        logging.debug('Opened {0} for writing.'.format(f_target.name))
-        for segment in _RE_SPLIT.split(payload_string):
-            if not segment:
-                continue
-            if not _RE_SPLIT.match(segment):
-                f_target.write(segment)
-                continue
-            file_path = b64decode(segment[12:-1])
-            with open(file_path, 'rU') as f_source:
-                logging.debug('Opened {0} for reading.'.format(f_source.name))
-                for line in f_source:
-                    f_target.write(encoder.encode(line)[1:-1])
-            logging.debug('Closed {0}.'.format(f_source.name))
-    logging.debug('Closed {0}.'.format(f_target.name))
+    with open(file_path, 'rU') as f:
+        logging.log(TRACE, 'Opened %s for reading.', f.name)
+        escaped = ''.join(encoder.encode(line)[1:-1] for line in f)
+    logging.log(TRACE, 'Closed %s.', f.name)
+    return escaped
 
-    byte_size = os.path.getsize(target_file)
-    logging.info('Wrote {0} bytes to {1}.'.format(byte_size, target_file))
-    return byte_size
 
+def truncate_line(line, max_length):
+    """Cuts a line read in universal newlines mode to max_length characters, keeping its newline.
 
-def select_ci():
-    """Selects the appropriate class and returns it."""
-    if 'CI' in os.environ and 'TRAVIS' in os.environ:
-        ci_class = TravisCI
-    elif 'CI' in os.environ and 'APPVEYOR' in os.environ:
-        ci_class = AppVeyor
-    elif 'CI' in os.environ and 'CIRCLECI' in os.environ:
-        ci_class = CircleCI
-    elif 'CI' in os.environ and 'SEMAPHORE' in os.environ:
-        ci_class = Semaphore
-    elif 'JENKINS_URL' in os.environ:
-        ci_class = JenkinsCI
-    elif 'CI' in os.environ and os.environ.get('CI_NAME') == 'codeship':
-        ci_class = Codeship
-    elif 'bamboo.buildNumber' in os.environ:
-        ci_class = Bamboo
-    else:
-        logging.debug('Did not detect an officially supported CI. Resorting to the generic class.')
-        ci_class = GenericCI
-    return ci_class
+    Positional arguments:
+    line -- string of one line.
+    max_length -- number of characters to keep, None keeps the whole line.
+    """
+    newline = '\n' if line.endswith('\n') else ''
+    if max_length is None or len(line) - len(newline) <= max_length:
+        return line
+    return line[:max_length] + newline
 
 
-def post_to_api(target_file):
-    """POSTs the JSON target_file to the Coveralls API.
+def classify_sample(head, tail):
+    """Classifies a source file by its first and last SAMPLE_SIZE bytes, for scan_source().
+
+    Positional arguments:
+    head -- first bytes of the file.
+    tail -- last bytes of the file, empty if head is the whole file.
+
+    Returns:
+    "binary" if there's a NUL byte, "minified" if a line is longer than MAX_LINE_LENGTH, "generated" if the first
+    2 kB have a marker like "@generated" or "DO NOT EDIT", otherwise None.
+    """
+    if b'\0' in head or b'\0' in tail:
+        return 'binary'
+    if any(len(b) > MAX_LINE_LENGTH and max(map(len, b.splitlines())) > MAX_LINE_LENGTH for b in (head, tail)):
+        return 'minified'
+    if _RE_GENERATED.search(head[:2048]):
+        return 'generated'
+    return None
+
+
+def scan_source(file_path):
+    """Counts a source file's lines and classifies it with classify_sample(), in one pass over the mapped file.
+
+    Lines are counted the way count_lines() counts them (universal newlines: \\n, \\r\\n and \\r). The MD5 digest the
+    API accepts instead of the source code is computed in the same pass, only for classified files.
+
+    Positional arguments:
+    file_path -- path to the source file.
+
+    Returns:
+    Tuple of the number of lines, the class (None for ordinary source code) and the hex MD5 digest (or None).
+    """
+    size = os.path.getsize(file_path)
+    if not size:
+        return 0, None, None
+    with open(file_path, 'rb') as f:
+        logging.log(TRACE, 'Opened %s for reading.', f.name)
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            kind = classify_sample(mapped[:SAMPLE_SIZE], mapped[max(size - SAMPLE_SIZE, SAMPLE_SIZE):])
+            digest = hashlib.md5() if kind else None
+            lines, previous = 0, b''
+            for offset in range(0, size, CHUNK_SIZE):
+                chunk = mapped[offset:offset + CHUNK_SIZE]
+                lines += chunk.count(b'\n') + chunk.count(b'\r') - chunk.count(b'\r\n')
+                if previous == b'\r' and chunk[:1] == b'\n':
+                    lines -= 1  # \r\n split between chunks.
+                previous = chunk[-1:]
+                if digest is not None:
+                    digest.update(chunk)
+            if previous not in (b'\r', b'\n'):
+                lines += 1  # Last line without a newline.
+        finally:
+            mapped.close()
+    logging.log(TRACE, 'Closed %s.', f.name)
+    return lines, kind, digest.hexdigest() if digest is not None else None
+
+
+def placeholder_source(placeholder):
+    """Decodes a placeholder made by source_file_entry().
+
+    Positional arguments:
+    placeholder -- "PLACEHOLDER_" + base64 of the source file's path (and, if its lines are truncated, a NUL byte and
+        the line length) + "_".
+
+    Returns:
+    Tuple of the source file's path (bytes) and the line length to truncate its lines to (None to keep them whole).
+    """
+    file_path, _, max_length = b64decode(placeholder[12:-1]).partition(b'\0')
+    return file_path, int(max_length) if max_length else None
+
+
+class HeavyFilePolicy(object):
+    """Decides what's sent of generated, minified and binary source files (see scan_source()) and counts what it saved.
+
+    Thread safe, one instance is shared by all files of a submission.
+
+    Positional arguments:
+    rules -- dict of class (HEAVY_CLASSES) to action (HEAVY_ACTIONS): "exclude" leaves out the file and its coverage,
+        "digest" sends the MD5 digest of the source code instead of the source code, "truncate" cuts lines to
+        MAX_LINE_LENGTH characters and "keep" sends the file as it is. Classes without a rule are kept.
+    """
+    VERBS = dict(digest='Sent only the digest of', exclude='Excluded', truncate='Truncated lines of')
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.saved = dict()  # dict(action=[files, bytes])
+        self._lock = threading.Lock()
+
+    def action(self, kind):
+        """Returns the action for a return value of classify_sample()."""
+        return self.rules.get(kind, 'keep') if kind else 'keep'
+
+    def count(self, action, nbytes):
+        """Counts one file the action was applied to and the source code bytes (about) it saved."""
+        with self._lock:
+            totals = self.saved.setdefault(action, [0, 0])
+            totals[0] += 1
+            totals[1] += nbytes
+
+    def report(self):
+        """Logs the files each action was applied to and the bytes saved at INFO."""
+        for action in sorted(self.saved):
+            files, nbytes = self.saved[action]
+            logging.info('{0} {1} generated/minified/binary file(s), about {2} bytes of source code saved.'.format(
+                self.VERBS[action], files, nbytes))
+
+
+def read_heavy_rules(rules):
+    """Parses the --heavy option.
 
     Raises:
     RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
 
     Positional arguments:
-    target_file -- JSON string file path to containing dumped payload and source code.
+    rules -- comma separated CLASS=ACTION rules, a bare ACTION applies to every class without a rule of its own.
+
+    Returns:
+    Dict of class to action for HeavyFilePolicy.
+    """
+    result, default = dict(), None
+    for entry in (e.strip() for e in rules.split(',') if e.strip()):
+        kind, _, action = entry.rpartition('=')
+        if action not in HEAVY_ACTIONS or (kind and kind not in HEAVY_CLASSES):
+            logging.error('Invalid heavy file rule, expected [CLASS=]ACTION: {0}'.format(entry))
+            raise RuntimeError('Invalid heavy file rule, expected [CLASS=]ACTION: {0}'.format(entry))
+        if kind:
+            result[kind] = action
+        else:
+            default = action
+    if default is not None:
+        for kind in HEAVY_CLASSES:
+            result.setdefault(kind, default)
+    return result
+
+
+class SourceCache(object):
+    """Thread safe in-memory cache of values computed from source files, used by the serve daemon.
+
+    Values are keyed on the file's path, size and modification time so edited files are read again. Once cached
+    strings add up to more than max_bytes the oldest ones are dropped.
+
+    Keyword arguments:
+    max_bytes -- upper bound of the total length of cached strings.
     """
-    logging.debug('POSTing to: {0}'.format(API_URL))
-    with open(target_file) as f:
-        logging.debug('Opened {0} for reading.'.format(f.name))
-        response = requests.post(API_URL, files={'json_file': f})
-    logging.debug('Closed {0}.'.format(f.name))
-    for attr in ('text', 'elapsed', 'headers', 'status_code', 'url'):
-        logging.debug('response.{0}: {1}'.format(attr, getattr(response, attr)))
-    if not response.ok:
-        logging.error('Got HTTP {0} while POSTing, not good.'.format(response.status_code))
-        raise RuntimeError('Got HTTP {0} while POSTing, not good.'.format(response.status_code))
 
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = dict()
+        self._order = list()
+        self._lock = threading.Lock()
 
-def main():
-    """Main function called upon script execution."""
-    get_dir = lambda d: CWD if d == 'cwd' else os.path.abspath(os.path.expanduser(d))
-
-    # First gather data about the git repo and test coverage.
-    repo_dir = get_dir(OPTIONS.get('--git'))
-    coverage_file = os.path.abspath(os.path.expanduser(OPTIONS.get('--coverage')))
-    source_root = get_dir(OPTIONS.get('--source'))
-    logging.info('Gathering git repo and test coverage data.')
-    git_stats_result = git_stats(repo_dir)
-    try:
-        coverage_result = coverage_report(coverage_file, source_root)
-    except RuntimeError:
-        sys.exit(1)
+    def get(self, function, file_path):
+        """Returns function(file_path), computing it only if the file changed since the last call.
 
-    # Select class and get the payload.
-    ci_class = select_ci()
-    logging.info('Selected class: {0}'.format(ci_class.__name__))
-    try:
-        payload = ci_class.payload(coverage_result=coverage_result, git_stats_result=git_stats_result)
-    except RuntimeError:
-        sys.exit(1)
-    logging.info('Coverage of {0} file(s) found.'.format(len(payload['source_files'])))
-    if payload.get('git'):
-        logging.info('Git branch/tag: {0}'.format(payload['git']['branch']))
+        Positional arguments:
+        function -- count_lines, escape_source or any other function taking one file path.
+        file_path -- path to the source file.
+        """
+        stat = os.stat(file_path)
+        key, stamp = (function.__name__, file_path), (stat.st_size, stat.st_mtime)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = function(file_path)
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (stamp, value)
+            self._order.append(key)
+            self.size += len(value) if isinstance(value, str) else 0
+            while self.size > self.max_bytes and len(self._order) > 1:
+                self._discard(self._order[0])
+        return value
+
+    def _discard(self, key):
+        """Removes one entry, caller holds the lock."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._order.remove(key)
+        self.size -= len(entry[1]) if isinstance(entry[1], str) else 0
+
+
+def source_file_entry(file_path, source_root, covered, missing, branches=None, cache=None, heavy=None):
+    """Builds one element of the source_files list sent to the API.
 
-    # Dump payload to file and merge in actual source code.
-    target_file = os.path.abspath(os.path.expanduser(OPTIONS.get('--output')))
-    try:
-        dump_json_to_disk(payload, target_file)
-    except RuntimeError:
-        sys.exit(1)
+    To avoid loading entire project's source code in memory, base64 encoded placeholders are used.
 
-    # Ok now we just submit it to the API.
-    try:
-        post_to_api(target_file)
-    except RuntimeError:
-        sys.exit(1)
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1). Also if line numbers are
+        beyond the end of the file (coverage data older than the file).
 
-    # Cleanup.
-    if not OPTIONS.get('--no-delete'):
+    Positional arguments:
+    file_path -- absolute path to the measured source file.
+    source_root -- absolute path to root directory of the project's source code, ending with a slash.
+    covered -- iterable of line numbers (starting at 1) that were executed.
+    missing -- iterable of line numbers that could have been executed but weren't.
+
+    Keyword arguments:
+    branches -- return value of branch_coverage(), left out of the dict if empty.
+    cache -- SourceCache to get the line count from instead of reading the file every time.
+    heavy -- HeavyFilePolicy applied to generated, minified and binary files, which scan_source() then classifies
+        while counting lines.
+
+    Returns:
+    Dict with name, source (placeholder, source_digest instead if heavy says so), coverage and (optionally) branches
+    keys. None if heavy excludes the file.
+    """
+    if not os.path.isfile(file_path):
+        logging.error('Source file not found: {0}'.format(file_path))
+        raise RuntimeError('Source file not found: {0}'.format(file_path))
+    if not file_path.startswith(source_root):
+        logging.error('Source file path {0} not within source root {1}.'.format(file_path, source_root))
+        raise RuntimeError('Source file path {0} not within source root {1}.'.format(file_path, source_root))
+    kind, digest = None, None
+    if heavy is None:
+        line_count = cache.get(count_lines, file_path) if cache is not None else count_lines(file_path)
+    else:
+        line_count, kind, digest = cache.get(scan_source, file_path) if cache is not None else scan_source(file_path)
+    action = heavy.action(kind) if heavy is not None else 'keep'
+    size = os.path.getsize(file_path)
+    if action == 'exclude':
+        heavy.count(action, size)
+        logging.log(TRACE, 'Excluded %s file %s.', kind, file_path)
+        return None
+    covered, missing = list(covered), list(missing)
+    bad = next((n for lines in (covered, missing) for n in lines if n < 1 or n > line_count), None)
+    if bad is not None:
+        logging.error('Line {0} of {1} is out of range ({2} lines), stale coverage data?'.format(
+            bad, file_path, line_count))
+        raise RuntimeError('Line {0} of {1} is out of range ({2} lines), stale coverage data?'.format(
+            bad, file_path, line_count))
+    fp_relative = file_path[len(source_root):]
+    file_path = file_path.encode('ascii')
+    fp_placeholder = ''
+    if action == 'truncate':
+        heavy.count(action, max(size - line_count * (MAX_LINE_LENGTH + 1), 0))
+        logging.log(TRACE, 'Truncating lines of %s file %s.', kind, fp_relative)
+        file_path += '\0{0}'.format(MAX_LINE_LENGTH).encode('ascii')
+    if size:
+        fp_placeholder = 'PLACEHOLDER_{0}_'.format(b64encode(file_path).decode('ascii'))
+
+    result = dict(name=fp_relative, source=fp_placeholder, coverage=coverage_vector(line_count, covered, missing))
+    if action == 'digest':
+        heavy.count(action, size)
+        logging.log(TRACE, 'Sending only the digest of %s file %s.', kind, fp_relative)
+        del result['source']
+        result['source_digest'] = digest
+    if branches:
+        result['branches'] = branches
+    return result
+
+
+class SpillList(object):
+    """List of source_file_entry() dicts which moves them to a temporary file once they take too much memory.
+
+    Whenever the entries held in memory are estimated to take more than max_bytes they're all appended to the spill
+    file as records: the length of the entry's JSON as a 4 byte big-endian integer, then the JSON. Spilled records are
+    read back in order through mmap, iter_json() yields their JSON without decoding it so dump_json_to_disk() writes
+    it as-is. The spill file is deleted when the SpillList is garbage collected.
+
+    Positional arguments:
+    max_bytes -- estimated bytes of memory the entries not yet spilled may take.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = list()
+        self.entries_bytes = 0
+        self.spilled = 0
+        self.spill_file = None
+
+    def __len__(self):
+        return self.spilled + len(self.entries)
+
+    def __repr__(self):
+        return '<SpillList of {0} entries, {1} spilled>'.format(len(self), self.spilled)
+
+    def __iter__(self):
+        for record in self._records():
+            yield json.loads(record)
+        for entry in list(self.entries):
+            yield entry
+
+    @staticmethod
+    def entry_bytes(entry):
+        """Estimates the memory one entry takes: 8 bytes per coverage/branches item (pointers to small ints and None,
+        which are shared) plus the strings and the dicts themselves.
+        """
+        items = len(entry['coverage']) + len(entry.get('branches', ()))
+        return 8 * items + len(entry['name']) + len(entry.get('source', '')) + 500
+
+    def append(self, entry):
+        """Adds one entry, then spills all entries held in memory if they take more than max_bytes."""
+        self.entries.append(entry)
+        self.entries_bytes += self.entry_bytes(entry)
+        if self.entries_bytes > self.max_bytes:
+            self.spill()
+
+    def spill(self):
+        """Appends the entries held in memory to the spill file and drops them."""
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile()
+            logging.info('Coverage results take more than {0} bytes of memory, spilling them to disk.'.format(
+                self.max_bytes))
+        self.spill_file.seek(0, os.SEEK_END)
+        for entry in self.entries:
+            record = json.dumps(entry).encode('ascii')
+            self.spill_file.write(struct.pack('>I', len(record)))
+            self.spill_file.write(record)
+        logging.debug('Spilled {0} entries ({1} bytes estimated).'.format(len(self.entries), self.entries_bytes))
+        self.spilled += len(self.entries)
+        self.entries = list()
+        self.entries_bytes = 0
+
+    def _records(self):
+        """Yields the JSON of each spilled entry, in order."""
+        if not self.spilled:
+            return
+        self.spill_file.flush()
+        mapped = mmap.mmap(self.spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            offset = 0
+            for _ in range(self.spilled):
+                length = struct.unpack_from('>I', mapped, offset)[0]
+                yield mapped[offset + 4:offset + 4 + length].decode('ascii')
+                offset += 4 + length
+        finally:
+            mapped.close()
+
+    def iter_json(self):
+        """Yields the JSON (json.dumps() with default separators) of every entry, in order."""
+        for record in self._records():
+            yield record
+        for entry in list(self.entries):
+            yield json.dumps(entry)
+
+
+def payload_json(payload):
+    """Yields json.dumps(payload) in pieces: everything up to the source_files array, one piece per source file (with
+    its leading separator) and the rest. Source files in a SpillList are written without being decoded.
+
+    Positional arguments:
+    payload -- dict of all data to be sent to the API minus the source code. Placeholders are used instead.
+    """
+    if 'source_files' not in payload:
+        yield json.dumps(payload)
+        return
+    head, _, tail = json.dumps(dict(payload, source_files=[])).partition('"source_files": []')
+    yield head + '"source_files": ['
+    source_files = payload['source_files']
+    records = source_files.iter_json() if isinstance(source_files, SpillList) else (json.dumps(f) for f in source_files)
+    for index, record in enumerate(records):
+        yield ', ' + record if index else record
+    yield ']' + tail
+
+
+class FileProgress(object):
+    """Logs progress of a loop over many files at INFO, at most once every `interval` seconds.
+
+    Each message has the files done so far, files/s, MB/s (if bytes were counted) and the estimated time left. Loops
+    shorter than `interval` log nothing at INFO.
+
+    Positional arguments:
+    action -- verb starting each message, e.g. "Analyzed".
+    total -- number of files the loop will go through, None if unknown (no ETA then).
+
+    Keyword arguments:
+    interval -- minimum number of seconds between messages.
+    """
+
+    def __init__(self, action, total, interval=None):
+        self.action = action
+        self.total = total
+        self.interval = PROGRESS_INTERVAL if interval is None else interval
+        self.start = time.time()
+        self.next_report = self.start + self.interval
+        self.files = 0
+        self.bytes = 0
+
+    def update(self, files=1, nbytes=0):
+        """Counts finished files and the bytes they took, logs progress if `interval` seconds passed.
+
+        Keyword arguments:
+        files -- number of files finished.
+        nbytes -- number of bytes read or written for them.
+        """
+        self.files += files
+        self.bytes += nbytes
+        now = time.time()
+        if now < self.next_report:
+            return
+        self.next_report = now + self.interval
+        elapsed = max(now - self.start, 0.001)
+        rate = self.files / elapsed
+        throughput = ', {0:.1f} MB/s'.format(self.bytes / elapsed / 1000000) if self.bytes else ''
+        if self.total is None:
+            logging.info('%s %d files (%.1f files/s%s).', self.action, self.files, rate, throughput)
+            return
+        eta = int((self.total - self.files) / rate) if rate else 0
+        logging.info('%s %d/%d files (%.1f files/s%s, ETA %dm%02ds).', self.action, self.files, self.total, rate,
+                     throughput, eta // 60, eta % 60)
+
+    def iterate(self, iterable):
+        """Yields items of iterable, counting each as one file when the loop body is done with it.
+
+        Positional arguments:
+        iterable -- files (paths or any other per-file item) to loop over.
+        """
+        for item in iterable:
+            yield item
+            self.update()
+        self.finish()
+
+    def finish(self):
+        """Logs the totals at DEBUG."""
+        elapsed = max(time.time() - self.start, 0.001)
+        logging.debug('%s %d files in %.1fs (%.1f files/s).', self.action, self.files, elapsed, self.files / elapsed)
+
+
+class PathRemapper(object):
+    """Rewrites path prefixes of files measured elsewhere (e.g. /app in a container) to where the files are now.
+
+    Rules are kept in a trie of path components and the longest matching prefix wins, so remapping a path costs
+    about its length no matter how many rules there are. Prefixes only match whole components, /app doesn't match
+    /application. Every remapped path is cached in the mapping dict (original path: remapped path).
+
+    Positional arguments:
+    rules -- iterable of (prefix, replacement) tuples.
+    """
+
+    def __init__(self, rules):
+        self.mapping = dict()
+        self._trie = dict()
+        for prefix, replacement in rules:
+            stripped = prefix.lstrip('/\\')
+            node = self._trie.setdefault(prefix[:len(prefix) - len(stripped)], dict())
+            for part in _RE_PATH_PART.findall(stripped):
+                node = node.setdefault(part, dict())
+            node[None] = replacement.rstrip('/\\')
+
+    def remap(self, path):
+        """Returns path with its longest matching prefix replaced, or unchanged if no rule matches."""
+        try:
+            return self.mapping[path]
+        except KeyError:
+            pass
+        stripped = path.lstrip('/\\')
+        offset = len(path) - len(stripped)
+        node, match = self._trie.get(path[:offset]), None
+        if node is not None:
+            if None in node:
+                match = (node[None], 0)  # Root directory rule, the path keeps its leading separator.
+            for part in _RE_PATH_PART.finditer(path, offset):
+                node = node.get(part.group())
+                if node is None:
+                    break
+                if None in node:
+                    match = (node[None], part.end())
+        result = path if match is None else match[0] + path[match[1]:]
+        if result != path:
+            logging.log(TRACE, 'Remapped %s to %s.', path, result)
+        self.mapping[path] = result
+        return result
+
+
+def read_remap_rules(rules):
+    """Parses the --remap option.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    rules -- comma separated FROM=TO rules, or @FILE to read one rule per line (blank lines and # comments ignored).
+
+    Returns:
+    List of (prefix, replacement) tuples for PathRemapper. Replacements are made absolute.
+    """
+    if rules.startswith('@'):
+        try:
+            with open(os.path.expanduser(rules[1:])) as f:
+                entries = [l.strip() for l in f if not l.strip().startswith('#')]
+        except IOError as e:
+            logging.error('Unable to read remap rules: {0}'.format(e))
+            raise RuntimeError('Unable to read remap rules: {0}'.format(e))
+    else:
+        entries = [e.strip() for e in rules.split(',')]
+
+    result = list()
+    for entry in (e for e in entries if e):
+        prefix, _, replacement = entry.partition('=')
+        if not prefix or not replacement:
+            logging.error('Invalid remap rule, expected FROM=TO: {0}'.format(entry))
+            raise RuntimeError('Invalid remap rule, expected FROM=TO: {0}'.format(entry))
+        result.append((prefix, os.path.abspath(os.path.expanduser(replacement))))
+    return result
+
+
+def python_file_reporter(file_path, cov):
+    """Returns coverage's Python file reporter of a source file, what cov.analysis2() parses Python files with.
+
+    Coverage's API has no way to get a file's possible arcs or to analyze data recorded under another path, both need
+    the reporter. Only for files coverage measured itself, files measured by a plugin (CoverageData.file_tracer(),
+    e.g. Django templates) aren't Python and need the plugin's reporter.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr if coverage is older than 4. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    file_path -- path to the source file.
+    cov -- coverage instance providing the configuration (exclude patterns).
+    """
+    try:
+        from coverage.python import PythonFileReporter
+    except ImportError:
+        logging.error('Coverage 4 or later is needed to read this coverage data.')
+        raise RuntimeError('Coverage 4 or later is needed to read this coverage data.')
+    return PythonFileReporter(file_path, cov)
+
+
+def reporter_coverage(file_reporter, executed_lines, executed_arcs=None):
+    """Line (and branch) coverage of one file from coverage's Python file reporter and the lines (arcs) executed.
+
+    Does what cov.analysis() does, for data that isn't keyed on the file's current path or isn't read through the API.
+
+    Positional arguments:
+    file_reporter -- coverage.python.PythonFileReporter of the source file.
+    executed_lines -- iterable of executed line numbers.
+
+    Keyword arguments:
+    executed_arcs -- iterable of executed (from, to) line number tuples. Branches are only returned if given.
+
+    Returns:
+    Tuple of covered and missing line number lists and the return value of branch_coverage() (or None).
+    """
+    statements = file_reporter.lines()
+    missing = statements - file_reporter.translate_lines(executed_lines)
+    branches = None
+    if executed_arcs is not None:
+        branches = branch_coverage(file_reporter.arcs(), file_reporter.translate_arcs(executed_arcs))
+    return sorted(statements - missing), sorted(missing), branches
+
+
+def coverage_report(coverage_file, source_root, only=None, cache=None, remap=None, max_memory=None,
+                    heavy=None):
+    """Parse coverage file created before this script was executed.
+
+    Looks like the author of Coverage doesn't want us subclassing his classes.
+    http://nedbatchelder.com/blog/201409/how_should_i_distribute_coveragepy_alphas.html
+
+    If the coverage file has arc data (coverage run --branch) branch coverage is included too, taken from the same
+    analysis of each file used for line coverage.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    coverage_file -- file path to the coverage file.
+    source_root -- absolute path to root directory of the project's source code.
+
+    Keyword arguments:
+    only -- set of absolute file paths. If given, other measured files are skipped before they're read or analyzed.
+    cache -- SourceCache passed to source_file_entry().
+    remap -- PathRemapper applied to measured file paths before they're checked or filtered by only.
+    max_memory -- passed to analyze_coverage().
+    heavy -- passed to analyze_coverage().
+
+    Returns:
+    List of dicts, each dict is one file and each dict holds API compatible coverage data.
+    """
+    if not coverage_file:
+        logging.error('No coverage file specified.')
+        raise RuntimeError('No coverage file specified.')
+    logging.debug('Loading coverage file: ' + coverage_file)
+    cov = coverage(data_file=coverage_file)
+    cov.load()
+    return analyze_coverage(cov, source_root, only=only, cache=cache, remap=remap, max_memory=max_memory,
+                            heavy=heavy)
+
+
+def analyze_coverage(cov, source_root, only=None, cache=None, remap=None, max_memory=None,
+                     heavy=None):
+    """Analyzes every measured file of a coverage object which already holds data, for coverage_report().
+
+    Also used by the pytest plugin (see coveralls_multi_ci_pytest) on the coverage object pytest-cov measured the tests
+    with, so the data isn't saved and loaded again.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    cov -- coverage instance with loaded or collected data.
+    source_root -- absolute path to root directory of the project's source code.
+
+    Keyword arguments:
+    only -- set of absolute file paths. If given, other measured files are skipped before they're analyzed.
+    cache -- SourceCache passed to source_file_entry().
+    remap -- PathRemapper applied to measured file paths before they're checked or filtered by only.
+    max_memory -- if set, a SpillList keeping about this many bytes of results in memory is returned instead.
+    heavy -- HeavyFilePolicy passed to source_file_entry().
+
+    Returns:
+    List of dicts, each dict is one file and each dict holds API compatible coverage data.
+    """
+    source_root = source_root.rstrip('/') + '/'
+    source_files = SpillList(max_memory) if max_memory else list()
+    data = cov.get_data() if hasattr(cov, 'get_data') else cov.data
+    has_arcs = data.has_arcs()
+
+    measured_files = data.measured_files()
+    for measured_path in FileProgress('Analyzed', len(measured_files)).iterate(measured_files):
+        file_path = remap.remap(measured_path) if remap is not None else measured_path
+        if only is not None and file_path not in only:
+            continue
+        logging.log(TRACE, 'Found coverage for: %s', file_path)
+        if not os.path.isfile(file_path):
+            logging.error('Source file not found: {0}'.format(file_path))
+            raise RuntimeError('Source file not found: {0}'.format(file_path))
+        plugin = data.file_tracer(measured_path) if hasattr(data, 'file_tracer') else None
+        if plugin and file_path != measured_path:
+            logging.warning('Skipping {0}, measured by plugin {1} which can only report it at {2}.'.format(
+                file_path, plugin, measured_path))
+            continue
+        if not plugin and (file_path != measured_path or has_arcs):
+            # One file reporter parses the file for both statements and possible arcs. Also needed when the data is
+            # keyed on the measured path, which cov.analysis2() would try to parse.
+            covered, missing, branches = reporter_coverage(
+                python_file_reporter(file_path, cov), data.lines(measured_path) or (),
+                (data.arcs(measured_path) or ()) if has_arcs else None)
+        else:
+            # Also for files measured by plugins, coverage asks the plugin's reporter. Line coverage only.
+            _, covered, _, missing, _ = cov.analysis2(file_path)  # All statements, missing ones override them.
+            branches = None
+        entry = source_file_entry(file_path, source_root, sorted(covered), sorted(missing), branches=branches,
+                                  cache=cache, heavy=heavy)
+        if entry is not None:
+            source_files.append(entry)
+
+    if not source_files:
+        logging.error('No code coverage found.')
+        raise RuntimeError('No code coverage found.')
+
+    return source_files
+
+
+def json_report(report_file, source_root, only=None, cache=None, remap=None, max_memory=None,
+                heavy=None):
+    """Reads a JSON report written by "coverage json" instead of the raw coverage file.
+
+    No source file is analyzed, executed and missing lines (and branches if the report has them) are taken as-is from
+    the report. Relative paths in the report are relative to source_root. The report is read as a stream by
+    json_report_files(), so only one file's lines are decoded at a time.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    report_file -- file path to the JSON report.
+    source_root -- absolute path to root directory of the project's source code.
+
+    Keyword arguments:
+    only -- set of absolute file paths. If given, other measured files are skipped before they're read or analyzed.
+    cache -- SourceCache passed to source_file_entry().
+    remap -- PathRemapper applied to measured file paths before they're checked or filtered by only.
+    max_memory -- if set, a SpillList keeping about this many bytes of results in memory is returned instead.
+    heavy -- HeavyFilePolicy passed to source_file_entry().
+
+    Returns:
+    List of dicts, each dict is one file and each dict holds API compatible coverage data.
+    """
+    source_root = source_root.rstrip('/') + '/'
+    logging.debug('Loading JSON report: ' + report_file)
+    source_files = SpillList(max_memory) if max_memory else list()
+    try:
+        with open(report_file) as f:
+            for file_name, lines in FileProgress('Read', None).iterate(json_report_files(JSONTokenizer(f))):
+                file_path = os.path.normpath(os.path.join(source_root, file_name))
+                file_path = remap.remap(file_path) if remap is not None else file_path
+                if only is not None and file_path not in only:
+                    continue
+                logging.log(TRACE, 'Found coverage for: %s', file_path)
+                executed_branches = lines.get('executed_branches', ())
+                branches = branch_coverage(list(executed_branches) + lines.get('missing_branches', []),
+                                           executed_branches)
+                entry = source_file_entry(file_path, source_root, lines.get('executed_lines', ()),
+                                          lines.get('missing_lines', ()), branches=branches, cache=cache, heavy=heavy)
+                if entry is not None:
+                    source_files.append(entry)
+    except (IOError, TypeError) as e:
+        logging.error('Unable to read JSON report {0}: {1}'.format(report_file, e))
+        raise RuntimeError('Unable to read JSON report {0}: {1}'.format(report_file, e))
+
+    if not source_files:
+        logging.error('No code coverage found.')
+        raise RuntimeError('No code coverage found.')
+
+    return source_files
+
+
+def json_report_files(tokenizer):
+    """Reads the "files" object of a "coverage json" report one file at a time, for json_report().
+
+    Only the executed/missing lines and branches of each file are decoded, everything else (summaries, contexts,
+    meta, totals) is skipped as it's read.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr on invalid JSON.
+
+    Positional arguments:
+    tokenizer -- JSONTokenizer at the start of the report.
+
+    Returns:
+    Generator of (file name, dict of executed_lines, missing_lines, executed_branches and missing_branches lists found)
+    tuples.
+    """
+    fields = ('executed_branches', 'executed_lines', 'missing_branches', 'missing_lines')
+    tokenizer.expect('{')
+    for key in tokenizer.members():
+        if key != 'files':
+            tokenizer.skip_unchecked()
+            continue
+        tokenizer.expect('{')
+        for file_name in tokenizer.members():
+            lines = dict()
+            tokenizer.expect('{')
+            for field in tokenizer.members():
+                token = tokenizer.next()
+                if field not in fields:
+                    tokenizer.skip_unchecked(token)
+                else:
+                    lines[field] = tokenizer.array() if token == '[' else tokenizer.load(token)
+            yield file_name, lines
+    tokenizer.end()
+
+
+def cobertura_report(report_file, source_root, only=None, cache=None, remap=None, max_memory=None,
+                     heavy=None):
+    """Reads a Cobertura XML report (e.g. written by "coverage xml") instead of the raw coverage file.
+
+    The report is parsed incrementally and each <class> element is cleared once its lines are read, so huge reports
+    don't have to fit in memory. Only line numbers are kept until the end, where each file's entry is built. Class
+    file names are resolved against the report's <source> directories, then source_root.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    report_file -- file path to the XML report.
+    source_root -- absolute path to root directory of the project's source code.
+
+    Keyword arguments:
+    only -- set of absolute file paths. If given, other measured files are skipped before they're read or analyzed.
+    cache -- SourceCache passed to source_file_entry().
+    remap -- PathRemapper applied to measured file paths before they're checked or filtered by only.
+    max_memory -- if set, a SpillList keeping about this many bytes of results in memory is returned instead.
+    heavy -- HeavyFilePolicy passed to source_file_entry().
+
+    Returns:
+    List of dicts, each dict is one file and each dict holds API compatible coverage data.
+    """
+    source_root = source_root.rstrip('/') + '/'
+    logging.debug('Loading Cobertura report: ' + report_file)
+    sources = list()
+    order, hits = list(), dict()  # hits = dict(file_name=dict(line_number=hits))
+    try:
+        for _, elem in ElementTree.iterparse(report_file):
+            if elem.tag == 'source' and elem.text:
+                sources.append(elem.text.strip())
+            elif elem.tag == 'class':
+                file_name = elem.get('filename')
+                if file_name not in hits:
+                    order.append(file_name)
+                    hits[file_name] = dict()
+                for line in elem.findall('lines/line'):
+                    number = int(line.get('number'))
+                    hits[file_name][number] = hits[file_name].get(number, 0) + int(line.get('hits'))
+                elem.clear()
+            elif elem.tag == 'package':
+                elem.clear()
+    except (IOError, SyntaxError, TypeError, ValueError) as e:
+        logging.error('Unable to read Cobertura report {0}: {1}'.format(report_file, e))
+        raise RuntimeError('Unable to read Cobertura report {0}: {1}'.format(report_file, e))
+
+    source_files = SpillList(max_memory) if max_memory else list()
+    for file_name in FileProgress('Read', len(order)).iterate(order):
+        candidates = [os.path.normpath(os.path.join(s, file_name)) for s in sources + [source_root]]
+        if remap is not None:
+            candidates = [remap.remap(c) for c in candidates]
+        file_path = next((c for c in candidates if os.path.isfile(c)), candidates[-1])
+        if only is not None and file_path not in only:
+            continue
+        logging.log(TRACE, 'Found coverage for: %s', file_path)
+        lines = hits[file_name]
+        entry = source_file_entry(file_path, source_root, [n for n, h in lines.items() if h],
+                                  [n for n, h in lines.items() if not h], cache=cache, heavy=heavy)
+        if entry is not None:
+            source_files.append(entry)
+
+    if not source_files:
+        logging.error('No code coverage found.')
+        raise RuntimeError('No code coverage found.')
+
+    return source_files
+
+
+def lcov_report(report_file, source_root, only=None, cache=None, remap=None, max_memory=None, heavy=None):
+    """Reads an LCOV tracefile (.info, written by lcov/geninfo for C and C++, by c8/nyc/istanbul for JavaScript, ...).
+
+    The tracefile is read one line at a time and only hit counts are kept: per file a dict of line numbers (DA records)
+    and one of branches (BRDA records), summed over repeated records of the same file (e.g. one per test name). So
+    memory grows with the number of instrumented lines, not with the tracefile's size. Unlike the other readers, hit
+    counts are sent as they are instead of 1 for covered lines. Relative paths are relative to source_root, files
+    outside of it (e.g. system headers) are skipped.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    report_file -- file path to the LCOV tracefile.
+    source_root -- absolute path to root directory of the project's source code.
+
+    Keyword arguments:
+    only -- set of absolute file paths. If given, other measured files are skipped before they're read or analyzed.
+    cache -- SourceCache passed to source_file_entry().
+    remap -- PathRemapper applied to measured file paths before they're checked or filtered by only.
+    max_memory -- if set, a SpillList keeping about this many bytes of results in memory is returned instead.
+    heavy -- HeavyFilePolicy passed to source_file_entry().
+
+    Returns:
+    List of dicts, each dict is one file and each dict holds API compatible coverage data.
+    """
+    source_root = source_root.rstrip('/') + '/'
+    logging.debug('Loading LCOV tracefile: ' + report_file)
+    order, hits, branch_hits = list(), dict(), dict()  # hits = dict(file_name=dict(line_number=hits))
+    lines = branches = None  # Of the record being read.
+    try:
+        with open(report_file) as f:
+            for record in f:
+                if record.startswith('DA:'):
+                    fields = record[3:].split(',', 2)
+                    number = int(fields[0])
+                    lines[number] = lines.get(number, 0) + int(fields[1])
+                elif record.startswith('BRDA:'):
+                    line, block, branch, taken = record[5:].rstrip().split(',')
+                    key = (int(line), int(block), int(branch))
+                    branches[key] = branches.get(key, 0) + (0 if taken == '-' else int(taken))
+                elif record.startswith('SF:'):
+                    file_name = record[3:].rstrip('\r\n')
+                    if file_name not in hits:
+                        order.append(file_name)
+                        hits[file_name], branch_hits[file_name] = dict(), dict()
+                    lines, branches = hits[file_name], branch_hits[file_name]
+                elif record.startswith('end_of_record'):
+                    lines = branches = None
+    except (AttributeError, IOError, TypeError, ValueError) as e:  # AttributeError/TypeError: DA/BRDA before SF.
+        logging.error('Unable to read LCOV tracefile {0}: {1}'.format(report_file, e))
+        raise RuntimeError('Unable to read LCOV tracefile {0}: {1}'.format(report_file, e))
+
+    source_files = SpillList(max_memory) if max_memory else list()
+    for file_name in FileProgress('Read', len(order)).iterate(order):
+        lines, branches = hits.pop(file_name), branch_hits.pop(file_name)
+        file_path = os.path.normpath(os.path.join(source_root, file_name))
+        file_path = remap.remap(file_path) if remap is not None else file_path
+        if only is not None and file_path not in only:
+            continue
+        if not file_path.startswith(source_root):
+            logging.log(TRACE, 'Skipping %s, not within source root.', file_path)
+            continue
+        logging.log(TRACE, 'Found coverage for: %s', file_path)
+        entry = source_file_entry(file_path, source_root, [n for n, h in lines.items() if h],
+                                  [n for n, h in lines.items() if not h],
+                                  branches=[i for k in sorted(branches) for i in k + (branches[k],)], cache=cache,
+                                  heavy=heavy)
+        if entry is not None:
+            for number, count in lines.items():
+                if count > 1:
+                    entry['coverage'][number - 1] = count
+            source_files.append(entry)
+
+    if not source_files:
+        logging.error('No code coverage found.')
+        raise RuntimeError('No code coverage found.')
+
+    return source_files
+
+
+def merge_entries(entry, other):
+    """Merges two source_files entries of the same file by summing their hits.
+
+    Positional arguments:
+    entry -- return value of source_file_entry(). Its source (or source_digest) is kept.
+    other -- return value of source_file_entry() for the same file, e.g. from another language's coverage tool.
+
+    Returns:
+    New dict, coverage and branches are summed line by line and branch by branch.
+    """
+    first, second = entry['coverage'], other['coverage']
+    if len(first) != len(second):
+        length = max(len(first), len(second))
+        first, second = first + [None] * (length - len(first)), second + [None] * (length - len(second))
+    coverage = [a if b is None else b if a is None else a + b for a, b in zip(first, second)]
+    merged = dict(entry, coverage=coverage)
+    branches = dict()
+    for flat in (entry.get('branches', ()), other.get('branches', ())):
+        for i in range(0, len(flat), 4):
+            key = tuple(flat[i:i + 3])
+            branches[key] = branches.get(key, 0) + flat[i + 3]
+    if branches:
+        merged['branches'] = [i for k in sorted(branches) for i in k + (branches[k],)]
+    return merged
+
+
+def merge_source_files(source_files, others, max_memory=None):
+    """Merges the coverage of two readers (e.g. coverage_report() and lcov_report()) into one source_files list.
+
+    Files in both are merged with merge_entries(). Only those are held in memory, everything else is streamed from
+    both lists (which may be SpillLists) into the result.
+
+    Positional arguments:
+    source_files -- list of source_file_entry() dicts.
+    others -- list of source_file_entry() dicts, files not in source_files are appended after them.
+
+    Keyword arguments:
+    max_memory -- if set, a SpillList keeping about this many bytes of results in memory is returned instead.
+
+    Returns:
+    List of dicts, each dict is one file and each dict holds API compatible coverage data.
+    """
+    names = set(f['name'] for f in source_files)
+    overlapping = dict((f['name'], f) for f in others if f['name'] in names)
+    logging.debug('Merging coverage of {0} file(s) measured twice.'.format(len(overlapping)))
+    merged = SpillList(max_memory) if max_memory else list()
+    for entry in source_files:
+        merged.append(merge_entries(entry, overlapping[entry['name']]) if entry['name'] in overlapping else entry)
+    for entry in others:
+        if entry['name'] not in names:
+            merged.append(entry)
+    return merged
+
+
+def read_coverage(coverage_file, source_root, only=None, cache=None, remap=None, max_memory=None, heavy=None):
+    """Reads coverage data with coverage_report(), or json_report()/cobertura_report()/lcov_report() by extension.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    coverage_file -- file path to the coverage file, or to a .json/.xml report or .info LCOV tracefile.
+    source_root -- absolute path to root directory of the project's source code.
+
+    Keyword arguments:
+    only -- passed to the function doing the reading.
+    cache -- passed to the function doing the reading.
+    remap -- passed to the function doing the reading.
+    max_memory -- passed to the function doing the reading.
+    heavy -- passed to the function doing the reading.
+
+    Returns:
+    List of dicts, each dict is one file and each dict holds API compatible coverage data.
+    """
+    extension = os.path.splitext(coverage_file or '')[1].lower()
+    keywords = dict(only=only, cache=cache, remap=remap, max_memory=max_memory, heavy=heavy)
+    if extension == '.json':
+        return json_report(coverage_file, source_root, **keywords)
+    if extension == '.xml':
+        return cobertura_report(coverage_file, source_root, **keywords)
+    if extension == '.info':
+        return lcov_report(coverage_file, source_root, **keywords)
+    return coverage_report(coverage_file, source_root, **keywords)
+
+
+def dump_json_to_disk(payload, target_file, cache=None):
+    """Dumps payload to disk as a JSON. Replaces placeholders with the project's source code.
+
+    The JSON is written one source file at a time (see payload_json()), payload's source_files may be a SpillList.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+    ValueError -- raised if arguments are invalid. Should never happen, treat it as a bug in caller.
+
+    Positional arguments:
+    payload -- dict of all data to be sent to the API minus the source code. Placeholders are used instead.
+    target_file -- file path to write dumped payload and source code to.
+
+    Keyword arguments:
+    cache -- SourceCache to get escaped source code from. Without it source files are streamed line by line.
+
+    Returns:
+    Number of bytes the target_file is after dumping all data.
+    """
+    if not payload or not target_file:
+        raise ValueError('"payload" or "target_file" invalid.')
+    if os.path.exists(target_file):
+        logging.error('File already exists: {0}'.format(target_file))
+        raise RuntimeError('File already exists: {0}'.format(target_file))
+    if not os.path.isdir(os.path.dirname(target_file)):
+        logging.error("Parent directory doesn't exist: {0}".format(os.path.dirname(target_file)))
+        raise RuntimeError("Parent directory doesn't exist: {0}".format(os.path.dirname(target_file)))
+
+    encoder = json.JSONEncoder()
+    total = len(payload.get('source_files', ()))
+    progress = FileProgress('Wrote source code of', total)
+    with open(target_file, 'w') as f_target:
+        logging.debug('Opened {0} for writing.'.format(f_target.name))
+        for index, piece in enumerate(payload_json(payload)):  # Head, one piece per source file, tail.
+            nbytes = 0
+            for segment in _RE_SPLIT.split(piece):
+                if not _RE_SPLIT.match(segment):
+                    f_target.write(segment)
+                    continue
+                file_path, max_length = placeholder_source(segment)
+                if cache is not None and max_length is None:
+                    escaped = cache.get(escape_source, file_path.decode('ascii'))
+                    nbytes += len(escaped)
+                    f_target.write(escaped)
+                    continue
+                with open(file_path, 'rU') as f_source:
+                    logging.log(TRACE, 'Opened %s for reading.', f_source.name)
+                    for line in f_source:
+                        escaped = encoder.encode(truncate_line(line, max_length))[1:-1]
+                        nbytes += len(escaped)
+                        f_target.write(escaped)
+                logging.log(TRACE, 'Closed %s.', f_source.name)
+            if 0 < index <= total:
+                progress.update(nbytes=nbytes)
+    progress.finish()
+    logging.debug('Closed {0}.'.format(f_target.name))
+
+    byte_size = os.path.getsize(target_file)
+    logging.info('Wrote {0} bytes to {1}.'.format(byte_size, target_file))
+    return byte_size
+
+
+def payload_stats(payload):
+    """Measures what dump_json_to_disk() would write without writing anything.
+
+    Reads each source file the same way dump_json_to_disk() does and escapes it to count the bytes it contributes to
+    the payload.
+
+    Positional arguments:
+    payload -- dict of all data to be sent to the API minus the source code. Placeholders are used instead.
+
+    Returns:
+    Dict with "files" (list of dicts with name, source_bytes, escaped_bytes, lines, relevant and covered keys) and
+    "payload_bytes" (exact size of the payload file dump_json_to_disk() would write).
+    """
+    encoder = json.JSONEncoder()
+    files = list()
+    payload_bytes = sum(len(piece) for piece in payload_json(payload))
+    for source_file in payload['source_files']:
+        placeholder = source_file.get('source')
+        stats = dict(name=source_file['name'], source_bytes=0, escaped_bytes=0, lines=0)
+        if placeholder:
+            file_path, max_length = placeholder_source(placeholder)
+            stats['source_bytes'] = os.path.getsize(file_path)
+            with open(file_path, 'rU') as f_source:
+                for line in f_source:
+                    stats['escaped_bytes'] += len(encoder.encode(truncate_line(line, max_length))) - 2
+                    stats['lines'] += 1
+            payload_bytes += stats['escaped_bytes'] - len(encoder.encode(placeholder)) + 2
+        stats['relevant'], stats['covered'] = coverage_totals(source_file['coverage'])
+        files.append(stats)
+    return dict(files=files, payload_bytes=payload_bytes)
+
+
+def log_payload_stats(stats, top=10, bandwidth=10.0):
+    """Logs the return value of payload_stats() at INFO.
+
+    Positional arguments:
+    stats -- return value of payload_stats().
+
+    Keyword arguments:
+    top -- list this many files contributing the most bytes.
+    bandwidth -- upload bandwidth in megabits per second, used to estimate upload time.
+    """
+    files = stats['files']
+    total = lambda k: sum(f[k] for f in files)
+    relevant, covered = total('relevant'), total('covered')
+    logging.info('{0} file(s), {1} lines, {2} bytes of source code ({3} bytes escaped).'.format(
+        len(files), total('lines'), total('source_bytes'), total('escaped_bytes')))
+    logging.info('{0} of {1} relevant lines covered ({2:.2f}%).'.format(
+        covered, relevant, 100.0 * covered / relevant if relevant else 100.0))
+    seconds = stats['payload_bytes'] * 8 / (bandwidth * 1000 * 1000)
+    logging.info('Payload would be {0} bytes, about {1:.1f}s to upload at {2} Mbit/s.'.format(
+        stats['payload_bytes'], seconds, bandwidth))
+    if not top:
+        return
+    logging.info('Largest {0} file(s):'.format(min(top, len(files))))
+    for stats_file in sorted(files, key=lambda f: f['escaped_bytes'], reverse=True)[:top]:
+        logging.info('{0:>12} bytes {1:>7} lines {2:>6}/{3:<6} covered  {4}'.format(
+            stats_file['escaped_bytes'], stats_file['lines'], stats_file['covered'], stats_file['relevant'],
+            stats_file['name']))
+
+
+def backslashes_before(text, start, end):
+    """Counts the backslashes right before text[end], not looking before text[start]."""
+    position = end
+    while position > start and text[position - 1] == '\\':
+        position -= 1
+    return end - position
+
+
+class JSONTokenizer(object):
+    """Reads a JSON file token by token in chunks, so memory use doesn't depend on the size of the file.
+
+    Strings are read with string() (keys and other short strings) or string_stats() (source code), which counts a
+    string's length and newlines without holding it. Arrays of numbers are counted by literal_counts().
+
+    Raises:
+    RuntimeError -- raised after logging to stderr on invalid JSON. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    f -- file object opened for reading.
+
+    Keyword arguments:
+    chunk_size -- number of bytes read at a time.
+    """
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.offset = 0  # Of buffer[0] in the file.
+        self.value = None
+
+    def _fill(self):
+        """Drops the consumed part of the buffer and appends the next chunk. Returns False at the end of the file."""
+        chunk = self.f.read(self.chunk_size)
+        self.offset += self.pos
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return bool(chunk)
+
+    def error(self, message):
+        """Logs and raises an error about the current position."""
+        message = '{0} at byte {1} of {2}.'.format(message, self.offset + self.pos, getattr(self.f, 'name', 'file'))
+        logging.error(message)
+        raise RuntimeError(message)
+
+    def peek(self):
+        """Returns the next non-whitespace character without consuming it, empty string at the end of the file."""
+        while True:
+            self.pos = _RE_WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def next(self):
+        """Consumes the next token.
+
+        Returns:
+        One of {}[]:, for punctuation, " for the start of a string (read it next with string() or string_stats()) or
+        "literal" for a number, true, false or null (its value is in self.value).
+        """
+        char = self.peek()
+        if not char:
+            self.error('Unexpected end of file')
+        if char in '{}[]:,"':
+            self.pos += 1
+            return char
+        while not _RE_LITERAL_END.search(self.buffer, self.pos) and self._fill():
+            pass  # The literal may continue in the next chunk.
+        match = _RE_LITERAL.match(self.buffer, self.pos)
+        if not match:
+            self.error('Unexpected character {0!r}'.format(char))
+        self.value = json.loads(match.group())
+        self.pos = match.end()
+        return 'literal'
+
+    def expect(self, token):
+        """Consumes the next token, which must be `token`."""
+        if self.next() != token:
+            self.error('Expected {0!r}'.format(token))
+
+    def end(self):
+        """Checks there's nothing but whitespace left."""
+        if self.peek():
+            self.error('Extra data')
+
+    def members(self):
+        """Yields the keys of an object whose { was just read. The caller reads each value before the next key."""
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            self.expect('"')
+            key = self.string()
+            self.expect(':')
+            yield key
+            token = self.next()
+            if token == '}':
+                return
+            if token != ',':
+                self.error("Expected ',' or '}'")
+
+    def elements(self):
+        """Yields once per element of an array whose [ was just read. The caller reads the element each time."""
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            token = self.next()
+            if token == ']':
+                return
+            if token != ',':
+                self.error("Expected ',' or ']'")
+
+    def string(self, limit=65536):
+        """Reads and decodes the rest of a string whose opening quote was just read.
+
+        Keyword arguments:
+        limit -- longest string (escaped) accepted.
+        """
+        value, length = self.string_stats(keep=limit)[:2]
+        if length > limit:
+            self.error('String longer than {0} bytes'.format(limit))
+        return value
+
+    def string_stats(self, keep=0):
+        """Reads the rest of a string whose opening quote was just read, holding at most one chunk of it.
+
+        Keyword arguments:
+        keep -- decode and return strings up to this many escaped characters long.
+
+        Returns:
+        Tuple of the decoded string (None if longer than keep), its escaped length, the number of newlines in it and
+        whether it ends with one.
+        """
+        kept = list()
+        length = newlines = 0
+        ends_with_newline = False
+        while True:
+            end = self.buffer.find('"', self.pos)
+            while end != -1 and backslashes_before(self.buffer, self.pos, end) % 2:
+                end = self.buffer.find('"', end + 1)  # Escaped quote.
+            if end == -1:
+                end = len(self.buffer)
+                end -= backslashes_before(self.buffer, self.pos, end) % 2  # Escape sequence continues in next chunk.
+            piece = self.buffer[self.pos:end]
+            unpaired = piece.replace('\\\\', '')  # Escaped backslashes can't start another escape sequence.
+            if piece:
+                length += len(piece)
+                newlines += unpaired.count('\\n')
+                ends_with_newline = piece.endswith('\\n') and unpaired.endswith('\\n')
+                if length <= keep:
+                    kept.append(piece)
+            self.pos = end
+            if end < len(self.buffer) and self.buffer[end] == '"':
+                self.pos += 1
+                break
+            if not self._fill():  # Stopped at the end of the buffer or before a backslash ending it.
+                self.error('Unterminated string')
+        value = None
+        if length <= keep:
+            try:
+                value = json.loads('"' + ''.join(kept) + '"')
+            except ValueError as e:
+                self.error('Invalid string ({0})'.format(e))
+        return value, length, newlines, ends_with_newline
+
+    def literal_counts(self):
+        """Reads the rest of an array of literals whose [ was just read, without building a list of them.
+
+        Returns:
+        Dict of how often each literal (as written, e.g. "null", "0" or "3") occurs in the array.
+        """
+        raw = dict()
+        while True:
+            end = self.buffer.find(']', self.pos)
+            stop = end if end != -1 else self.buffer.rfind(',', self.pos)
+            if stop == -1:
+                if not self._fill():
+                    self.error('Unterminated array')
+                continue
+            text = self.buffer[self.pos:stop]
+            self.pos = stop + 1
+            if end != -1 and not raw and not text.strip(' \t\n\r'):
+                break  # Empty array.
+            literals = text.split(',')
+            distinct = set(literals)
+            if len(distinct) <= 16:  # Usually null, 0 and 1: counting each in C beats a Python loop.
+                for literal in distinct:
+                    raw[literal] = raw.get(literal, 0) + literals.count(literal)
+            else:
+                for literal in literals:
+                    raw[literal] = raw.get(literal, 0) + 1
+            if end != -1:
+                break
+        counts = dict()
+        for literal, count in raw.items():
+            literal = literal.strip(' \t\n\r')
+            match = _RE_LITERAL.match(literal)
+            if not match or match.end() != len(literal):
+                self.error('Expected an array of literals, found {0!r}'.format(literal[:20]))
+            counts[literal] = counts.get(literal, 0) + count
+        return counts
+
+    def array(self):
+        """Reads the rest of an array of literals (or of arrays of them) whose [ was just read and decodes it at once.
+
+        Much faster than load() for the long arrays of line numbers in coverage reports, the array is only scanned
+        for brackets in C and then decoded with one json.loads() call.
+
+        Returns:
+        List.
+        """
+        depth, scanned = 1, 0  # Characters after self.pos already scanned.
+        while True:
+            for match in _RE_BRACKET.finditer(self.buffer, self.pos + scanned):
+                if match.group() not in '[]':
+                    self.error('Expected an array of literals')
+                depth += 1 if match.group() == '[' else -1
+                if not depth:
+                    try:
+                        value = json.loads('[' + self.buffer[self.pos:match.end()])
+                    except ValueError as e:
+                        self.error('Invalid array ({0})'.format(e))
+                    self.pos = match.end()
+                    return value
+            scanned = len(self.buffer) - self.pos
+            if not self._fill():
+                self.error('Unterminated array')
+
+    def skip_unchecked(self, token=None):
+        """Like skip(), but only matches brackets and jumps over strings (all in C) instead of reading every token.
+
+        Much faster for large values with many short strings (e.g. contexts in coverage reports). Values inside aren't
+        validated and each string must fit into memory.
+
+        Keyword arguments:
+        token -- the value's first token if it was read already.
+        """
+        token = token or self.next()
+        if token not in ('{', '['):
+            self.skip(token)
+            return
+        depth, scanned = 1, 0  # Characters after self.pos already scanned.
+        while True:
+            for match in _RE_SKIP.finditer(self.buffer, self.pos + scanned):
+                char = match.group()
+                if char == '"':  # String continues in the next chunk, scan it again from its start.
+                    scanned = match.start() - self.pos
+                    break
+                if char[0] == '"':
+                    continue
+                depth += 1 if char in '[{' else -1
+                if not depth:
+                    self.pos = match.end()
+                    return
+            else:
+                scanned = len(self.buffer) - self.pos
+            if not self._fill():
+                self.error('Unterminated {0}'.format('object' if token == '{' else 'array'))
+
+    def load(self, token=None):
+        """Reads a whole value and returns it decoded like json.load() would. Only meant for small values.
+
+        Keyword arguments:
+        token -- the value's first token if it was read already.
+        """
+        token = token or self.next()
+        if token == '{':
+            return dict((key, self.load()) for key in self.members())
+        if token == '[':
+            return list(self.load() for _ in self.elements())
+        if token == '"':
+            return self.string()
+        if token != 'literal':
+            self.error('Unexpected {0!r}'.format(token))
+        return self.value
+
+    def skip(self, token=None):
+        """Reads a whole value and ignores it.
+
+        Keyword arguments:
+        token -- the value's first token if it was read already.
+        """
+        token = token or self.next()
+        if token == '{':
+            for _ in self.members():
+                self.skip()
+        elif token == '[':
+            for _ in self.elements():
+                self.skip()
+        elif token == '"':
+            self.string_stats()
+        elif token != 'literal':
+            self.error('Unexpected {0!r}'.format(token))
+
+
+def inspect_source_file(tokenizer):
+    """Reads one entry of a payload's source_files array with a JSONTokenizer and checks it.
+
+    Positional arguments:
+    tokenizer -- JSONTokenizer positioned before the entry.
+
+    Returns:
+    Dict with name, escaped_bytes, lines, coverage (length of the coverage array), relevant, covered and branches
+    (number of branch entries) keys and a list of problems found.
+    """
+    entry = dict(name=None, escaped_bytes=0, lines=0, coverage=0, relevant=0, covered=0, branches=0, problems=list())
+    seen = set()
+    tokenizer.expect('{')
+    for key in tokenizer.members():
+        seen.add(key)
+        token = tokenizer.next()
+        if key == 'name' and token == '"':
+            entry['name'] = tokenizer.string()
+        elif key == 'source' and token == '"':
+            _, length, newlines, ends_with_newline = tokenizer.string_stats()
+            entry['escaped_bytes'] = length
+            entry['lines'] = newlines + (1 if length and not ends_with_newline else 0)
+        elif key in ('coverage', 'branches') and token == '[':
+            counts = tokenizer.literal_counts()
+            if any(v != 'null' and not v.isdigit() for v in counts) or (key == 'branches' and 'null' in counts):
+                entry['problems'].append('{0} holds values other than {1}.'.format(
+                    key, 'null or line hits' if key == 'coverage' else 'integers'))
+            entry[key] = sum(counts.values())
+            if key == 'coverage':
+                entry['relevant'] = entry['coverage'] - counts.get('null', 0)
+                entry['covered'] = entry['relevant'] - counts.get('0', 0)
+        else:
+            tokenizer.skip(token)
+            if key in ('name', 'source', 'coverage', 'branches'):
+                entry['problems'].append('{0} has the wrong type.'.format(key))
+    for key in ('name', 'source', 'coverage'):
+        if key not in seen and not (key == 'source' and 'source_digest' in seen):
+            entry['problems'].append('{0} is missing.'.format(key))
+    if entry['branches'] % 4:
+        entry['problems'].append('branches length {0} is not a multiple of 4.'.format(entry['branches']))
+    if 'source' in seen and entry['coverage'] != entry['lines']:
+        entry['problems'].append('{0} coverage entries for {1} lines.'.format(entry['coverage'], entry['lines']))
+    return entry
+
+
+def inspect_payload(target_file, report=None, chunk_size=CHUNK_SIZE):
+    """Validates a payload file written by dump_json_to_disk() and totals it, reading it as a stream.
+
+    Memory use is bounded by chunk_size, not by the size of the file or of any source file in it.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr if the file is missing or isn't valid JSON.
+
+    Positional arguments:
+    target_file -- JSON string file path to containing dumped payload and source code.
+
+    Keyword arguments:
+    report -- called with each return value of inspect_source_file(), in file order.
+    chunk_size -- number of bytes read at a time.
+
+    Returns:
+    Dict with the top level keys of the payload (keys), the number of source files (files), the sums of the
+    inspect_source_file() counts and the number of files with problems (problems).
+    """
+    totals = dict(keys=list(), files=0, escaped_bytes=0, lines=0, relevant=0, covered=0, problems=0)
+    try:
+        f = open(target_file)
+    except IOError as e:
+        logging.error('Unable to read payload {0}: {1}'.format(target_file, e))
+        raise RuntimeError('Unable to read payload {0}: {1}'.format(target_file, e))
+    with f:
+        tokenizer = JSONTokenizer(f, chunk_size=chunk_size)
+        tokenizer.expect('{')
+        for key in tokenizer.members():
+            totals['keys'].append(key)
+            if key != 'source_files':
+                tokenizer.skip()
+                continue
+            tokenizer.expect('[')
+            for _ in tokenizer.elements():
+                entry = inspect_source_file(tokenizer)
+                totals['files'] += 1
+                totals['problems'] += 1 if entry['problems'] else 0
+                for k in ('escaped_bytes', 'lines', 'relevant', 'covered'):
+                    totals[k] += entry[k]
+                if report is not None:
+                    report(entry)
+        tokenizer.end()
+    if 'source_files' not in totals['keys']:
+        logging.error('No source_files in payload {0}.'.format(target_file))
+        raise RuntimeError('No source_files in payload {0}.'.format(target_file))
+    return totals
+
+
+def payload_intact(target_file):
+    """Checks a payload file left by an interrupted upload with inspect_payload() before it's uploaded again.
+
+    Deletes the file if it's damaged (e.g. truncated by a full disk) so dump_json_to_disk() can write it again.
+
+    Positional arguments:
+    target_file -- JSON string file path to containing dumped payload and source code.
+
+    Returns:
+    True if the file can be uploaded as is.
+    """
+    try:
+        problems = inspect_payload(target_file)['problems']
+    except RuntimeError:
+        problems = 1
+    if not problems:
+        return True
+    logging.warning('{0} from an interrupted upload is damaged, writing it again.'.format(target_file))
+    os.remove(target_file)
+    return False
+
+
+def log_inspected_file(entry):
+    """Logs one return value of inspect_source_file(): its counts at INFO and problems at WARNING.
+
+    Positional arguments:
+    entry -- return value of inspect_source_file().
+    """
+    logging.info('{0:>12} bytes {1:>7} lines {2:>6}/{3:<6} covered  {4}'.format(
+        entry['escaped_bytes'], entry['lines'], entry['covered'], entry['relevant'], entry['name']))
+    for problem in entry['problems']:
+        logging.warning('{0}: {1}'.format(entry['name'], problem))
+
+
+def select_ci(environ=None):
+    """Selects the appropriate class for an environment and returns it bound to it, see Base.from_environ().
+
+    Keyword arguments:
+    environ -- mapping of environment variables, defaults to os.environ.
+
+    Returns:
+    Subclass of the selected CI class.
+    """
+    environ = os.environ if environ is None else environ
+    if 'CI' in environ and 'TRAVIS' in environ:
+        ci_class = TravisCI
+    elif 'CI' in environ and 'APPVEYOR' in environ:
+        ci_class = AppVeyor
+    elif 'CI' in environ and 'CIRCLECI' in environ:
+        ci_class = CircleCI
+    elif 'CI' in environ and 'SEMAPHORE' in environ:
+        ci_class = Semaphore
+    elif 'JENKINS_URL' in environ:
+        ci_class = JenkinsCI
+    elif 'CI' in environ and environ.get('CI_NAME') == 'codeship':
+        ci_class = Codeship
+    elif 'bamboo.buildNumber' in environ:
+        ci_class = Bamboo
+    else:
+        logging.debug('Did not detect an officially supported CI. Resorting to the generic class.')
+        ci_class = GenericCI
+    return ci_class.from_environ(environ)
+
+
+class MultipartUpload(object):
+    """Streams the payload file as a multipart/form-data request body in fixed-size chunks.
+
+    The body is byte-for-byte what requests would generate for files={'json_file': f}, but it's never held in memory.
+    Since it has a length requests sends it with a Content-Length header instead of chunked transfer encoding.
+
+    Positional arguments:
+    target_file -- JSON string file path to containing dumped payload and source code.
+    boundary -- multipart boundary string. Also identifies the upload when resuming.
+
+    Keyword arguments:
+    chunk_size -- number of bytes read from target_file at a time.
+    offset -- skip this many bytes of the body (they were received by the API during a previous attempt).
+    progress -- callable invoked with (bytes_sent, bytes_total) after each chunk.
+    """
+
+    def __init__(self, target_file, boundary, chunk_size=CHUNK_SIZE, offset=0, progress=None):
+        self.target_file = target_file
+        self.boundary = boundary
+        self.chunk_size = chunk_size
+        self.offset = offset
+        self.progress = progress
+        self.head = '--{0}\r\nContent-Disposition: form-data; name="json_file"; filename="{1}"\r\n\r\n'.format(
+            boundary, os.path.basename(target_file)).encode('ascii')
+        self.tail = '\r\n--{0}--\r\n'.format(boundary).encode('ascii')
+        self.file_size = os.path.getsize(target_file)
+        self.total = len(self.head) + self.file_size + len(self.tail)
+        self.sent = offset
+
+    @property
+    def content_type(self):
+        """Value of the Content-Type header for this body."""
+        return 'multipart/form-data; boundary={0}'.format(self.boundary)
+
+    def __len__(self):
+        return self.total - self.offset
+
+    def __iter__(self):
+        offset = self.offset
+        if offset < len(self.head):
+            yield self._count(self.head[offset:])
+        offset = max(offset - len(self.head), 0)
+        if offset < self.file_size:
+            with open(self.target_file, 'rb') as f:
+                f.seek(offset)
+                for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                    yield self._count(chunk)
+        offset = max(offset - self.file_size, 0)
+        yield self._count(self.tail[offset:])
+
+    def _count(self, chunk):
+        """Keeps track of bytes sent and reports progress."""
+        self.sent += len(chunk)
+        if self.progress:
+            self.progress(self.sent, self.total)
+        return chunk
+
+
+class UploadProgress(object):
+    """Logs upload progress and throughput at INFO every `step` percent.
+
+    Keyword arguments:
+    step -- log every this many percent.
+    """
+
+    def __init__(self, step=10):
+        self.step = step
+        self.start = time.time()
+        self.next_percent = step
+
+    def __call__(self, sent, total):
+        percent = 100 * sent // total
+        if percent < self.next_percent:
+            return
+        self.next_percent = percent - percent % self.step + self.step
+        rate = sent / max(time.time() - self.start, 0.001) / 1024
+        logging.info('Uploaded {0}% ({1}/{2} bytes, {3:.1f} KiB/s).'.format(percent, sent, total, rate))
+
+
+def read_checkpoint(target_file):
+    """Reads the upload checkpoint next to target_file if it still describes target_file.
+
+    A checkpoint is written when an upload is interrupted and is removed after the API accepts the upload. It records
+    the multipart boundary (the body must be identical to resume it), the bytes sent and target_file's size and mtime.
+
+    Positional arguments:
+    target_file -- JSON string file path to containing dumped payload and source code.
+
+    Returns:
+    Checkpoint dict, or None if there isn't one or it's stale.
+    """
+    checkpoint_file = target_file + CHECKPOINT_SUFFIX
+    if not os.path.isfile(checkpoint_file) or not os.path.isfile(target_file):
+        return None
+    try:
+        with open(checkpoint_file) as f:
+            checkpoint = json.load(f)
+    except ValueError:
+        logging.warning('Ignoring corrupt checkpoint: {0}'.format(checkpoint_file))
+        return None
+    stat = os.stat(target_file)
+    if checkpoint.get('size') != stat.st_size or checkpoint.get('mtime') != int(stat.st_mtime):
+        logging.info('Ignoring checkpoint {0}, {1} changed since.'.format(checkpoint_file, target_file))
+        return None
+    return checkpoint
+
+
+def write_checkpoint(target_file, boundary, sent):
+    """Records an interrupted upload next to target_file.
+
+    Positional arguments:
+    target_file -- JSON string file path to containing dumped payload and source code.
+    boundary -- multipart boundary string of the upload.
+    sent -- bytes of the body sent before the upload was interrupted. Informational, the API decides where to resume.
+    """
+    stat = os.stat(target_file)
+    with open(target_file + CHECKPOINT_SUFFIX, 'w') as f:
+        json.dump(dict(boundary=boundary, size=stat.st_size, mtime=int(stat.st_mtime), sent=sent), f)
+
+
+def query_offset(session, body, api_url=None):
+    """Asks the API how much of a previously interrupted upload it has.
+
+    Uses the same convention as resumable upload APIs: an empty request with "Content-Range: bytes */TOTAL" is
+    answered with HTTP 308 and a "Range: bytes=0-LAST" header. Coveralls itself doesn't support this and would take
+    the request for a job, so post_to_api() only asks with resumable=True. Any other answer starts the upload over.
+
+    Positional arguments:
+    session -- requests.Session instance.
+    body -- MultipartUpload instance with offset 0.
+
+    Keyword arguments:
+    api_url -- URL to POST to, defaults to API_URL.
+
+    Returns:
+    Number of bytes to skip when resuming, 0 if the upload can't be resumed.
+    """
+    headers = {'Content-Type': body.content_type, 'Content-Range': 'bytes */{0}'.format(body.total)}
+    try:
+        response = session.post(api_url or API_URL, data=b'', headers=headers)
+    except requests.RequestException as e:
+        logging.debug('Range query failed: {0}'.format(e))
+        return 0
+    if response.status_code != 308:
+        logging.info('API does not support resuming uploads, starting over.')
+        return 0
+    match = re.match(r'bytes=0-(\d+)$', response.headers.get('Range', ''))
+    if not match:
+        return 0
+    return min(int(match.group(1)) + 1, body.total - 1)
+
+
+def post_to_api(target_file, chunk_size=CHUNK_SIZE, progress=None, session=None, api_url=None, resumable=False):
+    """POSTs the JSON target_file to the Coveralls API.
+
+    The file is streamed in chunk_size pieces. If the connection drops a checkpoint is written next to target_file.
+    With resumable=True the next call resumes from the bytes the API already has, otherwise it sends everything again.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    target_file -- JSON string file path to containing dumped payload and source code.
+
+    Keyword arguments:
+    chunk_size -- number of bytes read from target_file and sent at a time.
+    progress -- callable invoked with (bytes_sent, bytes_total) after each chunk. Defaults to UploadProgress().
+    session -- requests.Session to reuse (and leave open). A new one is created and closed if not given.
+    api_url -- URL to POST to, defaults to API_URL.
+    resumable -- the API supports Content-Range, resume an interrupted upload with query_offset(). Coveralls doesn't.
+    """
+    api_url = api_url or API_URL
+    progress = progress or UploadProgress()
+    own_session = session is None
+    session = session or requests.Session()
+    checkpoint = read_checkpoint(target_file) if resumable else None
+    boundary = checkpoint['boundary'] if checkpoint else uuid.uuid4().hex
+    offset = 0
+    if checkpoint:
+        logging.info('Found checkpoint for {0}, {1} bytes were sent before.'.format(target_file, checkpoint['sent']))
+        offset = query_offset(session, MultipartUpload(target_file, boundary), api_url=api_url)
+
+    body = MultipartUpload(target_file, boundary, chunk_size=chunk_size, offset=offset, progress=progress)
+    headers = {'Content-Type': body.content_type}
+    if offset:
+        logging.info('Resuming upload at byte {0} of {1}.'.format(offset, body.total))
+        headers['Content-Range'] = 'bytes {0}-{1}/{2}'.format(offset, body.total - 1, body.total)
+
+    logging.debug('POSTing to: {0}'.format(api_url))
+    start = time.time()
+    try:
+        response = session.post(api_url, data=body, headers=headers)
+    except requests.RequestException as e:
+        write_checkpoint(target_file, boundary, body.sent)
+        logging.error('Upload interrupted after {0} bytes: {1}'.format(body.sent, e))
+        raise RuntimeError('Upload interrupted after {0} bytes: {1}'.format(body.sent, e))
+    finally:
+        if own_session:
+            session.close()
+    elapsed, sent = max(time.time() - start, 0.001), body.sent - offset
+    logging.info('Sent {0} bytes in {1:.2f}s ({2:.1f} KiB/s).'.format(sent, elapsed, sent / elapsed / 1024))
+
+    for attr in ('text', 'elapsed', 'headers', 'status_code', 'url'):
+        logging.debug('response.{0}: {1}'.format(attr, getattr(response, attr)))
+    if not response.ok:
+        logging.error('Got HTTP {0} while POSTing, not good.'.format(response.status_code))
+        raise RuntimeError('Got HTTP {0} while POSTing, not good.'.format(response.status_code))
+    if os.path.exists(target_file + CHECKPOINT_SUFFIX):
+        os.remove(target_file + CHECKPOINT_SUFFIX)
+
+
+def submission_fingerprint(coverage_file, payload, lcov_files=None):
+    """Hashes everything that makes a submission different from an earlier one, without reading any source code.
+
+    That's the contents of the coverage file (and of LCOV tracefiles merged into it), the payload minus
+    source_files/run_at (CI job identifiers, repo token, git HEAD and branch) and the name, size and modification time
+    of every source file (what SourceCache keys on).
+
+    Positional arguments:
+    coverage_file -- file path to the coverage file or report the payload was built from.
+    payload -- placeholdered payload, return value of Base.payload().
+
+    Keyword arguments:
+    lcov_files -- list of file paths to LCOV tracefiles merged into the payload, see submit().
+
+    Returns:
+    Hex digest string.
+    """
+    digest = hashlib.sha1()
+    for file_path in [coverage_file] + list(lcov_files or ()):
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+    metadata = dict((k, v) for k, v in payload.items() if k not in ('run_at', 'source_files'))
+    sources = list()
+    for source_file in payload['source_files']:
+        stamp = source_file.get('source_digest')
+        if source_file.get('source'):
+            file_path, max_length = placeholder_source(source_file['source'])
+            stat = os.stat(file_path)
+            stamp = (stat.st_size, stat.st_mtime, max_length)
+        sources.append((source_file['name'], stamp))
+    digest.update(json.dumps([metadata, sources], sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def read_fingerprints(index_file):
+    """Reads the fingerprints of earlier successful submissions.
+
+    Positional arguments:
+    index_file -- path to the fingerprint index, one fingerprint per line. May not exist yet.
+
+    Returns:
+    Set of fingerprint strings.
+    """
+    if not os.path.isfile(index_file):
+        return set()
+    with open(index_file) as f:
+        return set(line.strip() for line in f if line.strip())
+
+
+def store_fingerprint(index_file, fingerprint):
+    """Adds a fingerprint to the index after a successful submission. Only the newest FINGERPRINTS_KEEP are kept.
+
+    Failing to write the index is logged but not fatal, the submission itself already went through.
+
+    Positional arguments:
+    index_file -- path to the fingerprint index.
+    fingerprint -- return value of submission_fingerprint().
+    """
+    with _FINGERPRINTS_LOCK:
+        try:
+            lines = list()
+            if os.path.isfile(index_file):
+                with open(index_file) as f:
+                    lines = [line.strip() for line in f if line.strip()]
+            lines = [line for line in lines if line != fingerprint][-(FINGERPRINTS_KEEP - 1):] + [fingerprint]
+            with open(index_file, 'w') as f:
+                f.write(''.join(line + '\n' for line in lines))
+        except (IOError, OSError) as e:
+            logging.warning('Unable to update fingerprint index {0}: {1}'.format(index_file, e))
+
+
+def open_history(history_file):
+    """Opens the SQLite coverage history of record_history(), creating its tables and indexes if needed.
+
+    Each file's counts are keyed on (commit, file), so comparing two commits looks up their rows by primary key. A
+    second index on (file, commit) serves one file's trend across commits.
+
+    Raises:
+    sqlite3.Error -- if the database can't be opened or created.
+
+    Positional arguments:
+    history_file -- path to the SQLite database.
+
+    Returns:
+    sqlite3.Connection, caller closes it.
+    """
+    connection = sqlite3.connect(history_file, timeout=30)  # Other processes may be recording.
+    try:
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS commits (
+                id INTEGER PRIMARY KEY, sha TEXT NOT NULL UNIQUE, branch TEXT, recorded_at REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS commits_recorded_at ON commits (recorded_at);
+            CREATE TABLE IF NOT EXISTS paths (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+            CREATE TABLE IF NOT EXISTS coverage (
+                commit_id INTEGER NOT NULL, path_id INTEGER NOT NULL, relevant INTEGER NOT NULL,
+                covered INTEGER NOT NULL, PRIMARY KEY (commit_id, path_id));
+            CREATE INDEX IF NOT EXISTS coverage_path ON coverage (path_id, commit_id);
+        """)
+    except sqlite3.Error:
+        connection.close()
+        raise
+    return connection
+
+
+def record_history(history_file, payload):
+    """Records the relevant and covered line counts of every file in a payload under its git commit ID.
+
+    All rows are written in one transaction. Recording a commit again (e.g. another coverage file of a monorepo, or a
+    re-run) replaces the counts of the files it has and keeps the others. Failing to record is logged but not fatal,
+    the submission itself already went through.
+
+    Positional arguments:
+    history_file -- path to the SQLite database, created if it doesn't exist.
+    payload -- dict sent to the API, with git metadata.
+    """
+    git = payload.get('git') or dict()
+    sha = git.get('head', dict()).get('id')
+    if not sha:
+        logging.warning('No git commit ID, not recording coverage history.')
+        return
+    rows = list()
+    for source_file in payload['source_files']:
+        relevant, covered = coverage_totals(source_file['coverage'])
+        rows.append((source_file['name'], relevant, covered))
+
+    with _HISTORY_LOCK:
+        try:
+            connection = open_history(history_file)
+            try:
+                with connection:
+                    connection.execute('INSERT OR IGNORE INTO commits (sha, recorded_at) VALUES (?, 0)', (sha,))
+                    connection.execute('UPDATE commits SET branch = ?, recorded_at = ? WHERE sha = ?',
+                                       (git.get('branch'), time.time(), sha))
+                    commit_id = connection.execute('SELECT id FROM commits WHERE sha = ?', (sha,)).fetchone()[0]
+                    connection.executemany('INSERT OR IGNORE INTO paths (name) VALUES (?)', [(r[0],) for r in rows])
+                    connection.executemany(
+                        'INSERT OR REPLACE INTO coverage (commit_id, path_id, relevant, covered) '
+                        'SELECT ?, id, ?, ? FROM paths WHERE name = ?', [(commit_id, r, c, n) for n, r, c in rows])
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            logging.warning('Unable to record coverage history in {0}: {1}'.format(history_file, e))
+            return
+    logging.debug('Recorded coverage of {0} file(s) at {1} in {2}.'.format(len(rows), sha[:7], history_file))
+
+
+def history_regressions(history_file, sha, base_sha=None, top=10):
+    """Lists the files whose share of covered lines dropped between two recorded commits, largest drop first.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    history_file -- path to the SQLite database written by record_history().
+    sha -- hex SHA of the commit to check.
+
+    Keyword arguments:
+    base_sha -- hex SHA of the commit to compare to (e.g. the merge base). Defaults to the commit recorded last before
+        sha was.
+    top -- list at most this many files.
+
+    Returns:
+    Tuple of the base commit's SHA (None if there's no recorded base to compare to) and a list of dicts with name,
+    base_relevant, base_covered, relevant and covered keys.
+    """
+    try:
+        connection = open_history(history_file)
+        try:
+            commit = connection.execute('SELECT id, recorded_at FROM commits WHERE sha = ?', (sha,)).fetchone()
+            if commit is None:
+                logging.error('Commit {0} is not in coverage history {1}.'.format(sha, history_file))
+                raise RuntimeError('Commit {0} is not in coverage history {1}.'.format(sha, history_file))
+            if base_sha is None:
+                base = connection.execute('SELECT id, sha FROM commits WHERE recorded_at < ? '
+                                          'ORDER BY recorded_at DESC LIMIT 1', (commit[1],)).fetchone()
+            else:
+                base = connection.execute('SELECT id, sha FROM commits WHERE sha = ?', (base_sha,)).fetchone()
+            if base is None:
+                return None, list()
+            rows = connection.execute("""
+                SELECT paths.name, base.relevant, base.covered, head.relevant, head.covered
+                FROM coverage AS head
+                JOIN coverage AS base ON base.commit_id = ? AND base.path_id = head.path_id
+                JOIN paths ON paths.id = head.path_id
+                WHERE head.commit_id = ? AND head.covered * base.relevant < base.covered * head.relevant
+                ORDER BY 1.0 * base.covered / base.relevant - 1.0 * head.covered / head.relevant DESC, paths.name
+                LIMIT ?""", (base[0], commit[0], top)).fetchall()
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        logging.error('Unable to query coverage history {0}: {1}'.format(history_file, e))
+        raise RuntimeError('Unable to query coverage history {0}: {1}'.format(history_file, e))
+    keys = ('name', 'base_relevant', 'base_covered', 'relevant', 'covered')
+    return base[1], [dict(zip(keys, row)) for row in rows]
+
+
+def history_trend(history_file, name=None, limit=10):
+    """Relevant and covered line counts of one file (or all of them) over the last recorded commits.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    history_file -- path to the SQLite database written by record_history().
+
+    Keyword arguments:
+    name -- file name as sent to the API (relative to the source root). Totals of all files if None.
+    limit -- number of commits, the most recently recorded ones.
+
+    Returns:
+    List of dicts with sha, branch, relevant and covered keys, oldest commit first.
+    """
+    if name is None:
+        query = """
+            SELECT latest.sha, latest.branch, SUM(coverage.relevant), SUM(coverage.covered)
+            FROM (SELECT * FROM commits ORDER BY recorded_at DESC LIMIT ?) AS latest
+            JOIN coverage ON coverage.commit_id = latest.id
+            GROUP BY latest.id ORDER BY latest.recorded_at"""
+        arguments = (limit,)
+    else:
+        query = """
+            SELECT sha, branch, relevant, covered FROM (
+                SELECT commits.sha, commits.branch, coverage.relevant, coverage.covered, commits.recorded_at
+                FROM paths
+                JOIN coverage ON coverage.path_id = paths.id
+                JOIN commits ON commits.id = coverage.commit_id
+                WHERE paths.name = ? ORDER BY commits.recorded_at DESC LIMIT ?)
+            ORDER BY recorded_at"""
+        arguments = (name, limit)
+    try:
+        connection = open_history(history_file)
+        try:
+            rows = connection.execute(query, arguments).fetchall()
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        logging.error('Unable to query coverage history {0}: {1}'.format(history_file, e))
+        raise RuntimeError('Unable to query coverage history {0}: {1}'.format(history_file, e))
+    return [dict(zip(('sha', 'branch', 'relevant', 'covered'), row)) for row in rows]
+
+
+def show_history(history_file, repo_dir, name=None, since=None, top=10, known=None):
+    """Logs what the history subcommand shows: the files whose coverage dropped at HEAD, or the trend of one file.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    history_file -- path to the SQLite database written by record_history(), None if --history wasn't given.
+    repo_dir -- root directory of the git repository HEAD is read from.
+
+    Keyword arguments:
+    name -- file name to show the trend of instead.
+    since -- compare HEAD to the merge base of this git ref and HEAD instead of the commit recorded before it.
+    top -- number of files (or commits of the trend) listed.
+    known -- git fields passed to git_stats(), defaults to those of select_ci().
+
+    Returns:
+    List of files whose coverage dropped, see history_regressions(). Always empty for trends.
+    """
+    percent = lambda e: 100.0 * e['covered'] / e['relevant'] if e['relevant'] else 100.0
+    if not history_file or not os.path.isfile(history_file):
+        logging.error('No coverage history found, record submissions with --history FILE.')
+        raise RuntimeError('No coverage history found, record submissions with --history FILE.')
+
+    if name:
+        trend = history_trend(history_file, name=name, limit=top)
+        if not trend:
+            logging.error('{0} is not in coverage history {1}.'.format(name, history_file))
+            raise RuntimeError('{0} is not in coverage history {1}.'.format(name, history_file))
+        for entry in trend:
+            logging.info('{0} {1:>6}/{2:<6} covered ({3:6.2f}%)  {4}'.format(
+                entry['sha'][:7], entry['covered'], entry['relevant'], percent(entry), entry['branch'] or ''))
+        return list()
+
+    known = select_ci().git_fields() if known is None else known
+    sha = git_stats(repo_dir, known=known).get('head', dict()).get('id')
+    if not sha:
+        logging.error('Unable to find the HEAD commit of {0}.'.format(repo_dir))
+        raise RuntimeError('Unable to find the HEAD commit of {0}.'.format(repo_dir))
+    base_sha, regressions = history_regressions(history_file, sha, merge_base(repo_dir, since) if since else None,
+                                                top=top)
+    if base_sha is None:
+        logging.info('No recorded commit to compare {0} to.'.format(sha[:7]))
+    elif not regressions:
+        logging.info('No file lost coverage at {0} against {1}.'.format(sha[:7], base_sha[:7]))
+    else:
+        logging.error('{0} file(s) lost coverage at {1} against {2}:'.format(len(regressions), sha[:7], base_sha[:7]))
+        for entry in regressions:
+            base = dict(covered=entry['base_covered'], relevant=entry['base_relevant'])
+            logging.error('{0:6.2f}% -> {1:6.2f}% {2:>6}/{3:<6} covered  {4}'.format(
+                percent(base), percent(entry), entry['covered'], entry['relevant'], entry['name']))
+    return regressions
+
+
+def upload_payload(payload, target_file, no_delete=False, session=None, cache=None, api_url=None, resumable=False):
+    """Dumps a payload to disk (or reuses the file of an interrupted upload), POSTs it and deletes it.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    payload -- dict of all data to be sent to the API, with placeholders instead of source code.
+    target_file -- file path to write dumped payload and source code to.
+
+    Keyword arguments:
+    no_delete -- don't delete target_file after POSTing.
+    session -- passed to post_to_api().
+    cache -- passed to dump_json_to_disk().
+    api_url -- passed to post_to_api().
+    resumable -- passed to post_to_api().
+    """
+    if read_checkpoint(target_file) and payload_intact(target_file):
+        logging.info('Reusing {0} from an interrupted upload.'.format(target_file))
+    else:
+        dump_json_to_disk(payload, target_file, cache=cache)
+
+    post_to_api(target_file, session=session, api_url=api_url, resumable=resumable)
+
+    if not no_delete:
         logging.info('Deleting {0}.'.format(target_file))
         os.remove(target_file)
+
+
+def shard_source_files(source_files, shard_bytes):
+    """Splits source files into balanced shards of about shard_bytes each, before the payload is dumped.
+
+    Greedy bin-packing: files are taken largest first and each goes to the shard with the fewest bytes so far. A file's
+    bytes are its JSON without source code plus the size of the source file, which escaping grows only by a few
+    percent for most code.
+
+    Positional arguments:
+    source_files -- the payload's list of source file dicts, with placeholders instead of source code.
+    shard_bytes -- approximate size of each shard, total bytes divided by this (rounded up) is the number of shards.
+
+    Returns:
+    List of (estimated bytes, list of source file dicts in their original order) tuples, empty shards left out. Source
+    files spilled by a SpillList are loaded back into memory.
+    """
+    source_files = list(source_files)
+    sizes = list()
+    for index, source_file in enumerate(source_files):
+        placeholder = source_file.get('source', '')
+        size = len(json.dumps(source_file)) - len(placeholder)
+        if placeholder:
+            size += os.path.getsize(placeholder_source(placeholder)[0])
+        sizes.append((size, index))
+
+    shards = max(min(-(-sum(s[0] for s in sizes) // shard_bytes), len(sizes)), 1)
+    heap = [(0, shard, list()) for shard in range(shards)]
+    for size, index in sorted(sizes, reverse=True):
+        total, shard, members = heapq.heappop(heap)
+        members.append(index)
+        heapq.heappush(heap, (total + size, shard, members))
+    heap.sort(key=lambda h: h[1])
+    return [(total, [source_files[i] for i in sorted(members)]) for total, _, members in heap if members]
+
+
+def close_parallel_build(payload, session=None, webhook_url=None):
+    """Tells Coveralls all jobs of a parallel build were sent, so it can merge them.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    payload -- payload of one of the build's jobs, its repo_token and service_number (build number) are used.
+
+    Keyword arguments:
+    session -- requests.Session to POST with.
+    webhook_url -- URL to POST to, defaults to WEBHOOK_URL.
+    """
+    webhook_url = webhook_url or WEBHOOK_URL
+    params = dict(repo_token=payload['repo_token']) if payload.get('repo_token') else dict()
+    data = {'payload[build_num]': payload['service_number'], 'payload[status]': 'done'}
+    logging.debug('POSTing to: {0}'.format(webhook_url))
+    try:
+        response = (session or requests).post(webhook_url, params=params, data=data)
+    except requests.RequestException as e:
+        logging.error('Unable to close parallel build {0}: {1}'.format(payload['service_number'], e))
+        raise RuntimeError('Unable to close parallel build {0}: {1}'.format(payload['service_number'], e))
+    if not response.ok:
+        logging.error('Got HTTP {0} while closing the parallel build.'.format(response.status_code))
+        raise RuntimeError('Got HTTP {0} while closing the parallel build.'.format(response.status_code))
+    logging.info('Closed parallel build {0}.'.format(payload['service_number']))
+
+
+def submit_shards(payload, shards, target_file, jobs=4, no_delete=False, cache=None, api_url=None, webhook_url=None,
+                  resumable=False):
+    """Uploads a payload split by shard_source_files() as concurrent parallel jobs and closes the build.
+
+    Every job carries the same build metadata (service_number, git, ...) with "parallel" set and a "flag_name" telling
+    the shards apart. Each worker thread reuses one requests.Session. Payload files are named after target_file with
+    ".shardN" inserted before the extension.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    payload -- dict of all data to be sent to the API, with placeholders instead of source code.
+    shards -- return value of shard_source_files() for the payload's source_files.
+    target_file -- file path template for the dumped shards.
+
+    Keyword arguments:
+    jobs -- number of shards dumped and uploaded at the same time.
+    no_delete -- don't delete the payload files after POSTing.
+    cache -- passed to dump_json_to_disk().
+    api_url -- passed to upload_payload().
+    webhook_url -- passed to close_parallel_build().
+    resumable -- passed to upload_payload().
+    """
+    if not payload.get('service_number'):
+        logging.error('Sharding needs the CI build number (service_number) to close the parallel build.')
+        raise RuntimeError('Sharding needs the CI build number (service_number) to close the parallel build.')
+    for index, (size, source_files) in enumerate(shards, 1):
+        logging.info('Shard {0}/{1}: {2} file(s), about {3} bytes.'.format(index, len(shards), len(source_files), size))
+
+    local = threading.local()
+    sessions = list()
+    root, ext = os.path.splitext(target_file)
+
+    def run(args):
+        """Uploads one shard, never raises. Returns the error message or None."""
+        index, (_, source_files) = args
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+            sessions.append(local.session)
+        shard = dict(payload, source_files=source_files, parallel=True,
+                     flag_name='shard {0}/{1}'.format(index, len(shards)))
+        try:
+            upload_payload(shard, '{0}.shard{1}{2}'.format(root, index, ext), no_delete=no_delete,
+                           session=local.session, cache=cache, api_url=api_url, resumable=resumable)
+        except (RuntimeError, ValueError) as e:
+            return str(e)
+        return None
+
+    pool = ThreadPool(max(min(jobs, len(shards)), 1))
+    try:
+        errors = pool.map(run, enumerate(shards, 1))
+        failed = len([e for e in errors if e])
+        if failed:
+            logging.error('{0} of {1} shard(s) failed, not closing the parallel build.'.format(failed, len(shards)))
+            raise RuntimeError('{0} of {1} shard(s) failed, not closing the parallel build.'.format(
+                failed, len(shards)))
+        close_parallel_build(payload, session=sessions[0] if sessions else None, webhook_url=webhook_url)
+    finally:
+        pool.close()
+        pool.join()
+        for session in sessions:
+            session.close()
+
+
+def submit(coverage_file, source_root, git_stats_result, target_file, no_delete=False, session=None, dry_run=None,
+           only=None, cache=None, metadata=None, fingerprints=None, force=False,
+           cov=None, remap=None, shard_bytes=None, jobs=4, max_memory=None, history=None, heavy_rules=None,
+           lcov_files=None, api_url=None, webhook_url=None, resumable=False):
+    """Reads coverage data, builds the payload, dumps it to disk and POSTs it to the API.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    coverage_file -- file path to the coverage file.
+    source_root -- absolute path to root directory of the project's source code.
+    git_stats_result -- return value of git_stats().
+    target_file -- file path to write dumped payload and source code to.
+
+    Keyword arguments:
+    no_delete -- don't delete target_file after POSTing.
+    session -- requests.Session to POST with, passed to post_to_api().
+    dry_run -- dict of log_payload_stats() keyword arguments. If set, only log payload statistics and return.
+    only -- passed to read_coverage(), return value of changed_files().
+    cache -- SourceCache passed to read_coverage() and dump_json_to_disk().
+    metadata -- payload built by the submitting client minus source_files and git. If given select_ci() isn't used,
+        the serve daemon's environment variables are not the client's.
+    fingerprints -- path to the fingerprint index. If set, submissions identical to an earlier successful one are
+        skipped before anything is dumped and successful ones are added to it.
+    force -- submit even if the fingerprint is in the index.
+    cov -- coverage instance already holding the data of coverage_file, read with analyze_coverage() instead.
+    remap -- PathRemapper passed to read_coverage() or analyze_coverage().
+    shard_bytes -- if the payload is larger, it's split with shard_source_files() and sent with submit_shards().
+    jobs -- passed to submit_shards().
+    max_memory -- passed to read_coverage() or analyze_coverage().
+    history -- path to the coverage history database the submission is recorded in, see record_history().
+    heavy_rules -- rules of the HeavyFilePolicy passed to read_coverage() or analyze_coverage(), see
+        read_heavy_rules(). What they saved is logged once the coverage data is read.
+    lcov_files -- list of file paths to LCOV tracefiles (e.g. of C extensions or JavaScript) read with lcov_report()
+        and merged into the coverage data with merge_source_files(), so all languages are sent in one payload.
+    api_url -- passed to upload_payload() or submit_shards().
+    webhook_url -- passed to submit_shards().
+    resumable -- passed to upload_payload() or submit_shards().
+    """
+    heavy = HeavyFilePolicy(heavy_rules) if heavy_rules else None
+    if cov is not None:
+        coverage_result = analyze_coverage(cov, source_root, only=only, cache=cache, remap=remap,
+                                           max_memory=max_memory, heavy=heavy)
+    else:
+        coverage_result = read_coverage(coverage_file, source_root, only=only, cache=cache, remap=remap,
+                                        max_memory=max_memory, heavy=heavy)
+    for lcov_file in lcov_files or ():
+        lcov_result = lcov_report(lcov_file, source_root, only=only, cache=cache, remap=remap, max_memory=max_memory,
+                                  heavy=heavy)
+        coverage_result = merge_source_files(coverage_result, lcov_result, max_memory=max_memory)
+    if heavy is not None:
+        heavy.report()
+
+    # Select class and get the payload.
+    if metadata is None:
+        ci_class = select_ci()
+        logging.info('Selected class: {0}'.format(ci_class.__name__))
+        payload = ci_class.payload(coverage_result=coverage_result, git_stats_result=git_stats_result)
+    else:
+        payload = dict(metadata, source_files=coverage_result)
+        if git_stats_result:
+            payload['git'] = git_stats_result
+    totals = [coverage_totals(f['coverage']) for f in payload['source_files']]
+    logging.info('Coverage of {0} file(s) found, {1} of {2} relevant lines covered.'.format(
+        len(totals), sum(t[1] for t in totals), sum(t[0] for t in totals)))
+    if payload.get('git'):
+        logging.info('Git branch/tag: {0}'.format(payload['git'].get('branch')))
+    if dry_run is not None:
+        log_payload_stats(payload_stats(payload), **dry_run)
+        return
+
+    # Skip the submission if it's already been done.
+    fingerprint = submission_fingerprint(coverage_file, payload, lcov_files=lcov_files) if fingerprints else None
+    if fingerprint and fingerprint in read_fingerprints(fingerprints):
+        if not force:
+            logging.info('Identical submission already made (fingerprint {0}), skipping. Use --force to submit '
+                         'anyway.'.format(fingerprint))
+            return
+        logging.info('Identical submission already made (fingerprint {0}), submitting anyway.'.format(fingerprint))
+
+    # Dump payload to file, merge in actual source code and submit it to the API.
+    shards = shard_source_files(payload['source_files'], shard_bytes) if shard_bytes else list()
+    if len(shards) > 1:
+        submit_shards(payload, shards, target_file, jobs=jobs, no_delete=no_delete, cache=cache, api_url=api_url,
+                      webhook_url=webhook_url, resumable=resumable)
+    else:
+        upload_payload(payload, target_file, no_delete=no_delete, session=session, cache=cache, api_url=api_url,
+                       resumable=resumable)
+    if fingerprint:
+        store_fingerprint(fingerprints, fingerprint)
+    if history:
+        record_history(history, payload)
+
+
+def read_manifest(manifest_file, source_root, repo_dir):
+    """Reads a submit-many manifest file.
+
+    The manifest is a JSON list of objects, one per submission, with keys matching the long options of the submit
+    command: "coverage" (required), "source", "git" and "lcov" (list). Relative paths are relative to the manifest's
+    directory.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    manifest_file -- file path to the manifest.
+    source_root -- default source code root directory for entries without "source".
+    repo_dir -- default root git repo directory for entries without "git".
+
+    Returns:
+    List of dicts with absolute paths for "coverage", "source", "git" and "lcov" (list).
+    """
+    try:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError) as e:
+        logging.error('Unable to read manifest {0}: {1}'.format(manifest_file, e))
+        raise RuntimeError('Unable to read manifest {0}: {1}'.format(manifest_file, e))
+    if not isinstance(manifest, list) or not all(isinstance(e, dict) and e.get('coverage') for e in manifest):
+        logging.error('Manifest must be a list of objects with a "coverage" key: {0}'.format(manifest_file))
+        raise RuntimeError('Manifest must be a list of objects with a "coverage" key: {0}'.format(manifest_file))
+
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+    get_path = lambda p: os.path.normpath(os.path.join(manifest_dir, os.path.expanduser(p)))
+    entries = list()
+    for entry in manifest:
+        entries.append(dict(
+            coverage=get_path(entry['coverage']),
+            source=get_path(entry['source']) if entry.get('source') else source_root,
+            git=get_path(entry['git']) if entry.get('git') else repo_dir,
+            lcov=[get_path(p) for p in entry.get('lcov') or ()],
+        ))
+    return entries
+
+
+def submit_many(entries, target_file, jobs=4, no_delete=False, dry_run=None, since=None,
+                fingerprints=None, force=False, remap=None, history=None, heavy_rules=None, metadata=None,
+                api_url=None, webhook_url=None, resumable=False):
+    """Submits several coverage files concurrently using a bounded pool of threads.
+
+    git_stats() runs once per distinct repo directory and its result is shared. Each worker thread reuses one
+    requests.Session so connections to the API are kept alive between submissions. Payload files are named after
+    target_file with the entry's index inserted before the extension.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr if changed_files() fails. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    entries -- return value of read_manifest().
+    target_file -- file path template for the dumped payloads.
+
+    Keyword arguments:
+    jobs -- number of submissions to run at the same time.
+    no_delete -- don't delete the payload files after POSTing.
+    dry_run -- passed to submit().
+    since -- only submit files changed since this git ref, see changed_files().
+    fingerprints -- passed to submit().
+    force -- passed to submit().
+    remap -- passed to submit(), shared by all entries.
+    history -- passed to submit().
+    heavy_rules -- passed to submit().
+    metadata -- passed to submit().
+    api_url -- passed to submit().
+    webhook_url -- passed to submit().
+    resumable -- passed to submit().
+
+    Returns:
+    List of dicts (one per entry, same order) with "coverage", "ok", "error" and "seconds" keys.
+    """
+    git_stats_results, changed = dict(), dict()
+    for repo_dir in set(e['git'] for e in entries):
+        git_stats_results[repo_dir] = git_stats(repo_dir)
+        changed[repo_dir] = changed_files(repo_dir, since) if since else None
+
+    local = threading.local()
+    sessions = list()
+    root, ext = os.path.splitext(target_file)
+
+    def run(args):
+        """Submits one entry, never raises."""
+        index, entry = args
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+            sessions.append(local.session)
+        result = dict(coverage=entry['coverage'], ok=False, error=None)
+        start = time.time()
+        try:
+            submit(entry['coverage'], entry['source'], git_stats_results[entry['git']],
+                   '{0}.{1}{2}'.format(root, index, ext), no_delete=no_delete, session=local.session, dry_run=dry_run,
+                   only=changed[entry['git']], fingerprints=fingerprints, force=force,
+                   remap=remap, history=history, heavy_rules=heavy_rules, lcov_files=entry.get('lcov'),
+                   metadata=metadata, api_url=api_url, webhook_url=webhook_url, resumable=resumable)
+            result['ok'] = True
+        except (RuntimeError, ValueError) as e:
+            result['error'] = str(e)
+        result['seconds'] = time.time() - start
+        return result
+
+    pool = ThreadPool(max(min(jobs, len(entries)), 1))
+    try:
+        results = pool.map(run, enumerate(entries))
+    finally:
+        pool.close()
+        pool.join()
+        for session in sessions:
+            session.close()
+
+    for result in results:
+        status = 'OK' if result['ok'] else 'FAILED ({0})'.format(result['error'])
+        logging.info('{0:.2f}s {1}: {2}'.format(result['seconds'], result['coverage'], status))
+    return results
+
+
+def read_message(sock):
+    """Reads one newline terminated JSON message sent by send_message().
+
+    Raises:
+    ValueError -- raised if the other end hung up before sending a whole message or didn't send JSON.
+
+    Positional arguments:
+    sock -- connected socket.
+
+    Returns:
+    Decoded message.
+    """
+    chunks = list()
+    while not chunks or not chunks[-1].endswith(b'\n'):
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise ValueError('Connection closed before a whole message was received.')
+        chunks.append(chunk)
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def send_message(sock, message):
+    """Sends a dict as one line of JSON, read on the other end by read_message().
+
+    Positional arguments:
+    sock -- connected socket.
+    message -- JSON serializable dict.
+    """
+    sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+
+class SubmitDaemon(object):
+    """Long running process accepting submissions from submit_via_daemon() over a Unix socket.
+
+    Keeps what every coveralls_multi_ci invocation would pay for again warm: imported modules, one requests.Session per
+    worker (connections to the API are kept alive) and a SourceCache of line counts and escaped source code shared by
+    all workers. Accepted connections wait in a bounded queue for a fixed number of workers, which read and run their
+    jobs. When the queue is full new jobs are turned away and the client submits them in-process instead.
+
+    Jobs name files the daemon writes (output, history, fingerprints), so only clients running as the daemon's user
+    are served: the socket is only accessible by its owner and the peer's credentials are checked where supported.
+
+    Positional arguments:
+    socket_path -- path of the Unix socket to listen on.
+
+    Keyword arguments:
+    jobs -- number of worker threads.
+    queue_size -- number of accepted jobs allowed to wait for a worker.
+    cache -- SourceCache to use, a new one by default.
+    """
+
+    def __init__(self, socket_path, jobs=4, queue_size=16, cache=None):
+        self.socket_path = socket_path
+        self.jobs = max(jobs, 1)
+        self.queue = Queue(max(queue_size, 1))
+        self.cache = cache if cache is not None else SourceCache()
+        self.ready = threading.Event()
+        self._running = False
+
+    def serve_forever(self):
+        """Listens on the socket and hands jobs to the workers until shutdown() is called.
+
+        Raises:
+        RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+        """
+        if not hasattr(socket, 'AF_UNIX'):
+            logging.error('Unix sockets are not supported on this platform.')
+            raise RuntimeError('Unix sockets are not supported on this platform.')
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except socket.error:
+                logging.info('Removing stale socket {0}.'.format(self.socket_path))
+                os.remove(self.socket_path)
+            else:
+                logging.error('A daemon is already listening on {0}.'.format(self.socket_path))
+                raise RuntimeError('A daemon is already listening on {0}.'.format(self.socket_path))
+            finally:
+                probe.close()
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server.bind(self.socket_path)
+        except socket.error as e:
+            server.close()
+            logging.error('Unable to listen on {0}: {1}'.format(self.socket_path, e))
+            raise RuntimeError('Unable to listen on {0}: {1}'.format(self.socket_path, e))
+        os.chmod(self.socket_path, 0o600)  # Before listen(), nobody can connect yet.
+        server.listen(self.queue.maxsize + self.jobs)
+        workers = [threading.Thread(target=self._work) for _ in range(self.jobs)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        logging.info('Listening on {0} with {1} worker(s).'.format(self.socket_path, self.jobs))
+        self._running = True
+        self.ready.set()
+
+        try:
+            while self._running:
+                connection = server.accept()[0]
+                if not self._running:
+                    connection.close()
+                    break
+                self._accept(connection)
+        finally:
+            self._running = False
+            server.close()
+            os.remove(self.socket_path)
+            for _ in workers:
+                self.queue.put(None)
+            for worker in workers:
+                worker.join()
+            logging.info('Stopped listening on {0}.'.format(self.socket_path))
+
+    def shutdown(self):
+        """Makes serve_forever() return after the queued jobs are done. Can be called from any thread."""
+        self._running = False
+        wake = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            wake.connect(self.socket_path)  # Unblocks accept().
+        except socket.error:
+            pass
+        finally:
+            wake.close()
+
+    def _accept(self, connection):
+        """Queues a new connection for the workers or turns the client away. Never reads, slow clients can't block."""
+        if not self._peer_allowed(connection):
+            connection.close()
+            return
+        try:
+            self.queue.put_nowait((connection, time.time()))
+        except Full:
+            thread = threading.Thread(target=self._turn_away, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    @staticmethod
+    def _peer_allowed(connection):
+        """Whether the client runs as the daemon's user. Without SO_PEERCRED (not Linux) the socket's mode has to do."""
+        so_peercred = getattr(socket, 'SO_PEERCRED', 17 if sys.platform.startswith('linux') else None)
+        if so_peercred is None:
+            return True
+        credentials = connection.getsockopt(socket.SOL_SOCKET, so_peercred, struct.calcsize('3i'))
+        pid, uid, _ = struct.unpack('3i', credentials)
+        if uid != os.getuid():
+            logging.warning('Refusing connection from process {0} of user {1}.'.format(pid, uid))
+            return False
+        return True
+
+    @staticmethod
+    def _read_job(connection):
+        """Reads the job of a connection. Returns None after closing the connection if the client doesn't send one."""
+        connection.settimeout(10)
+        try:
+            job = read_message(connection)
+        except (socket.error, ValueError) as e:
+            logging.warning('Dropping connection: {0}'.format(e))
+            connection.close()
+            return None
+        connection.settimeout(None)
+        return job
+
+    def _turn_away(self, connection):
+        """Tells a client the daemon is busy, in its own thread."""
+        job = self._read_job(connection)
+        if job is None:
+            return
+        logging.warning('Queue full, turning away {0}.'.format(job.get('coverage')))
+        try:
+            send_message(connection, dict(ok=False, busy=True, error='Daemon busy.'))
+        except socket.error:
+            pass
+        finally:
+            connection.close()
+
+    def _work(self):
+        """Worker thread. Reads queued connections' jobs, runs them with its own requests.Session and replies."""
+        session = requests.Session()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                connection, accepted_at = item
+                job = self._read_job(connection)
+                if job is None:
+                    continue
+                started = time.time()
+                response = self.run(job, session)
+                response.update(queued=started - accepted_at, seconds=time.time() - started)
+                status = 'OK' if response['ok'] else 'FAILED ({0})'.format(response['error'])
+                logging.info('{0:.2f}s (queued {1:.2f}s) {2}: {3}'.format(
+                    response['seconds'], response['queued'], job.get('coverage'), status))
+                try:
+                    send_message(connection, response)
+                except socket.error as e:
+                    logging.warning('Client of {0} went away: {1}'.format(job.get('coverage'), e))
+                finally:
+                    connection.close()
+        finally:
+            session.close()
+
+    def run(self, job, session):
+        """Submits one job, never raises.
+
+        Positional arguments:
+        job -- dict sent by submit_via_daemon(). Has coverage, source, git, git_fields, output, no_delete, since,
+            fingerprints, force, remap (rules, see read_remap_rules()), shard_bytes, max_memory, history, heavy (rules,
+            see read_heavy_rules()), lcov, resume, api_url, webhook_url and metadata keys, everything needed that
+            depends on the client's working directory, options and environment.
+        session -- requests.Session passed to submit().
+
+        Returns:
+        Dict with "ok" and "error" keys.
+        """
+        response = dict(ok=False, error=None)
+        try:
+            only = changed_files(job['git'], job['since']) if job.get('since') else None
+            git_stats_result = git_stats(job['git'], known=job.get('git_fields'))
+            submit(job['coverage'], job['source'], git_stats_result, job['output'], no_delete=job.get('no_delete'),
+                   session=session, only=only, cache=self.cache, metadata=job['metadata'],
+                   fingerprints=job.get('fingerprints'), force=job.get('force'),
+                   remap=PathRemapper(job['remap']) if job.get('remap') else None, shard_bytes=job.get('shard_bytes'),
+                   jobs=self.jobs, max_memory=job.get('max_memory'), history=job.get('history'),
+                   heavy_rules=job.get('heavy'), lcov_files=job.get('lcov'), api_url=job.get('api_url'),
+                   webhook_url=job.get('webhook_url'), resumable=job.get('resume'))
+            response['ok'] = True
+        except Exception as e:  # One bad job must not take a worker down with it.
+            logging.exception('Submitting {0} failed.'.format(job.get('coverage')))
+            response['error'] = str(e) or e.__class__.__name__
+        return response
+
+
+def submit_via_daemon(socket_path, job):
+    """Hands a submission over to a running serve daemon and waits for it to finish.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr. Caller should just call sys.exit(1).
+
+    Positional arguments:
+    socket_path -- path of the daemon's Unix socket.
+    job -- dict passed to SubmitDaemon.run().
+
+    Returns:
+    True if the daemon submitted it, False if no daemon is listening or it's busy. Caller then submits in-process.
+    """
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(socket_path):
+        return False
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            client.connect(socket_path)
+        except socket.error as e:
+            logging.debug('No daemon listening on {0}: {1}'.format(socket_path, e))
+            return False
+        logging.info('Submitting through daemon listening on {0}.'.format(socket_path))
+        try:
+            send_message(client, job)
+            response = read_message(client)
+        except (socket.error, ValueError) as e:
+            logging.error('Lost connection to daemon: {0}'.format(e))
+            raise RuntimeError('Lost connection to daemon: {0}'.format(e))
+    finally:
+        client.close()
+
+    if response.get('busy'):
+        logging.info('Daemon is busy, submitting in-process.')
+        return False
+    if not response['ok']:
+        logging.error('Daemon failed to submit: {0}'.format(response['error']))
+        raise RuntimeError('Daemon failed to submit: {0}'.format(response['error']))
+    logging.info('Daemon submitted in {0:.2f}s (queued {1:.2f}s).'.format(response['seconds'], response['queued']))
+    return True
+
+
+class Submitter(object):
+    """Does what the command line does, configured explicitly instead of by OPTIONS, os.environ and the CWD.
+
+    Everything is read in the constructor and never changed afterwards, so one instance can be used by many threads at
+    once and instances with different options or environments can be used side by side in one process. The CI class is
+    selected and read from `environ`, every submission gets its own run_at and (unless --output is given) its own
+    temporary payload file. An explicit --output is shared, so submissions through one instance then run one at a time.
+
+    Raises:
+    RuntimeError -- raised after logging to stderr by the constructor (invalid options) and the methods.
+
+    Keyword arguments:
+    options -- dict of options keyed like OPTIONS (e.g. {'--coverage': 'coverage.xml', '--jobs': '2'}), missing ones
+        take the defaults of the command line except --output.
+    environ -- mapping of environment variables the CI class and its fields are read from, defaults to os.environ.
+        Copied.
+    cwd -- directory "cwd" and relative paths in options are relative to, defaults to the current directory.
+    api_url -- URL of the API's jobs endpoint, defaults to API_URL.
+    webhook_url -- URL of the API's webhook closing parallel builds, defaults to WEBHOOK_URL.
+    """
+
+    def __init__(self, options=None, environ=None, cwd=None, api_url=None, webhook_url=None):
+        output = (options or dict()).get('--output')  # Not its default, a payload file per submission instead.
+        options = dict(docopt(__doc__, argv=['submit']), **(options or dict()))
+        self.environ = dict(os.environ if environ is None else environ)
+        self.cwd = cwd or os.getcwd()
+        self.api_url = api_url
+        self.webhook_url = webhook_url
+
+        get_dir = lambda d: self.cwd if d == 'cwd' else self.path(d)
+        self.repo_dir = get_dir(options.get('--git') or 'cwd')
+        self.source_root = get_dir(options.get('--source') or 'cwd')
+        self.coverage_file = self.path(options.get('--coverage') or '.coverage')
+        self.target_file = self.path(output) if output else None
+        self._target_lock = threading.Lock()
+        self.dry_run = None
+        if options.get('--dry-run'):
+            self.dry_run = dict(top=int(options.get('--top') or 10), bandwidth=float(options.get('--bandwidth') or 10))
+        self.socket_path = self.path(options.get('--socket') or '~/.coveralls_multi_ci.sock')
+        self.no_daemon = bool(options.get('--no-daemon'))
+        self.no_delete = bool(options.get('--no-delete'))
+        self.resume = bool(options.get('--resume'))
+        self.fingerprints = options.get('--fingerprints') and self.path(options['--fingerprints'])
+        self.force = bool(options.get('--force'))
+        self.history_file = options.get('--history') and self.path(options['--history'])
+        self.since = options.get('--since')
+        self.top = int(options.get('--top') or 10)
+        self.jobs = int(options.get('--jobs') or 4)
+        self.queue = int(options.get('--queue') or 16)
+        self.shard_bytes = int(float(options['--shard-size']) * 1000 * 1000) if options.get('--shard-size') else None
+        self.max_memory = int(float(options['--max-memory']) * 1000 * 1000) if options.get('--max-memory') else None
+        self.lcov_files = [self.path(p.strip()) for p in (options.get('--lcov') or '').split(',') if p.strip()]
+        self.remap_rules = read_remap_rules(options['--remap']) if options.get('--remap') else None
+        self.heavy_rules = read_heavy_rules(options['--heavy']) if options.get('--heavy') else None
+
+    def path(self, path):
+        """Makes a path from the options absolute, relative to cwd and with ~ expanded."""
+        return os.path.normpath(os.path.join(self.cwd, os.path.expanduser(path)))
+
+    @contextmanager
+    def _payload_file(self):
+        """Yields the payload file of one submission, holding the lock on --output or in a new temporary directory."""
+        if self.target_file:
+            with self._target_lock:
+                yield self.target_file
+            return
+        target_dir = tempfile.mkdtemp(prefix='coveralls_multi_ci_')
+        try:
+            yield os.path.join(target_dir, 'coveralls_multi_ci_payload.txt')
+        finally:
+            if not self.no_delete:
+                shutil.rmtree(target_dir, ignore_errors=True)
+
+    def select_ci(self):
+        """Returns the CI class selected for and bound to the environment, see select_ci()."""
+        ci_class = select_ci(self.environ)
+        logging.info('Selected class: {0}'.format(ci_class.__name__))
+        return ci_class
+
+    def submit(self, coverage_file=None, session=None):
+        """Submits one coverage file, handing it to a serve daemon if one is listening, like the submit command.
+
+        Raises:
+        RuntimeError -- raised after logging to stderr.
+
+        Keyword arguments:
+        coverage_file -- coverage file or report to submit instead of --coverage, relative to cwd.
+        session -- passed to submit().
+        """
+        coverage_file = self.path(coverage_file) if coverage_file else self.coverage_file
+        ci_class = self.select_ci()
+        metadata = ci_class.payload(list())
+        metadata.pop('source_files')
+        with self._payload_file() as target_file:
+            if self.dry_run is None and not self.no_daemon and os.path.exists(self.socket_path):
+                job = dict(coverage=coverage_file, source=self.source_root, git=self.repo_dir,
+                           git_fields=ci_class.git_fields(), output=target_file, no_delete=self.no_delete,
+                           since=self.since, fingerprints=self.fingerprints, force=self.force, remap=self.remap_rules,
+                           shard_bytes=self.shard_bytes, max_memory=self.max_memory, history=self.history_file,
+                           heavy=self.heavy_rules, lcov=self.lcov_files, resume=self.resume, api_url=self.api_url,
+                           webhook_url=self.webhook_url, metadata=metadata)
+                if submit_via_daemon(self.socket_path, job):
+                    return
+            logging.info('Gathering git repo and test coverage data.')
+            git_stats_result = git_stats(self.repo_dir, known=ci_class.git_fields())
+            only = changed_files(self.repo_dir, self.since) if self.since else None
+            submit(coverage_file, self.source_root, git_stats_result, target_file, no_delete=self.no_delete,
+                   session=session, dry_run=self.dry_run, only=only, metadata=metadata,
+                   fingerprints=self.fingerprints, force=self.force,
+                   remap=PathRemapper(self.remap_rules) if self.remap_rules else None, shard_bytes=self.shard_bytes,
+                   jobs=self.jobs, max_memory=self.max_memory, history=self.history_file, heavy_rules=self.heavy_rules,
+                   lcov_files=self.lcov_files, api_url=self.api_url, webhook_url=self.webhook_url,
+                   resumable=self.resume)
+
+    def submit_many(self, manifest_file):
+        """Submits the coverage files listed in a manifest concurrently, like the submit-many command.
+
+        Raises:
+        RuntimeError -- raised after logging to stderr if the manifest can't be read or changed_files() fails.
+
+        Positional arguments:
+        manifest_file -- file path to the manifest, see read_manifest(). Relative to cwd.
+
+        Returns:
+        Return value of submit_many().
+        """
+        entries = read_manifest(self.path(manifest_file), self.source_root, self.repo_dir)
+        logging.info('Submitting {0} coverage file(s).'.format(len(entries)))
+        metadata = self.select_ci().payload(list())
+        metadata.pop('source_files')
+        with self._payload_file() as target_file:
+            return submit_many(entries, target_file, jobs=self.jobs, no_delete=self.no_delete, dry_run=self.dry_run,
+                               since=self.since, fingerprints=self.fingerprints, force=self.force,
+                               remap=PathRemapper(self.remap_rules) if self.remap_rules else None,
+                               history=self.history_file, heavy_rules=self.heavy_rules, metadata=metadata,
+                               api_url=self.api_url, webhook_url=self.webhook_url, resumable=self.resume)
+
+    def inspect(self):
+        """Checks the payload file kept at --output and logs what's in it, like the inspect command.
+
+        Raises:
+        RuntimeError -- raised after logging to stderr.
+
+        Returns:
+        Return value of inspect_payload().
+        """
+        if not self.target_file:
+            logging.error('No payload file to inspect, --output must be given.')
+            raise RuntimeError('No payload file to inspect, --output must be given.')
+        totals = inspect_payload(self.target_file, report=log_inspected_file)
+        logging.info('{0} file(s), {1} lines, {2} bytes of escaped source code.'.format(
+            totals['files'], totals['lines'], totals['escaped_bytes']))
+        logging.info('{0} of {1} relevant lines covered ({2:.2f}%).'.format(
+            totals['covered'], totals['relevant'],
+            100.0 * totals['covered'] / totals['relevant'] if totals['relevant'] else 100.0))
+        if totals['problems']:
+            logging.error('{0} of {1} file(s) have problems.'.format(totals['problems'], totals['files']))
+        return totals
+
+    def history(self, name=None):
+        """Shows the files whose coverage dropped at HEAD, or the trend of one file, like the history command.
+
+        Raises:
+        RuntimeError -- raised after logging to stderr.
+
+        Keyword arguments:
+        name -- passed to show_history().
+
+        Returns:
+        Return value of show_history().
+        """
+        known = select_ci(self.environ).git_fields()
+        return show_history(self.history_file, self.repo_dir, name=name, since=self.since, top=self.top, known=known)
+
+    def serve(self):
+        """Runs a SubmitDaemon on --socket until it's interrupted, like the serve command.
+
+        Raises:
+        RuntimeError -- raised after logging to stderr.
+        """
+        SubmitDaemon(self.socket_path, jobs=self.jobs, queue_size=self.queue).serve_forever()
+
+
+def main():
+    """Main function called upon script execution. Runs the command given in OPTIONS with a Submitter."""
+    try:
+        submitter = Submitter(OPTIONS, environ=os.environ, cwd=CWD)
+        if OPTIONS.get('serve'):
+            submitter.serve()
+            return
+        if OPTIONS.get('inspect'):
+            if submitter.inspect()['problems']:
+                sys.exit(1)
+        elif OPTIONS.get('history'):
+            if submitter.history(name=OPTIONS.get('<name>')):
+                sys.exit(1)
+        elif OPTIONS.get('submit-many'):
+            results = submitter.submit_many(OPTIONS['<manifest>'])
+            failed = len([r for r in results if not r['ok']])
+            if failed:
+                logging.error('{0} of {1} submission(s) failed.'.format(failed, len(results)))
+                sys.exit(1)
+        else:
+            submitter.submit()
+    except RuntimeError:
+        sys.exit(1)
     logging.info('Done.')
 
 
@@ -487,23 +3825,24 @@ def setup_logging():
 
     If --quiet was used, disables all logging, which is the only way this script writes to the console.
 
-    Otherwise, all CRITICAL, ERROR, and WARNING messages go to stderr, while INFO and DEBUG messages go to stdout. If
-    --verbose was used, all levels are enabled. If --verbose was not used, DEBUG messages will be silenced (done at the
-    root logger level).
+    Otherwise, all CRITICAL, ERROR, and WARNING messages go to stderr, while INFO, DEBUG and TRACE messages go to
+    stdout. If --verbose was used, all levels but TRACE are enabled, --trace enables TRACE too. If neither was used,
+    DEBUG messages will be silenced (done at the root logger level).
     """
     if OPTIONS.get('--quiet'):
         logging.disable(logging.CRITICAL)
         return
-    fmt = '%(asctime)-15s %(levelname)-8s %(funcName)-17s %(message)s' if OPTIONS.get('--verbose') else '%(message)s'
+    verbose = OPTIONS.get('--verbose') or OPTIONS.get('--trace')
+    fmt = '%(asctime)-15s %(levelname)-8s %(funcName)-17s %(message)s' if verbose else '%(message)s'
 
     class InfoFilter(logging.Filter):
         """From http://stackoverflow.com/questions/16061641/python-logging-split-between-stdout-and-stderr"""
         def filter(self, rec):
-            return rec.levelno in (logging.DEBUG, logging.INFO)
+            return rec.levelno in (TRACE, logging.DEBUG, logging.INFO)
 
     handler_stdout = logging.StreamHandler(sys.stdout)
     handler_stdout.setFormatter(logging.Formatter(fmt))
-    handler_stdout.setLevel(logging.DEBUG)
+    handler_stdout.setLevel(TRACE)
     handler_stdout.addFilter(InfoFilter())
 
     handler_stderr = logging.StreamHandler(sys.stderr)
@@ -511,7 +3850,7 @@ def setup_logging():
     handler_stderr.setLevel(logging.WARNING)
 
     root_logger = logging.getLogger()
-    root_logger.setLevel(logging.DEBUG if OPTIONS.get('--verbose') else logging.INFO)
+    root_logger.setLevel(TRACE if OPTIONS.get('--trace') else logging.DEBUG if verbose else logging.INFO)
     root_logger.addHandler(handler_stdout)
     root_logger.addHandler(handler_stderr)
 
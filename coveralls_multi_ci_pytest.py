@@ -0,0 +1,74 @@
+"""pytest plugin submitting the coverage pytest-cov measured to Coveralls.io when the session finishes.
+
+setup.py registers this module (not coveralls_multi_ci itself) as a pytest plugin, so every pytest session only loads
+these few hooks. coveralls_multi_ci and its dependencies are imported when --coveralls is given.
+"""
+
+import os
+import time
+
+
+def pytest_addoption(parser):
+    """pytest hook. Adds the plugin's options."""
+    group = parser.getgroup('coveralls_multi_ci', 'submitting coverage to Coveralls.io')
+    group.addoption('--coveralls', action='store_true',
+                    help='submit the coverage measured by pytest-cov (--cov) when the session finishes.')
+    group.addoption('--coveralls-git', metavar='DIR', default='.', help='root git repo directory. default: .')
+    group.addoption('--coveralls-output', metavar='FILE', default='coveralls_multi_ci_payload.txt',
+                    help='temporary payload file. default: coveralls_multi_ci_payload.txt')
+    group.addoption('--coveralls-source', metavar='DIR', default='.', help='source code root directory. default: .')
+
+
+def pytest_sessionfinish(session):
+    """pytest hook. Submits the coverage pytest-cov measured, in-process.
+
+    pytest-cov stops and combines its data and writes its reports at the end of the test loop, before this hook. Its
+    coverage instance is used as it is, instead of having a separate coveralls_multi_ci process load the .coverage
+    file again. Coverage keeps no analyses of its reports to reuse, so every file is analyzed once more, and nothing
+    else uses the instance meanwhile.
+    """
+    config = session.config
+    if not config.getoption('coveralls'):
+        return
+    state = config._coveralls_multi_ci = dict(message=None)
+    controller = getattr(config.pluginmanager.getplugin('_cov'), 'cov_controller', None)
+    cov = getattr(controller, 'cov', None)
+    if cov is None:
+        state['message'] = 'Nothing to submit to Coveralls.io, run with pytest-cov (--cov).'
+        return
+    submit_from_pytest(config, cov)
+
+
+def submit_from_pytest(config, cov):
+    """Submits for pytest_sessionfinish(). Never raises, the outcome is left for pytest_unconfigure() to print.
+
+    Positional arguments:
+    config -- pytest config object.
+    cov -- pytest-cov's coverage instance.
+    """
+    import coveralls_multi_ci
+
+    def get_path(name):
+        return os.path.abspath(os.path.expanduser(config.getoption(name)))
+
+    state = config._coveralls_multi_ci
+    started = time.time()
+    try:
+        repo_dir = get_path('coveralls_git')
+        data_file = os.path.abspath(getattr(cov.config, 'data_file', '.coverage'))
+        git_stats_result = coveralls_multi_ci.git_stats(repo_dir, known=coveralls_multi_ci.select_ci().git_fields())
+        coveralls_multi_ci.submit(data_file, get_path('coveralls_source'), git_stats_result,
+                                  get_path('coveralls_output'), cov=cov)
+        state['message'] = 'Coverage submitted to Coveralls.io in {0:.2f}s.'.format(time.time() - started)
+    except Exception as e:  # Coverage, requests or OS errors too, a failed submission must not go unnoticed.
+        state['message'] = 'Coverage submission to Coveralls.io FAILED: {0}'.format(str(e) or e.__class__.__name__)
+
+
+def pytest_unconfigure(config):
+    """pytest hook. Prints how the submission went."""
+    state = getattr(config, '_coveralls_multi_ci', None)
+    if not state:
+        return
+    reporter = config.pluginmanager.getplugin('terminalreporter')
+    if reporter is not None and state['message']:
+        reporter.write_line(state['message'])
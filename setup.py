@@ -148,9 +148,9 @@ ALL_DATA = dict(
     ],
 
     keywords=KEYWORDS,
-    py_modules=[NAME_FILE],
+    py_modules=[NAME_FILE, NAME_FILE + '_pytest'],
     zip_safe=True,
-    entry_points=dict(console_scripts=get_entry_points()),
+    entry_points=dict(console_scripts=get_entry_points(), pytest11=['{0} = {0}_pytest'.format(NAME_FILE)]),
 
     install_requires=REQUIRES_INSTALL,
     tests_require=REQUIRES_TEST,
@@ -0,0 +1,177 @@
+"""Benchmarks behind the performance numbers quoted in commit messages, run on synthetic projects.
+
+Each command writes its input to a temporary directory, times the code path it measures (and what it's compared with)
+best of --repeat runs and prints a table. Timings depend on the machine, only compare numbers of the same run. Run it
+from the repository root with python -m tests.benchmarks.
+
+Usage:
+    benchmarks json-report [options]
+    benchmarks logging [options]
+    benchmarks spill [options]
+    benchmarks -h | --help
+
+Options:
+    -f --files=NUM      Number of source files in the project. [default: 20000]
+    -h --help           Show this screen.
+    --lines=NUM         Number of lines per source file. [default: 200]
+    -m --max-memory=MB  Budget spill runs with. [default: 50]
+    -r --repeat=NUM     Number of runs of each case, the fastest counts.
+                        [default: 3]
+"""
+
+from __future__ import print_function
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from docopt import docopt
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from coveralls_multi_ci import dump_json_to_disk, json_report, json_report_files, JSONTokenizer, TRACE
+from tests.load_harness import make_project
+
+
+def best_of(repeat, function):
+    """Runs a function `repeat` times and returns the shortest time one run took in seconds."""
+    timings = list()
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def peak_memory(function):
+    """Runs a function once and returns the peak of memory allocated by Python meanwhile as text, empty on Python 2."""
+    if tracemalloc is None:
+        return ''
+    tracemalloc.start()
+    try:
+        function()
+        return 'peak {0:.1f} MB'.format(tracemalloc.get_traced_memory()[1] / 1000.0 / 1000)
+    finally:
+        tracemalloc.stop()
+
+
+def bench_json_report(work_dir, options):
+    """Reading a "coverage json" report with json.load() against streaming it with json_report_files().
+
+    Returns:
+    List of (case, seconds, note) tuples.
+    """
+    repeat = int(options['--repeat'])
+    report_file = make_project(work_dir, files=int(options['--files']), lines=int(options['--lines']))
+
+    def load():
+        with open(report_file) as f:
+            for _ in json.load(f)['files'].items():
+                pass
+
+    def stream():
+        with open(report_file) as f:
+            for _ in json_report_files(JSONTokenizer(f)):
+                pass
+
+    cases = [('json.load()', load), ('json_report_files()', stream),
+             ('json_report()', lambda: json_report(report_file, work_dir))]
+    return [(n, best_of(repeat, f), peak_memory(f)) for n, f in cases]
+
+
+def bench_logging(work_dir, options):
+    """Reading a report and dumping its payload with logging enabled at INFO, DEBUG (--verbose) and TRACE (--trace).
+
+    Log records are formatted like setup_logging() formats them with --verbose and written to os.devnull.
+
+    Returns:
+    List of (case, seconds, note) tuples.
+    """
+    repeat = int(options['--repeat'])
+    report_file = make_project(work_dir, files=int(options['--files']), lines=int(options['--lines']))
+    target_file = os.path.join(work_dir, 'payload.txt')
+
+    def run():
+        if os.path.exists(target_file):
+            os.remove(target_file)
+        payload = dict(service_name='coveralls_multi_ci', source_files=json_report(report_file, work_dir))
+        dump_json_to_disk(payload, target_file)
+
+    root_logger = logging.getLogger()
+    rows = list()
+    with open(os.devnull, 'w') as devnull:
+        handler = logging.StreamHandler(devnull)
+        handler.setFormatter(logging.Formatter('%(asctime)-15s %(levelname)-8s %(funcName)-17s %(message)s'))
+        level, disabled = root_logger.level, logging.root.manager.disable
+        logging.disable(logging.NOTSET)
+        root_logger.addHandler(handler)
+        try:
+            for name in ('INFO', 'DEBUG', 'TRACE'):
+                root_logger.setLevel(TRACE if name == 'TRACE' else getattr(logging, name))
+                rows.append((name, best_of(repeat, run), ''))
+        finally:
+            root_logger.removeHandler(handler)
+            root_logger.setLevel(level)
+            logging.disable(disabled)
+    return rows
+
+
+def bench_spill(work_dir, options):
+    """Reading a report and dumping its payload with all results in memory against with a --max-memory budget.
+
+    The memory held by the results read is measured with tracemalloc (not on Python 2), while they're still in use.
+
+    Returns:
+    List of (case, seconds, note) tuples.
+    """
+    repeat = int(options['--repeat'])
+    report_file = make_project(work_dir, files=int(options['--files']), lines=int(options['--lines']))
+    target_file = os.path.join(work_dir, 'payload.txt')
+    rows = list()
+    budget = int(float(options['--max-memory']) * 1000 * 1000)
+    for name, max_memory in (('in memory', None), ('--max-memory ' + options['--max-memory'], budget)):
+        read = lambda: json_report(report_file, work_dir, max_memory=max_memory)
+        held = ''
+        if tracemalloc is not None:
+            tracemalloc.start()
+            try:
+                source_files = read()
+                megabytes = tracemalloc.get_traced_memory()[0] / 1000.0 / 1000
+                held = 'held {0:.1f} MB for {1} files'.format(megabytes, len(source_files))
+            finally:
+                tracemalloc.stop()
+        rows.append(('read, ' + name, best_of(repeat, read), held))
+
+        def dump():
+            if os.path.exists(target_file):
+                os.remove(target_file)
+            dump_json_to_disk(dict(service_name='coveralls_multi_ci', source_files=read()), target_file)
+        rows.append(('read + dump, ' + name, best_of(repeat, dump), ''))
+    return rows
+
+
+COMMANDS = [('json-report', bench_json_report), ('logging', bench_logging), ('spill', bench_spill)]
+
+
+def main():
+    options = docopt(__doc__)
+    logging.disable(logging.CRITICAL)
+    work_dir = tempfile.mkdtemp()
+    try:
+        rows = [f(work_dir, options) for c, f in COMMANDS if options[c]][0]
+    finally:
+        shutil.rmtree(work_dir)
+
+    print('--files {0} --lines {1}, best of {2}:'.format(options['--files'], options['--lines'], options['--repeat']))
+    for case, seconds, note in rows:
+        print('  {0:<28} {1:8.3f}s  {2}'.format(case, seconds, note))
+
+
+if __name__ == '__main__':
+    main()
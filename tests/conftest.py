@@ -9,24 +9,59 @@ try:
 except ImportError:
     import subprocess as subprocess32
 
+import coveralls_multi_ci
 from coveralls_multi_ci import OPTIONS, setup_logging
+from tests.fake_api import FakeAPIServer
 
 
 OPTIONS.update({
+    '--bandwidth': '10',
     '--coverage': '.coverage',
+    '--dry-run': False,
+    '--fingerprints': None,
+    '--force': False,
     '--git': 'cwd',
+    '--heavy': None,
     '--help': False,
+    '--history': None,
+    '--jobs': '4',
+    '--lcov': None,
+    '--max-memory': None,
+    '--no-daemon': False,
     '--no-delete': False,
     '--output': 'coveralls_multi_ci_payload.txt',
+    '--queue': '16',
     '--quiet': False,
+    '--remap': None,
+    '--resume': False,
+    '--shard-size': None,
+    '--since': None,
+    '--socket': '~/.coveralls_multi_ci.sock',
     '--source': 'cwd',
+    '--top': '10',
+    '--trace': False,
     '--verbose': True,
     '--version': False,
-    'submit': True
+    '<manifest>': None,
+    '<name>': None,
+    'history': False,
+    'inspect': False,
+    'serve': False,
+    'submit': True,
+    'submit-many': False,
 })
 setup_logging()
 
 
+@pytest.fixture
+def api_server(request, monkeypatch):
+    httpd = FakeAPIServer().start()
+    request.addfinalizer(httpd.stop)
+    monkeypatch.setattr(coveralls_multi_ci, 'API_URL', httpd.url)
+    monkeypatch.setattr(coveralls_multi_ci, 'WEBHOOK_URL', httpd.webhook_url)
+    return httpd
+
+
 @pytest.fixture(scope='module')
 def repo_dir(request):
     rd = tempfile.mkdtemp()
@@ -0,0 +1,188 @@
+"""Stand-in for the Coveralls API listening on a real socket, for tests and tests/load_harness.py.
+
+Uploads go through the kernel like they do to coveralls.io, so streaming, chunking and connection reuse are exercised,
+and the server can be made slow, throttled or flaky. It runs in a thread (FakeAPIServer.start()) or as a subprocess:
+python -m tests.fake_api from the repository root prints its URL and serves until interrupted.
+
+Usage:
+    fake_api [options]
+
+Options:
+    -b --bandwidth=NUM      Read request bodies at this many MB/s.
+    -e --error-rate=NUM     Fraction of uploads answered with HTTP 503.
+                            [default: 0]
+    -h --help               Show this screen.
+    -l --latency=NUM        Seconds to wait before each response. [default: 0]
+    -p --port=NUM           Port to listen on, 0 picks a free one. [default: 0]
+"""
+
+from __future__ import print_function
+
+import json
+import random
+import re
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from docopt import docopt
+
+READ_SIZE = 64 * 1024
+
+
+class APIHandler(BaseHTTPRequestHandler):
+    """Accepts whole uploads and, if the server has ranges=True, resumable ones keyed on the multipart boundary.
+    Parallel build webhook calls are recorded as (query string, form body) tuples.
+    """
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API.
+
+    def log_message(self, *_):
+        pass
+
+    def read_body(self):
+        """Reads the request body (Content-Length or chunked), no faster than the server's bandwidth."""
+        start, body, received = time.time(), list(), [0]
+
+        def read(size):
+            while size:
+                data = self.rfile.read(min(size, READ_SIZE))
+                if not data:
+                    return
+                body.append(data)
+                size -= len(data)
+                received[0] += len(data)
+                if self.server.bandwidth:
+                    time.sleep(max(received[0] / float(self.server.bandwidth) - (time.time() - start), 0))
+
+        if self.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+            read(int(self.headers.get('Content-Length', 0)))
+            return b''.join(body)
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            if not size:
+                self.rfile.readline()  # No trailers, just the final CRLF.
+                return b''.join(body)
+            read(size)
+            self.rfile.readline()
+
+    def respond(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for key, value in (headers or dict()).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        start = time.time()
+        body = self.read_body()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            failed = self.server.random.random() < self.server.error_rate
+            job = len(self.server.requests) + 1
+        status = self.handle_upload(body, failed, job)
+        with self.server.lock:
+            self.server.requests.append(dict(path=self.path, bytes=len(body), status=status,
+                                             seconds=time.time() - start))
+
+    def handle_upload(self, body, failed, job):
+        """Answers one request. Returns the HTTP status."""
+        if self.path.startswith('/webhook'):
+            self.server.webhooks.append((self.path.partition('?')[2], body.decode('ascii')))
+            self.respond(200, b'{"done": true}')
+            return 200
+        if failed:
+            self.respond(self.server.error_status, b'{"message": "Service Unavailable", "error": true}')
+            return self.server.error_status
+
+        boundary = self.headers['Content-Type'].split('boundary=')[1]
+        content_range = self.headers.get('Content-Range')
+        with self.server.lock:
+            received = self.server.received.setdefault(boundary, b'')
+            if content_range and not self.server.ranges:
+                status, headers = 400, None
+            elif content_range and content_range.startswith('bytes */'):
+                status, headers = 308, {'Range': 'bytes=0-{0}'.format(len(received) - 1)} if received else None
+            elif content_range:
+                offset = int(re.match(r'bytes (\d+)-', content_range).group(1))
+                self.server.received[boundary] = received[:offset] + body
+                self.server.ranged_bodies.append(body)
+                status, headers = 200, None
+            else:
+                self.server.received[boundary] = body
+                status, headers = 200, None
+        message = json.dumps(dict(message='Job #{0}'.format(job), url='https://coveralls.io/jobs/{0}'.format(job)))
+        self.respond(status, message.encode('ascii') if status == 200 else b'', headers)
+        return status
+
+
+class FakeAPIServer(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server answering like the Coveralls API. Its attributes may be changed while it runs.
+
+    Keyword arguments:
+    port -- port to listen on (on 127.0.0.1), 0 picks a free one.
+    latency -- seconds to wait before each response.
+    bandwidth -- bytes per second request bodies are read at, None for unlimited.
+    error_rate -- fraction of uploads (chosen at random, seeded) answered with error_status.
+    error_status -- HTTP status of failed uploads.
+    ranges -- accept resumed uploads (Content-Range). Otherwise they're answered with HTTP 400.
+    seed -- seed of the random numbers picking failed uploads.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, latency=0.0, bandwidth=None, error_rate=0.0, error_status=503, ranges=True, seed=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), APIHandler)
+        self.latency, self.bandwidth, self.ranges = latency, bandwidth, ranges
+        self.error_rate, self.error_status = error_rate, error_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.received, self.ranged_bodies, self.webhooks, self.requests = dict(), list(), list(), list()
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/api/v1/jobs'.format(self.server_port)
+
+    @property
+    def webhook_url(self):
+        return 'http://127.0.0.1:{0}/webhook'.format(self.server_port)
+
+    def start(self):
+        """Serves in a daemon thread. Returns self."""
+        self.thread = threading.Thread(target=self.serve_forever, kwargs=dict(poll_interval=0.05))  # Quick stop().
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving and closes the socket."""
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+
+def main():
+    options = docopt(__doc__)
+    bandwidth = float(options['--bandwidth']) * 1000 * 1000 if options['--bandwidth'] else None
+    server = FakeAPIServer(int(options['--port']), latency=float(options['--latency']), bandwidth=bandwidth,
+                           error_rate=float(options['--error-rate']))
+    print(server.url)
+    sys.stdout.flush()  # The parent process reads the URL before the server stops.
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""Load harness for the upload path: concurrent submits of synthetic projects against the API stand-in.
+
+Every submit reads the JSON coverage report of a generated project, dumps the payload and POSTs it with the real
+submit() code over a real socket, one requests.Session per worker thread. Throughput and latency percentiles of the
+whole submits are printed at the end. Run it from the repository root with python -m tests.load_harness.
+
+Usage:
+    load_harness [options]
+
+Options:
+    -b --bandwidth=NUM      MB/s the stand-in reads uploads at.
+    -c --concurrency=NUM    Number of submits running at once. [default: 4]
+    -e --error-rate=NUM     Fraction of uploads the stand-in fails with HTTP 503.
+                            [default: 0]
+    -f --files=NUM          Number of source files in the project. [default: 50]
+    -h --help               Show this screen.
+    -l --latency=NUM        Seconds the stand-in waits before each response.
+                            [default: 0]
+    --lines=NUM             Number of lines per source file. [default: 200]
+    -n --submits=NUM        Number of submits. [default: 20]
+    -u --url=URL            Upload to a running stand-in (python -m tests.fake_api)
+                            instead of starting one in a thread.
+"""
+
+from __future__ import print_function
+
+from datetime import datetime
+import json
+import logging
+import math
+from multiprocessing.pool import ThreadPool
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from docopt import docopt
+import requests
+
+import coveralls_multi_ci
+from coveralls_multi_ci import CHECKPOINT_SUFFIX, RUN_AT_FORMAT, submit
+from tests.fake_api import FakeAPIServer
+
+METADATA = dict(repo_token='load', run_at=datetime.utcnow().strftime(RUN_AT_FORMAT), service_name='coveralls_multi_ci',
+                service_number='1')
+
+
+def make_project(root, files=50, lines=200, seed=0):
+    """Writes a synthetic project with a coverage report like "coverage json" writes.
+
+    Lines hold quotes and backslashes so escaping costs what it does for real code, about 80% of them are covered.
+
+    Positional arguments:
+    root -- directory to write the project to.
+
+    Keyword arguments:
+    files -- number of source files.
+    lines -- number of lines per source file.
+    seed -- seed of the random line lengths and covered lines.
+
+    Returns:
+    Path to the report.
+    """
+    rand = random.Random(seed)
+    report = dict(meta=dict(version='7.0'), files=dict())
+    for index in range(files):
+        name = os.path.join('package{0}'.format(index % 10), 'module{0}.py'.format(index))
+        if not os.path.isdir(os.path.dirname(os.path.join(root, name))):
+            os.makedirs(os.path.dirname(os.path.join(root, name)))
+        with open(os.path.join(root, name), 'w') as f:
+            for number in range(1, lines + 1):
+                f.write('value_{0} = "{1}\\\\n"\n'.format(number, 'x' * rand.randint(0, 60)))
+        executed = [n for n in range(1, lines + 1) if rand.random() < 0.8]
+        report['files'][name] = dict(executed_lines=executed,
+                                     missing_lines=sorted(set(range(1, lines + 1)) - set(executed)))
+    report_file = os.path.join(root, 'coverage.json')
+    with open(report_file, 'w') as f:
+        json.dump(report, f)
+    return report_file
+
+
+def run_load(report_file, source_root, work_dir, submits=20, concurrency=4):
+    """Runs submits of one report concurrently.
+
+    Positional arguments:
+    report_file -- return value of make_project().
+    source_root -- directory make_project() wrote to.
+    work_dir -- directory for the payload files, which are deleted after each submit.
+
+    Keyword arguments:
+    submits -- number of submits.
+    concurrency -- number of submits running at once.
+
+    Returns:
+    List of dicts (one per submit) with "ok", "error", "seconds" and "bytes" (payload file size) keys.
+    """
+    local = threading.local()
+    sessions = list()
+
+    def run(index):
+        """Submits once, never raises."""
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+            sessions.append(local.session)
+        target_file = os.path.join(work_dir, 'payload.{0}.txt'.format(index))
+        result = dict(ok=False, error=None, bytes=0)
+        start = time.time()
+        try:
+            submit(report_file, source_root, dict(), target_file, no_delete=True, session=local.session,
+                   metadata=METADATA)
+            result['ok'] = True
+        except (RuntimeError, ValueError) as e:
+            result['error'] = str(e)
+        result['seconds'] = time.time() - start
+        if os.path.exists(target_file):
+            result['bytes'] = os.path.getsize(target_file)
+            os.remove(target_file)
+        if os.path.exists(target_file + CHECKPOINT_SUFFIX):
+            os.remove(target_file + CHECKPOINT_SUFFIX)  # Left by failed uploads.
+        return result
+
+    pool = ThreadPool(max(min(concurrency, submits), 1))
+    try:
+        return pool.map(run, range(submits))
+    finally:
+        pool.close()
+        pool.join()
+        for session in sessions:
+            session.close()
+
+
+def percentile(values, percent):
+    """Returns the nearest-rank percentile of a non-empty list of numbers."""
+    ordered = sorted(values)
+    return ordered[max(int(math.ceil(percent / 100.0 * len(ordered))) - 1, 0)]
+
+
+def summarize(results, seconds):
+    """Totals the return value of run_load().
+
+    Positional arguments:
+    results -- return value of run_load().
+    seconds -- wall clock time run_load() took.
+
+    Returns:
+    Dict with submits, failed, submits_per_second, mb_per_second (of payloads uploaded successfully) and p50, p90, p99
+    and max latency keys.
+    """
+    latencies = [r['seconds'] for r in results]
+    uploaded = sum(r['bytes'] for r in results if r['ok'])
+    summary = dict(submits=len(results), failed=len([r for r in results if not r['ok']]),
+                   submits_per_second=len(results) / seconds, mb_per_second=uploaded / seconds / 1000 / 1000,
+                   max=max(latencies))
+    for percent in (50, 90, 99):
+        summary['p{0}'.format(percent)] = percentile(latencies, percent)
+    return summary
+
+
+def main():
+    options = docopt(__doc__)
+    logging.disable(logging.CRITICAL)  # Failed uploads are counted in the summary instead.
+    server = None
+    if not options['--url']:
+        bandwidth = float(options['--bandwidth']) * 1000 * 1000 if options['--bandwidth'] else None
+        server = FakeAPIServer(latency=float(options['--latency']), bandwidth=bandwidth,
+                               error_rate=float(options['--error-rate'])).start()
+    coveralls_multi_ci.API_URL = options['--url'] or server.url
+    work_dir = tempfile.mkdtemp()
+    try:
+        report_file = make_project(work_dir, files=int(options['--files']), lines=int(options['--lines']))
+        start = time.time()
+        results = run_load(report_file, work_dir, work_dir, submits=int(options['--submits']),
+                           concurrency=int(options['--concurrency']))
+        summary = summarize(results, time.time() - start)
+    finally:
+        shutil.rmtree(work_dir)
+        if server is not None:
+            server.stop()
+
+    print('{submits} submits ({failed} failed): {submits_per_second:.1f} submits/s, {mb_per_second:.2f} MB/s '
+          'uploaded.'.format(**summary))
+    print('Latency p50 {p50:.3f}s, p90 {p90:.3f}s, p99 {p99:.3f}s, max {max:.3f}s.'.format(**summary))
+    for error in sorted(set(r['error'] for r in results if r['error'])):
+        print('Error: {0}'.format(error))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+import pytest
+
+from tests.benchmarks import bench_json_report, bench_logging, bench_spill
+
+OPTIONS = {'--files': '3', '--lines': '20', '--max-memory': '0.001', '--repeat': '1'}
+
+
+@pytest.mark.parametrize('bench', [bench_json_report, bench_logging, bench_spill])
+def test_bench(tmpdir, bench):
+    rows = bench(str(tmpdir), OPTIONS)
+    assert rows
+    assert all(seconds >= 0 for _, seconds, _ in rows)
@@ -0,0 +1,81 @@
+import json
+import os
+
+import pytest
+
+from coveralls_multi_ci import analyze_coverage, branch_coverage, coverage, json_report, PathRemapper
+
+ROOT = os.path.abspath(os.path.expanduser(os.path.dirname(__file__)))
+
+
+def test_branch_coverage():
+    assert [] == branch_coverage([], [])
+    assert [] == branch_coverage([(-1, 1), (1, 2), (2, -1)], [(-1, 1), (1, 2), (2, -1)])  # No branches.
+
+    # project/library/sub.py: "if condition:" on line 2 jumps to line 3 or line 6, only line 3 ran.
+    possible = [(-1, 1), (1, -1), (-1, 2), (2, 3), (2, 6), (3, 4), (4, -1), (6, 7), (7, -1)]
+    executed = [(-1, 1), (1, -1), (-1, 2), (2, 3), (3, 4), (4, -1)]
+    assert [2, 0, 0, 1, 2, 0, 1, 0] == branch_coverage(possible, executed)
+
+    # Order of arcs doesn't matter, lists (like from JSON) work too.
+    assert [2, 0, 0, 1, 2, 0, 1, 0] == branch_coverage(reversed(possible), [[2, 3]])
+    assert [2, 0, 0, 1, 2, 0, 1, 1, 5, 0, 0, 0, 5, 0, 1, 0] == branch_coverage(
+        [(2, 3), (2, 6), (5, 6), (5, 8)], [(2, 3), (2, 6)])
+
+
+def test_json_report(tmpdir):
+    report = tmpdir.join('coverage.json')
+    report.write(json.dumps(dict(files={
+        'project/library/sub.py': dict(executed_lines=[1, 2, 3, 4], missing_lines=[6, 7],
+                                       executed_branches=[[2, 3]], missing_branches=[[2, 6]]),
+        'project/main.py': dict(executed_lines=[1, 4, 5, 6], missing_lines=[8, 9]),
+    })))
+
+    actual = json_report(str(report), os.path.join(ROOT, 'sample_project'))
+    assert [2, 0, 0, 1, 2, 0, 1, 0] == actual[0]['branches']
+    assert 'branches' not in actual[1]
+
+
+def test_analyze_coverage(tmpdir):
+    if not hasattr(coverage, 'get_data'):
+        pytest.skip('Live coverage data needs coverage 4+.')
+    source_root = os.path.join(ROOT, 'sample_project')
+    main_py = os.path.join(source_root, 'project', 'main.py')
+    cov = coverage(data_file=str(tmpdir.join('.coverage')), branch=True)
+    cov.get_data().add_arcs({main_py: dict.fromkeys([(-1, 1), (1, 4), (4, -4), (-4, 5), (5, 6), (6, -4)])})
+
+    actual = analyze_coverage(cov, source_root)
+    assert [1, None, None, 1, 1, 1, None, 0, 0] == actual[0]['coverage']
+    assert [5, 0, 0, 1, 5, 0, 1, 0] == actual[0]['branches']  # "if condition:" only went to line 6.
+
+
+def test_analyze_coverage_plugin(tmpdir, monkeypatch):
+    if not hasattr(coverage, 'get_data'):
+        pytest.skip('Live coverage data needs coverage 4+.')
+    tmpdir.join('template_plugin.py').write(
+        'import coverage\n\n\n'
+        'class Reporter(coverage.FileReporter):\n'
+        '    def lines(self):\n'
+        '        return set([1, 2])\n\n\n'
+        'class Plugin(coverage.CoveragePlugin):\n'
+        '    def file_reporter(self, filename):\n'
+        '        return Reporter(filename)\n\n\n'
+        'def coverage_init(reg, options):\n'
+        '    reg.add_file_tracer(Plugin())\n')
+    monkeypatch.syspath_prepend(str(tmpdir))
+    tmpdir.join('.coveragerc').write('[run]\nbranch = True\nplugins = template_plugin\n')
+    source_root = str(tmpdir.ensure('src', dir=True))
+    tmpdir.join('src', 'page.html').write('<p>{{ page }}</p>\n{{ footer }}\n')
+    tmpdir.join('src', 'moved.html').write('<p>{{ moved }}</p>\n')
+    page_html = os.path.join(source_root, 'page.html')
+
+    cov = coverage(data_file=str(tmpdir.join('.coverage')), config_file=str(tmpdir.join('.coveragerc')))
+    cov.load()
+    cov.get_data().add_arcs({page_html: dict.fromkeys([(-1, 1), (1, -1)]),
+                             '/app/moved.html': dict.fromkeys([(-1, 1), (1, -1)])})
+    cov.get_data().add_file_tracers({page_html: 'template_plugin.Plugin', '/app/moved.html': 'template_plugin.Plugin'})
+
+    # Reported by the plugin, never parsed as Python. Remapped, the plugin can't report it, so it's skipped.
+    actual = analyze_coverage(cov, source_root, remap=PathRemapper([('/app', source_root)]))
+    assert [('page.html', [1, 0])] == [(a['name'], a['coverage']) for a in actual]
+    assert 'branches' not in actual[0]
@@ -0,0 +1,53 @@
+import json
+import os
+
+import pytest
+
+from coveralls_multi_ci import changed_files, json_report
+
+try:
+    import subprocess32
+except ImportError:
+    import subprocess as subprocess32
+
+ROOT = os.path.abspath(os.path.expanduser(os.path.dirname(__file__)))
+
+
+def test_changed_files(tmpdir):
+    rd = str(tmpdir)
+    subprocess32.check_call(['git', 'init'], cwd=rd)
+    subprocess32.check_call(['git', 'config', '--local', 'user.name', 'MrCommit'], cwd=rd)
+    subprocess32.check_call(['git', 'config', '--local', 'user.email', 'mc@aol.com'], cwd=rd)
+    tmpdir.join('a.py').write('a = 1\n')
+    tmpdir.join('b.py').write('b = 1\n')
+    subprocess32.check_call(['git', 'add', 'a.py', 'b.py'], cwd=rd)
+    subprocess32.check_call(['git', 'commit', '-m', 'Base.'], cwd=rd)
+    subprocess32.check_call(['git', 'tag', 'base'], cwd=rd)
+
+    assert set() == changed_files(rd, 'base')
+
+    tmpdir.join('b.py').write('b = 2\n')
+    tmpdir.join('pkg', 'c.py').write('c = 1\n', ensure=True)
+    subprocess32.check_call(['git', 'add', 'b.py', 'pkg/c.py'], cwd=rd)
+    subprocess32.check_call(['git', 'commit', '-m', 'Feature.'], cwd=rd)
+    tmpdir.join('a.py').write('a = 2\n')  # Uncommitted.
+
+    expected = set([os.path.join(rd, 'a.py'), os.path.join(rd, 'b.py'), os.path.join(rd, 'pkg', 'c.py')])
+    assert expected == changed_files(rd, 'base')
+
+    with pytest.raises(RuntimeError):
+        changed_files(rd, 'does_not_exist')
+
+
+def test_only(tmpdir):
+    report = tmpdir.join('coverage.json')
+    report.write(json.dumps(dict(files={
+        'project/library/sub.py': dict(executed_lines=[1, 2, 3, 4], missing_lines=[6, 7]),
+        'project/main.py': dict(executed_lines=[1, 4, 5, 6], missing_lines=[8, 9]),
+    })))
+    source_root = os.path.join(ROOT, 'sample_project')
+
+    actual = json_report(str(report), source_root, only=set([os.path.join(source_root, 'project', 'main.py')]))
+    assert ['project/main.py'] == [a['name'] for a in actual]
+    with pytest.raises(RuntimeError):
+        json_report(str(report), source_root, only=set())
@@ -0,0 +1,19 @@
+from coveralls_multi_ci import coverage_totals, coverage_vector
+
+
+def test_coverage_vector():
+    assert [] == coverage_vector(0, [], [])
+    assert [None, None, None] == coverage_vector(3, [], [])
+    assert [1, None, None, 1, 1, 1, None, 0, 0] == coverage_vector(9, [1, 4, 5, 6], [8, 9])
+    assert [0, 1, None] == coverage_vector(3, set([1, 2]), (i for i in [1]))  # Missing overrides covered.
+
+    vector = coverage_vector(5000, range(1, 5001, 2), range(2, 5001, 4))
+    assert [1, 0, 1, None, 1, 0] == vector[:6]
+    assert (3750, 2500) == coverage_totals(vector)
+    assert all(type(v) is int for v in vector if v is not None)
+
+
+def test_coverage_totals():
+    assert (0, 0) == coverage_totals([])
+    assert (6, 4) == coverage_totals([1, None, None, 1, 1, 1, None, 0, 0])
+    assert (2, 1) == coverage_totals([None, 0, 12])
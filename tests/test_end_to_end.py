@@ -1,5 +1,4 @@
 from datetime import datetime
-import imp
 import json
 import os
 
@@ -17,9 +16,7 @@ def execute(environ, options):
     original_options = coveralls_multi_ci.OPTIONS.copy()
     os.environ.clear()
     os.environ.update(environ)
-    imp.reload(coveralls_multi_ci)
 
-    coveralls_multi_ci.OPTIONS.update(original_options)
     coveralls_multi_ci.OPTIONS.update({
         '--coverage': os.path.join(ROOT, 'sample_project', 'coverage_project_full'),
         '--source': os.path.join(ROOT, 'sample_project'),
@@ -0,0 +1,68 @@
+import json
+import os
+
+import coveralls_multi_ci
+from coveralls_multi_ci import read_fingerprints, store_fingerprint, submission_fingerprint, submit
+
+ROOT = os.path.abspath(os.path.expanduser(os.path.dirname(__file__)))
+SOURCE_ROOT = os.path.join(ROOT, 'sample_project')
+
+
+def test_store(tmpdir, monkeypatch):
+    monkeypatch.setattr(coveralls_multi_ci, 'FINGERPRINTS_KEEP', 3)
+    index_file = str(tmpdir.join('fingerprints'))
+    assert set() == read_fingerprints(index_file)
+    for fingerprint in ('a', 'b', 'c', 'a', 'd'):
+        store_fingerprint(index_file, fingerprint)
+    assert set(['a', 'c', 'd']) == read_fingerprints(index_file)
+    store_fingerprint(str(tmpdir.join('dne', 'fingerprints')), 'a')  # Logged, not raised.
+
+
+def test_submit(tmpdir, api_server):
+    report = tmpdir.join('coverage.json')
+    report.write(json.dumps(dict(meta=dict(version='7.0'), files={
+        'project/library/sub.py': dict(executed_lines=[1, 2, 3, 4], missing_lines=[6, 7]),
+        'project/__init__.py': dict(executed_lines=[], missing_lines=[]),
+    })))
+    index_file = str(tmpdir.join('fingerprints'))
+    metadata = dict(run_at='2015-01-01 00:00:00 +0000', repo_token='abc', service_name='coveralls_multi_ci')
+    target_file = str(tmpdir.join('payload.txt'))
+    kwargs = dict(no_delete=True, metadata=metadata, fingerprints=index_file)
+
+    submit(str(report), SOURCE_ROOT, dict(head=dict(id='1234'), branch='master'), target_file, **kwargs)
+    assert 1 == len(api_server.received)
+    assert 1 == len(read_fingerprints(index_file))
+    os.remove(target_file)
+
+    # Same everything but run_at, skipped before dumping.
+    kwargs['metadata'] = dict(metadata, run_at='2015-01-02 00:00:00 +0000')
+    submit(str(report), SOURCE_ROOT, dict(head=dict(id='1234'), branch='master'), target_file, **kwargs)
+    assert 1 == len(api_server.received)
+    assert not os.path.exists(target_file)
+
+    submit(str(report), SOURCE_ROOT, dict(head=dict(id='1234'), branch='master'), target_file, force=True, **kwargs)
+    assert 2 == len(api_server.received)
+    assert 1 == len(read_fingerprints(index_file))
+    os.remove(target_file)
+
+    # Different HEAD.
+    submit(str(report), SOURCE_ROOT, dict(head=dict(id='5678'), branch='master'), target_file, **kwargs)
+    assert 3 == len(api_server.received)
+    assert 2 == len(read_fingerprints(index_file))
+
+
+def test_fingerprint(tmpdir):
+    report = tmpdir.join('coverage.json')
+    report.write('{}')
+    source = tmpdir.join('source.py')
+    source.write('a = 1\n')
+    placeholder = coveralls_multi_ci.source_file_entry(str(source), str(tmpdir) + '/', [1], [])['source']
+    payload = dict(run_at='now', service_job_id='1', source_files=[dict(name='source.py', source=placeholder)])
+    expected = submission_fingerprint(str(report), payload)
+    assert expected == submission_fingerprint(str(report), dict(payload, run_at='later'))
+    assert expected != submission_fingerprint(str(report), dict(payload, service_job_id='2'))
+
+    source.setmtime(source.mtime() - 10)
+    assert expected != submission_fingerprint(str(report), payload)
+    report.write('{ }')
+    assert expected != submission_fingerprint(str(report), payload)
@@ -0,0 +1,103 @@
+import json
+import os
+
+import pytest
+
+import coveralls_multi_ci
+from coveralls_multi_ci import GIT_STATS_CACHE, git_state, git_stats
+
+try:
+    import subprocess32
+except ImportError:
+    import subprocess as subprocess32
+
+
+@pytest.fixture
+def commands(monkeypatch):
+    ran = list()
+    check_output = coveralls_multi_ci.subprocess32.check_output
+
+    def record(command, **kwargs):
+        ran.append(command)
+        return check_output(command, **kwargs)
+    monkeypatch.setattr(coveralls_multi_ci.subprocess32, 'check_output', record)
+    return ran
+
+
+def test_hit(repo_dir, commands):
+    cache_file = os.path.join(repo_dir, '.git', GIT_STATS_CACHE)
+    if os.path.exists(cache_file):
+        os.remove(cache_file)  # repo_dir is shared by the module's tests.
+    expected = git_stats(repo_dir)
+    assert commands
+    assert os.path.isfile(cache_file)
+
+    del commands[:]
+    assert expected == git_stats(repo_dir)
+    assert [] == commands
+
+    assert 'feature' == git_stats(repo_dir, known=dict(branch='feature'))['branch']  # Known fields are in the key.
+    assert commands
+
+
+@pytest.mark.parametrize('change', ['commit', 'checkout', 'tag', 'branch', 'remote'])
+def test_invalidated(repo_dir, commands, change):
+    before = git_stats(repo_dir)
+    state = git_state(repo_dir)
+    git = lambda *a: subprocess32.check_call(('git',) + a, cwd=repo_dir)
+    if change == 'commit':
+        git('commit', '--allow-empty', '-m', 'Another one.')
+    elif change == 'checkout':
+        git('checkout', '-q', '-b', 'feature')
+    elif change == 'tag':
+        git('checkout', '-q', before['head']['id'])
+        git_stats(repo_dir)
+        state = git_state(repo_dir)
+        git('tag', 'v1.0')
+    elif change == 'branch':
+        git('branch', 'other')
+    else:
+        git('remote', 'add', 'upstream', 'http://localhost/upstream.git')
+    assert state != git_state(repo_dir)
+
+    del commands[:]
+    after = git_stats(repo_dir)
+    assert commands
+    if change == 'commit':
+        assert 'Another one.' == after['head']['message']
+    elif change == 'checkout':
+        assert 'feature' == after['branch']
+    elif change == 'tag':
+        assert 'v1.0' == after['branch']
+    elif change == 'remote':
+        assert ['origin', 'upstream'] == sorted(r['name'] for r in after['remotes'])
+
+
+def test_unusable(repo_dir, tmpdir, monkeypatch):
+    assert git_state(str(tmpdir)) is None
+    cache_file = os.path.join(repo_dir, '.git', GIT_STATS_CACHE)
+    with open(cache_file, 'w') as f:
+        f.write('{"key": ')  # Truncated, ignored.
+    expected = git_stats(repo_dir)
+    with open(cache_file) as f:
+        assert expected == json.load(f)['result']
+
+    def fail(*_, **__):
+        raise OSError
+    monkeypatch.setattr(coveralls_multi_ci.subprocess32, 'check_output', fail)
+    known = dict(id='abc123', branch='x')
+    assert dict(branch='x', head=dict(id='abc123'), remotes=[]) == git_stats(repo_dir, known=known)
+    monkeypatch.undo()
+    assert expected == git_stats(repo_dir)
+
+
+def test_worktree(repo_dir, tmpdir):
+    branch = git_stats(repo_dir)['branch']
+    worktree = str(tmpdir.join('worktree'))
+    subprocess32.check_call(['git', 'worktree', 'add', '-q', '-b', 'in_worktree', worktree], cwd=repo_dir)
+    assert os.path.isfile(os.path.join(worktree, '.git'))
+    state = git_state(worktree)
+    assert state is not None and state != git_state(repo_dir)
+    assert 'in_worktree' == git_stats(worktree)['branch']
+    assert branch == git_stats(repo_dir)['branch']
+    assert 'in_worktree' == git_stats(worktree)['branch']
@@ -0,0 +1,52 @@
+import pytest
+
+import coveralls_multi_ci
+from coveralls_multi_ci import GIT_HEAD_FIELDS, git_stats, JenkinsCI, TravisCI
+
+HEAD = dict(id='abc123', author_name='MrsAuthor', author_email='ma@aol.com', committer_name='MrCommit',
+            committer_email='mc@aol.com', message='Committing empty file.')
+
+
+@pytest.fixture
+def commands(monkeypatch):
+    ran = list()
+    check_output = coveralls_multi_ci.subprocess32.check_output
+
+    def record(command, **kwargs):
+        ran.append(command[1] if command[1] != '--no-pager' else command[2])
+        return check_output(command, **kwargs)
+    monkeypatch.setattr(coveralls_multi_ci.subprocess32, 'check_output', record)
+    return ran
+
+
+def test_everything_known(tmpdir, commands):
+    known = dict(branch='master', remotes=[dict(name='origin', url='http://localhost/git.git')], **HEAD)
+    assert dict(branch='master', remotes=known['remotes'], head=HEAD) == git_stats(str(tmpdir), known=known)
+    assert [] == commands
+
+
+def test_some_known(repo_dir, commands):
+    known = dict(id='abc123', branch='feature', message='From the CI.')
+    actual = git_stats(repo_dir, known=known)
+    assert ['log', 'remote'] == sorted(commands)  # Run concurrently.
+    assert 'feature' == actual['branch']
+    assert ('abc123', 'From the CI.') == (actual['head']['id'], actual['head']['message'])
+    assert set(GIT_HEAD_FIELDS) == set(actual['head'])
+    assert [dict(name='origin', url='http://localhost/git.git')] == actual['remotes']
+
+    del commands[:]
+    git_stats(repo_dir, known=dict(branch='feature', remotes=list()))
+    assert ['log'] == commands
+
+
+def test_no_repo(tmpdir):
+    assert dict() == git_stats(str(tmpdir), known=dict(branch='master'))
+    expected = dict(branch='master', remotes=[], head=dict(id='abc123'))
+    assert expected == git_stats(str(tmpdir), known=dict(id='abc123', branch='master'))
+
+
+def test_git_fields(monkeypatch):
+    monkeypatch.setattr(TravisCI, 'GIT', dict(id='abc123', branch='master', message=None))
+    assert dict(id='abc123', branch='master') == TravisCI.git_fields()
+    monkeypatch.setattr(JenkinsCI, 'GIT', dict(id='abc123', remote_url='http://localhost/git.git'))
+    assert dict(id='abc123', remotes=[dict(name='origin', url='http://localhost/git.git')]) == JenkinsCI.git_fields()
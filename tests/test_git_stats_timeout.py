@@ -0,0 +1,61 @@
+import os
+import time
+
+import pytest
+
+import coveralls_multi_ci
+from coveralls_multi_ci import GIT_STATS_CACHE, git_stats
+
+
+@pytest.fixture
+def slow(monkeypatch, repo_dir):
+    """Delays git subcommands by the seconds in the returned dict, e.g. slow['remote'] = 5."""
+    delays = dict()
+    check_output = coveralls_multi_ci.subprocess32.check_output
+
+    def delayed(command, **kwargs):
+        delay = delays.get(command[1] if command[1] != '--no-pager' else command[2])
+        if delay:
+            command = ['sh', '-c', 'sleep {0}; exec "$@"'.format(delay), 'sh'] + list(command)
+        return check_output(command, **kwargs)
+    monkeypatch.setattr(coveralls_multi_ci.subprocess32, 'check_output', delayed)
+    cache_file = os.path.join(repo_dir, '.git', GIT_STATS_CACHE)
+    if os.path.exists(cache_file):
+        os.remove(cache_file)  # repo_dir is shared by the module's tests.
+    return delays
+
+
+def test_concurrent(repo_dir, slow):
+    expected = git_stats(repo_dir)
+    os.remove(os.path.join(repo_dir, '.git', GIT_STATS_CACHE))
+    slow.update(remote=0.5, log=0.5, **{'show-ref': 0.5, 'rev-parse': 0.5})
+    start = time.time()
+    assert expected == git_stats(repo_dir)
+    assert time.time() - start < 1.5  # One after another they'd take 2.5 seconds.
+
+
+def test_timeout(repo_dir, slow):
+    expected = git_stats(repo_dir)
+    os.remove(os.path.join(repo_dir, '.git', GIT_STATS_CACHE))
+    slow['remote'] = 10
+    start = time.time()
+    actual = git_stats(repo_dir, timeout=0.5)
+    assert time.time() - start < 5
+    assert dict(expected, remotes=[]) == actual
+    assert not os.path.exists(os.path.join(repo_dir, '.git', GIT_STATS_CACHE))  # Partial results aren't cached.
+
+    known = dict(remotes=[dict(name='upstream', url='http://localhost/upstream.git')])
+    slow.update(remote=0, log=10)
+    assert dict() == git_stats(repo_dir, known=known, timeout=0.5)  # No commit ID.
+    actual = git_stats(repo_dir, known=dict(known, id='abc123'), timeout=0.5)
+    assert dict(head=dict(id='abc123'), branch=expected['branch'], remotes=known['remotes']) == actual
+
+
+def test_deadline(repo_dir, slow):
+    expected = git_stats(repo_dir)
+    os.remove(os.path.join(repo_dir, '.git', GIT_STATS_CACHE))
+    slow.update(remote=10, **{'rev-parse': 10})
+    start = time.time()
+    actual = git_stats(repo_dir, timeout=10, deadline=1)
+    assert time.time() - start < 5
+    assert dict(head=expected['head'], remotes=[]) == actual
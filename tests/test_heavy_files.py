@@ -0,0 +1,75 @@
+import hashlib
+import json
+
+import pytest
+
+import coveralls_multi_ci
+from coveralls_multi_ci import (count_lines, dump_json_to_disk, HeavyFilePolicy, inspect_payload, json_report,
+                                MAX_LINE_LENGTH, payload_stats, read_heavy_rules, scan_source)
+
+
+def write_project(tmpdir):
+    tmpdir.join('plain.py').write('a = 1\nb = "\\\\"\n')
+    tmpdir.join('stub_pb2.py').write('# Generated by the protocol buffer compiler.  DO NOT EDIT!\n' + 'x = 1\n' * 5)
+    tmpdir.join('data.py').write('DATA = "{0}"\nDONE = True\n'.format('z' * 3000))
+    tmpdir.join('blob.py').write_binary(b'a = 1\n\0\0\0\nb = 2\n')
+    report = tmpdir.join('coverage.json')
+    report.write(json.dumps(dict(meta=dict(version='7.0'), files={
+        'plain.py': dict(executed_lines=[1, 2], missing_lines=[]),
+        'stub_pb2.py': dict(executed_lines=[2, 3], missing_lines=[4]),
+        'data.py': dict(executed_lines=[1], missing_lines=[2]),
+        'blob.py': dict(executed_lines=[1], missing_lines=[3]),
+    })))
+    return str(report)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 1024 * 1024])
+def test_scan_source(tmpdir, monkeypatch, chunk_size):
+    monkeypatch.setattr(coveralls_multi_ci, 'CHUNK_SIZE', chunk_size)
+    for content in (b'', b'a', b'a\n', b'a\r\nb\r\n', b'a\rb\r', b'a\r\n\r\nb', b'\r\r\n\n\r', b'a\n\nb\r\nc'):
+        path = tmpdir.join('source.py')
+        path.write_binary(content)
+        assert (count_lines(str(path)), None, None) == scan_source(str(path))
+
+    tmpdir.join('stub_pb2.py').write('# @generated\nx = 1\n')
+    tmpdir.join('min.js').write('x' * (MAX_LINE_LENGTH + 1))
+    tmpdir.join('blob.bin').write_binary(b'\0' * 3)
+    tmpdir.join('tail.js').write('x = 1\n' * 20000 + 'y' * 2000)  # Long line only in the last block.
+    assert (2, 'generated') == scan_source(str(tmpdir.join('stub_pb2.py')))[:2]
+    assert (1, 'minified') == scan_source(str(tmpdir.join('min.js')))[:2]
+    assert (1, 'binary', hashlib.md5(b'\0' * 3).hexdigest()) == scan_source(str(tmpdir.join('blob.bin')))
+    assert (20001, 'minified') == scan_source(str(tmpdir.join('tail.js')))[:2]
+
+
+def test_read_heavy_rules():
+    assert dict(binary='exclude', generated='digest', minified='truncate') == read_heavy_rules(
+        'binary=exclude, generated=digest,minified=truncate')
+    assert dict(binary='exclude', generated='digest', minified='digest') == read_heavy_rules('digest,binary=exclude')
+    for rules in ('generated=drop', 'vendored=digest', 'generated='):
+        with pytest.raises(RuntimeError):
+            read_heavy_rules(rules)
+
+
+def test_policy(tmpdir, caplog):
+    report = write_project(tmpdir)
+    heavy = HeavyFilePolicy(dict(binary='exclude', generated='digest', minified='truncate'))
+    source_files = json_report(report, str(tmpdir), heavy=heavy)
+    by_name = dict((f['name'], f) for f in source_files)
+    assert ['data.py', 'plain.py', 'stub_pb2.py'] == sorted(by_name)  # blob.py excluded.
+    assert 'source' not in by_name['stub_pb2.py']
+    assert hashlib.md5(tmpdir.join('stub_pb2.py').read_binary()).hexdigest() == by_name['stub_pb2.py']['source_digest']
+    assert [None, 1, 1, 0, None, None] == by_name['stub_pb2.py']['coverage']
+    size = lambda n: tmpdir.join(n).size()
+    assert dict(digest=[1, size('stub_pb2.py')], exclude=[1, size('blob.py')],
+                truncate=[1, size('data.py') - 2 * (MAX_LINE_LENGTH + 1)]) == heavy.saved
+
+    heavy.report()
+    assert 'Excluded 1 generated/minified/binary file(s), about 16 bytes of source code saved.' in caplog.text
+
+    payload = dict(service_name='coveralls_multi_ci', source_files=source_files)
+    target_file = tmpdir.join('payload.txt')
+    dump_json_to_disk(payload, str(target_file))
+    sources = dict((f['name'], f.get('source')) for f in json.loads(target_file.read())['source_files'])
+    assert 'DATA = "{0}\nDONE = True\n'.format('z' * (MAX_LINE_LENGTH - 8)) == sources['data.py']
+    assert target_file.size() == payload_stats(payload)['payload_bytes']
+    assert 0 == inspect_payload(str(target_file))['problems']
@@ -0,0 +1,91 @@
+import logging
+import sqlite3
+
+import pytest
+
+from coveralls_multi_ci import history_regressions, history_trend, record_history, show_history
+
+try:
+    import subprocess32
+except ImportError:
+    import subprocess as subprocess32
+
+
+def payload(sha, files, branch='master'):
+    source_files = [dict(name=n, source='', coverage=[1] * covered + [0] * (relevant - covered))
+                    for n, (relevant, covered) in sorted(files.items())]
+    return dict(git=dict(head=dict(id=sha), branch=branch), source_files=source_files)
+
+
+@pytest.fixture
+def history(tmpdir):
+    path = str(tmpdir.join('history.db'))
+    record_history(path, payload('a' * 40, {'a.py': (10, 10), 'b.py': (10, 8), 'c.py': (4, 2)}))
+    record_history(path, payload('b' * 40, {'a.py': (10, 9), 'b.py': (10, 4), 'c.py': (4, 3)}, branch='feature'))
+    record_history(path, payload('c' * 40, {'a.py': (12, 9)}, branch='feature'))
+    return path
+
+
+def test_record(history):
+    record_history(history, payload('c' * 40, {'b.py': (10, 10)}))  # Same commit, another coverage file.
+    connection = sqlite3.connect(history)
+    assert [('a' * 40, 'master'), ('b' * 40, 'feature'), ('c' * 40, 'master')] == connection.execute(
+        'SELECT sha, branch FROM commits ORDER BY recorded_at').fetchall()
+    query = ('SELECT name, relevant, covered FROM coverage JOIN paths ON paths.id = path_id '
+             'JOIN commits ON commits.id = commit_id WHERE sha = ? ORDER BY name')
+    assert [('a.py', 12, 9), ('b.py', 10, 10)] == connection.execute(query, ('c' * 40,)).fetchall()
+    connection.close()
+
+    record_history(history, dict(source_files=list()))  # No git commit ID, nothing recorded.
+    assert 3 == len(history_trend(history))
+
+
+def test_regressions(history):
+    base, regressions = history_regressions(history, 'b' * 40)
+    assert 'a' * 40 == base
+    assert ['b.py', 'a.py'] == [r['name'] for r in regressions]  # 80% -> 40%, then 100% -> 90%.
+    assert dict(name='b.py', base_relevant=10, base_covered=8, relevant=10, covered=4) == regressions[0]
+    assert ['b.py'] == [r['name'] for r in history_regressions(history, 'b' * 40, top=1)[1]]
+
+    assert ['a.py'] == [r['name'] for r in history_regressions(history, 'c' * 40, base_sha='a' * 40)[1]]
+    assert (None, []) == history_regressions(history, 'a' * 40)  # Nothing recorded before.
+    assert (None, []) == history_regressions(history, 'c' * 40, base_sha='d' * 40)
+    with pytest.raises(RuntimeError):
+        history_regressions(history, 'd' * 40)
+
+
+def test_trend(history):
+    trend = history_trend(history, name='a.py')
+    assert [('a' * 40, 10), ('b' * 40, 9), ('c' * 40, 9)] == [(t['sha'], t['covered']) for t in trend]
+    assert ['b' * 40, 'c' * 40] == [t['sha'] for t in history_trend(history, name='a.py', limit=2)]
+    assert [(24, 20), (24, 16), (12, 9)] == [(t['relevant'], t['covered']) for t in history_trend(history)]
+    assert [] == history_trend(history, name='d.py')
+
+
+def test_show_history(tmpdir, caplog):
+    rd = str(tmpdir.join('repo').ensure(dir=True))
+    git = lambda *a: subprocess32.check_output(('git',) + a, cwd=rd).decode('ascii').strip()
+    git('init')
+    git('config', '--local', 'user.name', 'MrCommit')
+    git('config', '--local', 'user.email', 'mc@aol.com')
+    git('commit', '--allow-empty', '-m', 'Base.')
+    git('tag', 'base')
+    base_sha = git('rev-parse', 'HEAD')
+    git('commit', '--allow-empty', '-m', 'Feature.')
+    sha = git('rev-parse', 'HEAD')
+
+    path = str(tmpdir.join('history.db'))
+    with pytest.raises(RuntimeError):
+        show_history(path, rd)  # Not recorded yet.
+    record_history(path, payload(base_sha, {'a.py': (10, 10), 'b.py': (10, 8)}))
+    record_history(path, payload('f' * 40, {'a.py': (10, 0)}))
+    record_history(path, payload(sha, {'a.py': (10, 10), 'b.py': (10, 7)}))
+
+    assert [] == show_history(path, rd)  # Against the commit recorded before, a.py went up.
+    assert ['b.py'] == [r['name'] for r in show_history(path, rd, since='base')]
+    errors = [r.getMessage() for r in caplog.records if r.levelno == logging.ERROR]
+    assert ' 80.00% ->  70.00%      7/10     covered  b.py' == errors[-1]
+
+    assert [] == show_history(path, rd, name='a.py')
+    with pytest.raises(RuntimeError):
+        show_history(path, rd, name='c.py')
@@ -0,0 +1,113 @@
+from base64 import b64encode
+import json
+import os
+
+import pytest
+
+from coveralls_multi_ci import dump_json_to_disk, inspect_payload, JSONTokenizer, payload_intact
+
+ROOT = os.path.abspath(os.path.expanduser(os.path.dirname(__file__)))
+
+
+def placeholder(*path):
+    return 'PLACEHOLDER_{0}_'.format(b64encode(os.path.join(ROOT, 'sample_project', *path).encode('ascii'))
+                                     .decode('ascii'))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 1024 * 1024])
+def test_inspect(tmpdir, chunk_size):
+    target_file = str(tmpdir.join('payload.txt'))
+    dump_json_to_disk(dict(service_name='coveralls_multi_ci', source_files=[
+        dict(name='project/library/sub.py', source=placeholder('project', 'library', 'sub.py'),
+             coverage=[1, 1, 1, 1, None, 0, 0], branches=[1, 0, 0, 1]),
+        dict(name='project/library/__init__.py', source='', coverage=[]),
+        dict(name='project/main.py', source=placeholder('project', 'main.py'),
+             coverage=[1, None, None, 1, 1, 1, None, 0, 0]),
+    ], git=dict(head=dict(id='abc'), remotes=[])), target_file)
+
+    entries = list()
+    totals = inspect_payload(target_file, report=entries.append, chunk_size=chunk_size)
+    assert [
+        dict(name='project/library/sub.py', escaped_bytes=132, lines=7, coverage=7, relevant=6, covered=4,
+             branches=4, problems=[]),
+        dict(name='project/library/__init__.py', escaped_bytes=0, lines=0, coverage=0, relevant=0, covered=0,
+             branches=0, problems=[]),
+        dict(name='project/main.py', escaped_bytes=176, lines=9, coverage=9, relevant=6, covered=4, branches=0,
+             problems=[]),
+    ] == entries
+    assert dict(keys=['git', 'service_name', 'source_files'], files=3, escaped_bytes=308, lines=16, relevant=12,
+                covered=8, problems=0) == dict(totals, keys=sorted(totals['keys']))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 64])
+@pytest.mark.parametrize('source', ['a\nb', 'a\nb\n', '\\', 'x = "\\\\n"\n', '\\\n\\', '"]"\n\n', u'é\n'])
+def test_string_stats(tmpdir, chunk_size, source):
+    path = tmpdir.join('string.json')
+    path.write(json.dumps([source, 'after']))
+    with open(str(path)) as f:
+        tokenizer = JSONTokenizer(f, chunk_size=chunk_size)
+        tokenizer.expect('[')
+        tokenizer.expect('"')
+        value, length, newlines, ends_with_newline = tokenizer.string_stats(keep=100)
+        assert (source, len(json.dumps(source)) - 2) == (value, length)
+        assert (source.count('\n'), source.endswith('\n')) == (newlines, ends_with_newline)
+        tokenizer.expect(',')
+        tokenizer.expect('"')
+        assert 'after' == tokenizer.string()
+        tokenizer.expect(']')
+        tokenizer.end()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 64])
+def test_literals(tmpdir, chunk_size):
+    path = tmpdir.join('literals.json')
+    path.write('[true, false,null , -12.5e3,7]')
+    with open(str(path)) as f:
+        tokenizer = JSONTokenizer(f, chunk_size=chunk_size)
+        tokenizer.expect('[')
+        values = list()
+        for _ in tokenizer.elements():
+            assert 'literal' == tokenizer.next()
+            values.append(tokenizer.value)
+        tokenizer.end()
+    assert [True, False, None, -12500.0, 7] == values
+
+
+def test_problems(tmpdir):
+    target_file = tmpdir.join('payload.txt')
+    target_file.write(json.dumps(dict(source_files=[
+        dict(name='a.py', source='a\nb\n', coverage=[1]),
+        dict(name='b.py', coverage=[1, -1, True], branches=[1, 2, 3]),
+        dict(name='c.py', source=1, coverage=[[1]]),
+    ])))
+    entries = list()
+    with pytest.raises(RuntimeError):
+        inspect_payload(str(target_file), report=entries.append)  # c.py coverage isn't an array of literals.
+    assert [['1 coverage entries for 2 lines.'],
+            ['coverage holds values other than null or line hits.', 'source is missing.',
+             'branches length 3 is not a multiple of 4.']] == [e['problems'] for e in entries]
+
+    target_file.write(json.dumps(dict(source_files=[dict(name='c.py', source=1, coverage=None)])))
+    entries = list()
+    assert 1 == inspect_payload(str(target_file), report=entries.append)['problems']
+    assert ['source has the wrong type.', 'coverage has the wrong type.'] == entries[0]['problems']
+
+
+@pytest.mark.parametrize('content', ['', '{"source_files": [{"name": "a.py", "source": "a\\n', '{"a" 1}',
+                                     '{"source_files": []} {}', '{"service_name": "x"}', '{"source_files": [1,]}'])
+def test_invalid(tmpdir, content):
+    target_file = tmpdir.join('payload.txt')
+    target_file.write(content)
+    with pytest.raises(RuntimeError):
+        inspect_payload(str(target_file), chunk_size=4)
+    with pytest.raises(RuntimeError):
+        inspect_payload(str(tmpdir.join('dne.txt')))
+
+
+def test_payload_intact(tmpdir):
+    target_file = tmpdir.join('payload.txt')
+    target_file.write('{"source_files": [{"name": "a.py", "source": "a\\n", "coverage": [1]}]}')
+    assert payload_intact(str(target_file)) is True
+    target_file.write('{"source_files": [{"name": "a.py", "source": "a\\n", "cov')  # Truncated.
+    assert payload_intact(str(target_file)) is False
+    assert not target_file.check()
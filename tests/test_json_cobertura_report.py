@@ -0,0 +1,109 @@
+import json
+import os
+from textwrap import dedent
+
+import pytest
+
+from coveralls_multi_ci import cobertura_report, json_report, json_report_files, JSONTokenizer, read_coverage
+
+ROOT = os.path.abspath(os.path.expanduser(os.path.dirname(__file__)))
+SOURCE_ROOT = os.path.join(ROOT, 'sample_project')
+EXPECTED = [
+    dict(name='project/library/sub.py', coverage=[1, 1, 1, 1, None, 0, 0]),
+    dict(name='project/main.py', coverage=[1, None, None, 1, 1, 1, None, 0, 0]),
+    dict(name='project/__init__.py', coverage=[]),
+]
+
+
+def test_json(tmpdir):
+    report = tmpdir.join('coverage.json')
+    report.write(json.dumps(dict(meta=dict(version='7.0'), files={
+        'project/library/sub.py': dict(executed_lines=[1, 2, 3, 4], missing_lines=[6, 7], excluded_lines=[]),
+        os.path.join(SOURCE_ROOT, 'project', 'main.py'): dict(executed_lines=[1, 4, 5, 6], missing_lines=[8, 9]),
+        'project/__init__.py': dict(executed_lines=[], missing_lines=[]),
+    })))
+
+    actual = sorted(read_coverage(str(report), SOURCE_ROOT), key=lambda a: a['name'])
+    assert sorted(EXPECTED, key=lambda e: e['name']) == [dict(name=a['name'], coverage=a['coverage']) for a in actual]
+    assert all(a['source'].startswith('PLACEHOLDER_') for a in actual if a['name'] != 'project/__init__.py')
+
+    report.write('{"meta": {}}')
+    with pytest.raises(RuntimeError):
+        json_report(str(report), SOURCE_ROOT)
+    report.write(json.dumps(dict(files={'project/main.py': dict(executed_lines=[1, 12], missing_lines=[])})))
+    with pytest.raises(RuntimeError):
+        json_report(str(report), SOURCE_ROOT)  # main.py has 9 lines.
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1024 * 1024])
+def test_json_report_files(tmpdir, chunk_size):
+    report = tmpdir.join('coverage.json')
+    report.write(json.dumps(dict(meta=dict(version='7.0', show_contexts=True), files={
+        'a.py': dict(executed_lines=[1, 2], missing_lines=[3], contexts={'1': ['test_a|run', '[{\\"]}']},
+                     summary=dict(covered_lines=2, percent_covered=66.7), executed_branches=[[1, -1]]),
+        'b\\"c.py': dict(missing_lines=[], excluded_lines=[4]),
+    }, totals=dict(covered_lines=2))))
+    with report.open() as f:
+        actual = list(json_report_files(JSONTokenizer(f, chunk_size=chunk_size)))
+    expected = [('a.py', dict(executed_lines=[1, 2], missing_lines=[3], executed_branches=[[1, -1]])),
+                ('b\\"c.py', dict(missing_lines=[]))]
+    assert expected == actual  # Summaries, contexts, excluded lines and totals skipped.
+
+    for content in ('{"files": {"a.py": {"executed_lines": [1, 2}}}', '{"files": {"a.py": {"missing_lines": ["1"]}}}',
+                    '{"files": {"a.py": {"contexts": {"1": ["a"}}}}'):
+        report.write(content)
+        with pytest.raises(RuntimeError):
+            json_report(str(report), SOURCE_ROOT)
+
+
+def test_cobertura(tmpdir):
+    report = tmpdir.join('coverage.xml')
+    report.write(dedent("""\
+        <?xml version="1.0" ?>
+        <coverage version="7.0" line-rate="0.6667">
+            <sources>
+                <source>{0}</source>
+            </sources>
+            <packages>
+                <package name="project.library">
+                    <classes>
+                        <class name="sub.py" filename="project/library/sub.py">
+                            <methods/>
+                            <lines>
+                                <line number="1" hits="1"/><line number="2" hits="3"/><line number="3" hits="1"/>
+                                <line number="4" hits="1"/><line number="6" hits="0"/><line number="7" hits="0"/>
+                            </lines>
+                        </class>
+                    </classes>
+                </package>
+                <package name="project">
+                    <classes>
+                        <class name="main.py" filename="project/main.py">
+                            <methods>
+                                <method name="main"><lines><line number="8" hits="5"/></lines></method>
+                            </methods>
+                            <lines>
+                                <line number="1" hits="1"/><line number="4" hits="1"/><line number="5" hits="1"/>
+                                <line number="6" hits="1"/><line number="8" hits="0"/><line number="9" hits="0"/>
+                            </lines>
+                        </class>
+                        <class name="__init__.py" filename="project/__init__.py"><lines/></class>
+                    </classes>
+                </package>
+            </packages>
+        </coverage>
+    """).format(SOURCE_ROOT))
+
+    actual = read_coverage(str(report), ROOT)  # Files are found through <source>.
+    expected = ['sample_project/project/library/sub.py', 'sample_project/project/main.py',
+                'sample_project/project/__init__.py']
+    assert expected == [a['name'] for a in actual]
+    assert actual[0]['source'].startswith('PLACEHOLDER_')
+    assert '' == actual[2]['source']
+
+    actual = cobertura_report(str(report), SOURCE_ROOT)
+    assert EXPECTED == [dict(name=a['name'], coverage=a['coverage']) for a in actual]
+
+    report.write('<coverage><packages>')
+    with pytest.raises(RuntimeError):
+        cobertura_report(str(report), SOURCE_ROOT)
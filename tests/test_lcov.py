@@ -0,0 +1,116 @@
+import json
+from textwrap import dedent
+
+import pytest
+
+import coveralls_multi_ci
+from coveralls_multi_ci import GenericCI, json_report, lcov_report, merge_source_files, read_coverage, submit
+
+
+def write_project(tmpdir):
+    tmpdir.join('ext.c').write('int f(int x) {\n    if (x)\n        return 1;\n    return 0;\n}\n')
+    tmpdir.join('web', 'app.js').write('function g() {\n  return 2;\n}\n', ensure=True)
+    tmpdir.join('lib.py').write('def h():\n    return 3\n\nh()\n')
+    tmpdir.join('coverage.json').write(json.dumps(dict(meta=dict(version='7.0'), files={
+        'lib.py': dict(executed_lines=[1, 4], missing_lines=[2]),
+    })))
+    tmpdir.join('coverage.info').write(dedent("""\
+        TN:test_one
+        SF:{0}
+        FN:1,f
+        FNDA:2,f
+        DA:1,2
+        DA:2,2
+        DA:3,0,5d41402abc4b2a76b9719d911017c592
+        DA:4,2
+        BRDA:2,0,0,0
+        BRDA:2,0,1,2
+        end_of_record
+        TN:test_two
+        SF:{0}
+        DA:1,1
+        DA:2,1
+        DA:3,1
+        DA:4,0
+        BRDA:2,0,0,1
+        BRDA:2,0,1,-
+        end_of_record
+        SF:web/app.js
+        DA:1,1
+        DA:2,0
+        end_of_record
+        SF:/usr/include/stdio.h
+        DA:10,4
+        end_of_record
+        SF:lib.py
+        DA:2,3
+        DA:4,0
+        end_of_record
+        """).format(tmpdir.join('ext.c')))
+    return str(tmpdir.join('coverage.json')), str(tmpdir.join('coverage.info'))
+
+
+def test_lcov_report(tmpdir):
+    _, tracefile = write_project(tmpdir)
+    actual = dict((f['name'], f) for f in read_coverage(tracefile, str(tmpdir)))
+    assert ['ext.c', 'lib.py', 'web/app.js'] == sorted(actual)  # stdio.h is outside of the source root.
+    assert [3, 3, 1, 2, None] == actual['ext.c']['coverage']  # Records of both tests summed, hit counts kept.
+    assert [2, 0, 0, 1, 2, 0, 1, 2] == actual['ext.c']['branches']
+    assert [1, 0, None] == actual['web/app.js']['coverage']
+    assert 'branches' not in actual['web/app.js']
+    assert actual['ext.c']['source'].startswith('PLACEHOLDER_')
+
+    assert list(actual.values()) == list(lcov_report(tracefile, str(tmpdir), max_memory=1))
+    only = set([str(tmpdir.join('web', 'app.js'))])
+    assert ['web/app.js'] == [f['name'] for f in lcov_report(tracefile, str(tmpdir), only=only)]
+
+    tmpdir.join('bad.info').write('DA:1,1\nend_of_record\n')  # No SF record.
+    with pytest.raises(RuntimeError):
+        lcov_report(str(tmpdir.join('bad.info')), str(tmpdir))
+    tmpdir.join('bad.info').write('SF:ext.c\nDA:one,1\nend_of_record\n')
+    with pytest.raises(RuntimeError):
+        lcov_report(str(tmpdir.join('bad.info')), str(tmpdir))
+    tmpdir.join('bad.info').write('SF:/usr/include/stdio.h\nDA:1,1\nend_of_record\n')
+    with pytest.raises(RuntimeError):
+        lcov_report(str(tmpdir.join('bad.info')), str(tmpdir))  # Nothing within the source root.
+    tmpdir.join('bad.info').write('SF:lib.py\nDA:4,1\nDA:9,1\nend_of_record\n')
+    with pytest.raises(RuntimeError):
+        lcov_report(str(tmpdir.join('bad.info')), str(tmpdir))  # lib.py has 4 lines, tracefile is stale.
+
+
+@pytest.mark.parametrize('max_memory', [None, 1])
+def test_merge(tmpdir, max_memory):
+    report, tracefile = write_project(tmpdir)
+    merged = merge_source_files(json_report(report, str(tmpdir)), lcov_report(tracefile, str(tmpdir)),
+                                max_memory=max_memory)
+    assert ['lib.py', 'ext.c', 'web/app.js'] == [f['name'] for f in merged]
+    by_name = dict((f['name'], f) for f in merged)
+    assert [1, 3, None, 1] == by_name['lib.py']['coverage']  # 1 + 0, 0 + 3, None, 1 + 0.
+    assert [3, 3, 1, 2, None] == by_name['ext.c']['coverage']
+
+    python = dict(name='a.py', source='', coverage=[1, None, 0], branches=[1, 0, 0, 1, 1, 0, 1, 0])
+    other = dict(name='a.py', source='', coverage=[2, None, None, 4], branches=[1, 0, 1, 3, 5, 0, 0, 1])
+    expected = dict(name='a.py', source='', coverage=[3, None, 0, 4], branches=[1, 0, 0, 1, 1, 0, 1, 3, 5, 0, 0, 1])
+    assert [expected] == list(merge_source_files([python], [other], max_memory=max_memory))
+
+
+def test_submit(tmpdir, api_server, monkeypatch):
+    monkeypatch.setattr(coveralls_multi_ci, 'select_ci', lambda: GenericCI)
+    monkeypatch.setattr(GenericCI, 'REPO_TOKEN', 'abc')
+    report, tracefile = write_project(tmpdir)
+    fingerprints = str(tmpdir.join('fingerprints'))
+    submit(report, str(tmpdir), dict(), str(tmpdir.join('payload.txt')), lcov_files=[tracefile],
+           fingerprints=fingerprints)
+    assert 1 == len(api_server.received)
+    payload = json.loads(list(api_server.received.values())[0].splitlines()[3].decode('ascii'))
+    assert ['ext.c', 'lib.py', 'web/app.js'] == sorted(f['name'] for f in payload['source_files'])
+    sources = dict((f['name'], f['source']) for f in payload['source_files'])
+    assert tmpdir.join('ext.c').read() == sources['ext.c']
+
+    submit(report, str(tmpdir), dict(), str(tmpdir.join('payload.txt')), lcov_files=[tracefile],
+           fingerprints=fingerprints)
+    assert 1 == len(api_server.received)  # Identical, skipped.
+    tmpdir.join('coverage.info').write('SF:web/app.js\nDA:1,1\nDA:2,1\nend_of_record\n')
+    submit(report, str(tmpdir), dict(), str(tmpdir.join('payload.txt')), lcov_files=[tracefile],
+           fingerprints=fingerprints)
+    assert 2 == len(api_server.received)  # The tracefile is part of the fingerprint.
@@ -0,0 +1,54 @@
+import time
+
+import pytest
+import requests
+
+import coveralls_multi_ci
+from tests.fake_api import FakeAPIServer
+from tests.load_harness import make_project, percentile, run_load, summarize
+
+
+@pytest.fixture
+def server(request):
+    server = FakeAPIServer().start()
+    request.addfinalizer(server.stop)
+    return server
+
+
+def test_fake_api(server):
+    server.latency, server.bandwidth = 0.1, 1000 * 1000
+    body = [b'x' * 100000] * 3
+    headers = {'Content-Type': 'multipart/form-data; boundary=abc'}
+    start = time.time()
+    response = requests.post(server.url, data=iter(body), headers=headers)  # Chunked, length unknown.
+    assert 200 == response.status_code
+    assert 'Job #1' == response.json()['message']
+    assert time.time() - start >= 0.4  # 0.3s reading 300 kB at 1 MB/s, then 0.1s latency.
+    assert b''.join(body) == server.received['abc']
+
+    server.latency, server.bandwidth, server.error_rate = 0, None, 1
+    response = requests.post(server.url, data=b'x', headers=headers)
+    assert 503 == response.status_code
+    assert [(300000, 200), (1, 503)] == [(r['bytes'], r['status']) for r in server.requests]
+
+
+def test_run_load(tmpdir, server, monkeypatch):
+    monkeypatch.setattr(coveralls_multi_ci, 'API_URL', server.url)
+    report_file = make_project(str(tmpdir), files=5, lines=20)
+    server.error_rate = 0.5  # Random(0) fails the 3rd and 4th upload.
+
+    results = run_load(report_file, str(tmpdir), str(tmpdir), submits=4, concurrency=2)
+    assert [True, True, False, False] == sorted((r['ok'] for r in results), reverse=True)
+    assert [200, 200, 503, 503] == sorted(r['status'] for r in server.requests)
+    assert len(set(r['bytes'] for r in results)) == 1  # Same payload every time.
+    assert sorted(tmpdir.listdir()) == sorted(p for p in tmpdir.listdir() if 'payload' not in p.basename)
+
+    summary = summarize(results, 2.0)
+    assert (4, 2, 2.0) == (summary['submits'], summary['failed'], summary['submits_per_second'])
+    assert summary['p50'] <= summary['p90'] <= summary['p99'] == summary['max']
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert (50, 90, 99, 100) == tuple(percentile(values, p) for p in (50, 90, 99, 100))
+    assert 7 == percentile([7], 50)
@@ -0,0 +1,63 @@
+import json
+import os
+
+import pytest
+
+from coveralls_multi_ci import analyze_coverage, coverage, json_report, PathRemapper, read_remap_rules
+
+ROOT = os.path.abspath(os.path.expanduser(os.path.dirname(__file__)))
+SOURCE_ROOT = os.path.join(ROOT, 'sample_project')
+
+
+def test_remapper():
+    remapper = PathRemapper([('/app', '/builds/x'), ('/app/vendor/', '/usr/lib/vendor'), ('/', '/root/'),
+                             ('C:\\build', '/builds/win')])
+    assert '/builds/x/main.py' == remapper.remap('/app/main.py')
+    assert '/usr/lib/vendor/lib.py' == remapper.remap('/app/vendor/lib.py')  # Longest prefix wins.
+    assert '/builds/x/vendors/lib.py' == remapper.remap('/app/vendors/lib.py')
+    assert '/root/application/main.py' == remapper.remap('/application/main.py')  # Whole components only.
+    assert '/builds/x' == remapper.remap('/app')
+    assert '/builds/win\\project\\main.py' == remapper.remap('C:\\build\\project\\main.py')
+    assert 'relative/main.py' == remapper.remap('relative/main.py')
+    assert '/builds/x/main.py' == remapper.mapping['/app/main.py']
+    assert 'relative/main.py' == PathRemapper([]).remap('relative/main.py')
+
+
+def test_read_rules(tmpdir):
+    assert [('/app', '/builds/x'), ('/lib', '/usr/lib')] == read_remap_rules('/app=/builds/x, /lib=/usr/lib,')
+    rules = tmpdir.join('rules.txt')
+    rules.write('# Container paths.\n/app=/builds/x\n\n/a b=/c d\n')
+    assert [('/app', '/builds/x'), ('/a b', '/c d')] == read_remap_rules('@' + str(rules))
+    with pytest.raises(RuntimeError):
+        read_remap_rules('/app')
+    with pytest.raises(RuntimeError):
+        read_remap_rules('@' + str(tmpdir.join('dne.txt')))
+
+
+def test_json_report(tmpdir):
+    report = tmpdir.join('coverage.json')
+    report.write(json.dumps(dict(files={
+        '/app/project/main.py': dict(executed_lines=[1, 4, 5, 6], missing_lines=[8, 9]),
+    })))
+    remap = PathRemapper([('/app', SOURCE_ROOT)])
+    with pytest.raises(RuntimeError):
+        json_report(str(report), SOURCE_ROOT)  # Not found.
+    only = set([os.path.join(SOURCE_ROOT, 'project', 'main.py')])  # Compared with remapped paths.
+    actual = json_report(str(report), SOURCE_ROOT, remap=remap, only=only)
+    assert [('project/main.py', [1, None, None, 1, 1, 1, None, 0, 0])] == [(a['name'], a['coverage']) for a in actual]
+
+
+def test_analyze_coverage(tmpdir):
+    if not hasattr(coverage, 'get_data'):
+        pytest.skip('Live coverage data needs coverage 4+.')
+    cov = coverage(data_file=str(tmpdir.join('.coverage')))
+    cov.get_data().add_lines({
+        '/app/project/main.py': dict.fromkeys([1, 4, 5, 6]),
+        os.path.join(SOURCE_ROOT, 'project', 'library', 'sub.py'): dict.fromkeys([1, 2, 3, 4]),
+    })
+    actual = analyze_coverage(cov, SOURCE_ROOT, remap=PathRemapper([('/app', SOURCE_ROOT)]))
+    expected = [
+        ('project/library/sub.py', [1, 1, 1, 1, None, 0, 0]),
+        ('project/main.py', [1, None, None, 1, 1, 1, None, 0, 0]),
+    ]
+    assert expected == sorted((a['name'], a['coverage']) for a in actual)
@@ -0,0 +1,39 @@
+from base64 import b64encode
+import logging
+import os
+
+from coveralls_multi_ci import dump_json_to_disk, log_payload_stats, payload_stats
+
+ROOT = os.path.abspath(os.path.expanduser(os.path.dirname(__file__)))
+
+
+def placeholder(*path):
+    return 'PLACEHOLDER_{0}_'.format(b64encode(os.path.join(ROOT, 'sample_project', *path).encode('ascii'))
+                                     .decode('ascii'))
+
+
+def test(tmpdir, caplog):
+    payload = dict(service_name='coveralls_multi_ci', source_files=[
+        dict(name='project/library/sub.py', source=placeholder('project', 'library', 'sub.py'),
+             coverage=[1, 1, 1, 1, None, 0, 0]),
+        dict(name='project/library/__init__.py', source='', coverage=[]),
+        dict(name='project/main.py', source=placeholder('project', 'main.py'),
+             coverage=[1, None, None, 1, 1, 1, None, 0, 0]),
+    ])
+
+    stats = payload_stats(payload)
+    expected = [
+        dict(name='project/library/sub.py', source_bytes=125, escaped_bytes=132, lines=7, relevant=6, covered=4),
+        dict(name='project/library/__init__.py', source_bytes=0, escaped_bytes=0, lines=0, relevant=0, covered=0),
+        dict(name='project/main.py', source_bytes=167, escaped_bytes=176, lines=9, relevant=6, covered=4),
+    ]
+    assert expected == stats['files']
+    assert dump_json_to_disk(payload, str(tmpdir.join('payload.txt'))) == stats['payload_bytes']
+
+    caplog.set_level(logging.INFO)
+    log_payload_stats(stats, top=1, bandwidth=0.001)
+    messages = [r.getMessage() for r in caplog.records]
+    assert '3 file(s), 16 lines, 292 bytes of source code (308 bytes escaped).' in messages
+    assert '8 of 12 relevant lines covered (66.67%).' in messages
+    assert 'Largest 1 file(s):' in messages
+    assert messages[-1].endswith(' project/main.py')
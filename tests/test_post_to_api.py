@@ -0,0 +1,83 @@
+import json
+import os
+
+import pytest
+
+from coveralls_multi_ci import CHECKPOINT_SUFFIX, MultipartUpload, post_to_api, read_checkpoint, write_checkpoint
+
+
+@pytest.fixture
+def target_file(tmpdir):
+    target = tmpdir.join('coveralls_multi_ci_payload.txt')
+    target.write(json.dumps(dict(source_files=[dict(name='a.py', source='x = 1\n' * 5000, coverage=[1] * 5000)])))
+    return str(target)
+
+
+def test_multipart_upload(target_file):
+    progress = list()
+    body = MultipartUpload(target_file, 'abc', chunk_size=1000, progress=lambda s, t: progress.append((s, t)))
+    data = b''.join(body)
+    assert data.startswith(b'--abc\r\nContent-Disposition: form-data; name="json_file"; '
+                           b'filename="coveralls_multi_ci_payload.txt"\r\n\r\n{"source_files"')
+    assert data.endswith(b'\r\n--abc--\r\n')
+    assert len(body) == len(data) == body.total
+    assert (body.total, body.total) == progress[-1]
+
+    resumed = MultipartUpload(target_file, 'abc', chunk_size=1000, offset=12345)
+    assert data[12345:] == b''.join(resumed)
+    assert len(resumed) == body.total - 12345
+
+
+def test_post(api_server, target_file):
+    post_to_api(target_file, chunk_size=4096)
+    assert 1 == len(api_server.received)
+    data = next(iter(api_server.received.values()))
+    with open(target_file, 'rb') as f:
+        assert f.read() in data
+    assert not read_checkpoint(target_file)
+
+
+def test_resume(api_server, target_file):
+    boundary = 'resumeme'
+    full = b''.join(MultipartUpload(target_file, boundary))
+    api_server.received[boundary] = full[:20000]  # Connection dropped after 20000 bytes.
+    write_checkpoint(target_file, boundary, 20000)
+
+    post_to_api(target_file, resumable=True)
+    assert full == api_server.received[boundary]
+    assert [full[20000:]] == api_server.ranged_bodies
+    assert not read_checkpoint(target_file)
+
+
+def test_resume_unsupported(api_server, target_file):
+    api_server.ranges = False
+    write_checkpoint(target_file, 'norange', 20000)
+
+    post_to_api(target_file, resumable=True)
+    assert b''.join(MultipartUpload(target_file, 'norange')) == api_server.received['norange']
+    assert not api_server.ranged_bodies
+
+
+def test_resume_not_resumable(api_server, target_file):
+    write_checkpoint(target_file, 'old', 20000)
+
+    post_to_api(target_file)
+    assert 1 == len(api_server.requests)  # No range query, which the real API would take for a job.
+    assert ['old'] != list(api_server.received)
+    assert not os.path.isfile(target_file + CHECKPOINT_SUFFIX)
+
+
+def test_interrupted(api_server, target_file):
+    api_server.shutdown()
+    api_server.server_close()
+    with pytest.raises(RuntimeError):
+        post_to_api(target_file)
+    checkpoint = read_checkpoint(target_file)
+    assert checkpoint['boundary']
+    assert 0 <= checkpoint['sent'] < os.path.getsize(target_file)
+
+    # Stale checkpoints are ignored.
+    with open(target_file, 'a') as f:
+        f.write(' ')
+    assert read_checkpoint(target_file) is None
+    assert os.path.isfile(target_file + CHECKPOINT_SUFFIX)
@@ -0,0 +1,50 @@
+import logging
+import os
+
+from coveralls_multi_ci import count_lines, FileProgress, TRACE
+
+ROOT = os.path.abspath(os.path.expanduser(os.path.dirname(__file__)))
+
+
+def test_throttled(caplog):
+    caplog.set_level(logging.INFO)
+    progress = FileProgress('Analyzed', 1000)
+    assert list(range(1000)) == list(progress.iterate(range(1000)))
+    assert 1000 == progress.files
+    assert not caplog.records  # Finished before the first interval.
+
+
+def test_message(caplog, monkeypatch):
+    caplog.set_level(logging.DEBUG)
+    now = [100.0]
+    monkeypatch.setattr('time.time', lambda: now[0])
+    progress = FileProgress('Wrote source code of', 300, interval=10)
+    now[0] = 105.0
+    progress.update(files=50, nbytes=5000000)
+    assert not caplog.records
+    now[0] = 110.0
+    progress.update(files=50, nbytes=5000000)
+    now[0] = 115.0
+    progress.update()
+    now[0] = 130.0
+    progress.update(files=99)
+    progress.finish()
+    messages = [r.getMessage() for r in caplog.records]
+    assert [
+        'Wrote source code of 100/300 files (10.0 files/s, 1.0 MB/s, ETA 0m20s).',
+        'Wrote source code of 200/300 files (6.7 files/s, 0.3 MB/s, ETA 0m15s).',
+        'Wrote source code of 200 files in 30.0s (6.7 files/s).',
+    ] == messages
+
+
+def test_trace(caplog):
+    source = os.path.join(ROOT, 'sample_project', 'project', 'main.py')
+    caplog.set_level(logging.DEBUG)
+    count_lines(source)
+    assert not caplog.records  # Per-file messages are below DEBUG.
+
+    caplog.set_level(TRACE)
+    count_lines(source)
+    assert ['Opened {0} for reading.'.format(source), 'Closed {0}.'.format(source)] == [
+        r.getMessage() for r in caplog.records]
+    assert 'TRACE' == caplog.records[0].levelname
@@ -0,0 +1,92 @@
+import json
+import os
+import sys
+
+import pytest
+
+import coveralls_multi_ci
+from coveralls_multi_ci import coverage, GenericCI
+from coveralls_multi_ci_pytest import pytest_sessionfinish, pytest_unconfigure
+
+ROOT = os.path.abspath(os.path.expanduser(os.path.dirname(__file__)))
+SOURCE_ROOT = os.path.join(ROOT, 'sample_project')
+
+
+class Namespace(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Config(object):
+    """Stand-in for pytest's config with pytest-cov and the terminal reporter loaded."""
+
+    def __init__(self, cov, **options):
+        self.options, self.lines = options, list()
+        plugins = dict(
+            _cov=Namespace(cov_controller=Namespace(cov=cov, combining_cov=None)) if cov else None,
+            terminalreporter=Namespace(write_line=self.lines.append),
+        )
+        self.pluginmanager = Namespace(getplugin=plugins.get)
+
+    def getoption(self, name):
+        return self.options.get(name)
+
+
+@pytest.fixture
+def cov(tmpdir):
+    if not hasattr(coverage, 'get_data'):
+        pytest.skip('Live coverage data needs coverage 4+.')
+    cov = coverage(data_file=str(tmpdir.join('.coverage')))
+    cov.get_data().add_lines({
+        os.path.join(SOURCE_ROOT, 'project', 'main.py'): dict.fromkeys([1, 4, 5, 6]),
+        os.path.join(SOURCE_ROOT, 'project', 'library', 'sub.py'): dict.fromkeys([1, 2, 3, 4]),
+    })
+    return cov
+
+
+def test_session(tmpdir, monkeypatch, api_server, cov):
+    monkeypatch.setattr(coveralls_multi_ci, 'select_ci', lambda: GenericCI)
+    monkeypatch.setattr(GenericCI, 'REPO_TOKEN', 'abc')
+    config = Config(cov, coveralls=True, coveralls_git=ROOT, coveralls_source=SOURCE_ROOT,
+                    coveralls_output=str(tmpdir.join('payload.txt')))
+    session = Namespace(config=config)
+
+    pytest_sessionfinish(session)
+    pytest_unconfigure(config)
+
+    assert 1 == len(config.lines)
+    assert config.lines[0].startswith('Coverage submitted to Coveralls.io in ')
+    payload = json.loads(list(api_server.received.values())[0].splitlines()[3].decode('ascii'))
+    actual = sorted((f['name'], f['coverage']) for f in payload['source_files'])
+    expected = [
+        ('project/library/sub.py', [1, 1, 1, 1, None, 0, 0]),
+        ('project/main.py', [1, None, None, 1, 1, 1, None, 0, 0]),
+    ]
+    assert expected == actual
+    assert not tmpdir.join('payload.txt').check()
+
+
+def test_failed(tmpdir, monkeypatch, cov):
+    def git_stats(*_, **__):
+        raise OSError('No such file or directory: git')
+    monkeypatch.setattr(coveralls_multi_ci, 'git_stats', git_stats)
+    config = Config(cov, coveralls=True, coveralls_git=ROOT, coveralls_source=SOURCE_ROOT,
+                    coveralls_output=str(tmpdir.join('payload.txt')))
+
+    pytest_sessionfinish(Namespace(config=config))  # Doesn't raise.
+    pytest_unconfigure(config)
+    assert ['Coverage submission to Coveralls.io FAILED: No such file or directory: git'] == config.lines
+
+
+def test_not_enabled_or_no_cov(monkeypatch):
+    monkeypatch.delitem(sys.modules, 'coveralls_multi_ci')
+    config = Config(None, coveralls=False)
+    pytest_sessionfinish(Namespace(config=config))
+    pytest_unconfigure(config)
+    assert [] == config.lines
+
+    config = Config(None, coveralls=True)
+    pytest_sessionfinish(Namespace(config=config))
+    pytest_unconfigure(config)
+    assert ['Nothing to submit to Coveralls.io, run with pytest-cov (--cov).'] == config.lines
+    assert 'coveralls_multi_ci' not in sys.modules  # Only imported to submit.
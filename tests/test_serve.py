@@ -0,0 +1,112 @@
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+from coveralls_multi_ci import count_lines, escape_source, read_message, send_message, SourceCache, submit_via_daemon
+from coveralls_multi_ci import SubmitDaemon
+
+ROOT = os.path.abspath(os.path.expanduser(os.path.dirname(__file__)))
+SOURCE_ROOT = os.path.join(ROOT, 'sample_project')
+
+
+def test_source_cache(tmpdir):
+    source = tmpdir.join('source.py')
+    source.write('a = 1\nb = "2"\n')
+    cache = SourceCache(max_bytes=20)
+    assert 2 == cache.get(count_lines, str(source))
+    assert 'a = 1\\nb = \\"2\\"\\n' == cache.get(escape_source, str(source))
+    assert 2 == cache.get(count_lines, str(source))
+    assert (1, 2) == (cache.hits, cache.misses)
+
+    source.write('a = 1\n')
+    assert 1 == cache.get(count_lines, str(source))
+    assert 3 == cache.misses
+
+    other = tmpdir.join('other.py')
+    other.write('c = 3333333333333333\n')
+    assert 'c = 3333333333333333\\n' == cache.get(escape_source, str(other))
+    assert 22 == cache.size  # Older entries were dropped.
+    assert 'a = 1\\n' == cache.get(escape_source, str(source))
+    assert (1, 5) == (cache.hits, cache.misses)
+
+
+def test_serve(tmpdir, api_server):
+    report = tmpdir.join('coverage.json')
+    report.write(json.dumps(dict(meta=dict(version='7.0'), files={
+        'project/library/sub.py': dict(executed_lines=[1, 2, 3, 4], missing_lines=[6, 7]),
+        'project/main.py': dict(executed_lines=[1, 4, 5, 6], missing_lines=[8, 9]),
+        'project/__init__.py': dict(executed_lines=[], missing_lines=[]),
+    })))
+    socket_path = str(tmpdir.join('daemon.sock'))
+    job = dict(coverage=str(report), source=SOURCE_ROOT, git=ROOT, output=str(tmpdir.join('payload.txt')),
+               no_delete=False, since=None,
+               metadata=dict(run_at='2015-01-01 00:00:00 +0000', repo_token='abc', service_name='coveralls_multi_ci'))
+    assert submit_via_daemon(socket_path, job) is False  # Not running yet.
+
+    daemon = SubmitDaemon(socket_path, jobs=2)
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.start()
+    assert daemon.ready.wait(5)
+    silent = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        assert 0o600 == os.stat(socket_path).st_mode & 0o777
+        with pytest.raises(RuntimeError):
+            SubmitDaemon(socket_path).serve_forever()  # Already running.
+        silent.connect(socket_path)  # Never sends its job, only holds up one worker.
+        start = time.time()
+        assert submit_via_daemon(socket_path, job) is True
+        assert time.time() - start < 5
+        assert submit_via_daemon(socket_path, job) is True
+        with pytest.raises(RuntimeError):
+            submit_via_daemon(socket_path, dict(job, coverage=str(tmpdir.join('dne.json'))))
+    finally:
+        silent.close()
+        daemon.shutdown()
+        thread.join(5)
+    assert not thread.is_alive()
+    assert not os.path.exists(socket_path)
+    assert ['coverage.json'] == [p.basename for p in tmpdir.listdir()]
+
+    assert (5, 5) == (daemon.cache.hits, daemon.cache.misses)  # 3 line counts and 2 escaped sources each.
+    payloads = [json.loads(b.splitlines()[3].decode('ascii')) for b in api_server.received.values()]
+    assert 2 == len(payloads)
+    assert payloads[0] == payloads[1]
+    assert 'abc' == payloads[0]['repo_token']
+    assert payloads[0]['git']['head']['id']
+    sources = dict((f['name'], f['source']) for f in payloads[0]['source_files'])
+    with open(os.path.join(SOURCE_ROOT, 'project', 'main.py')) as f:
+        assert f.read() == sources['project/main.py']
+
+
+def test_busy(tmpdir):
+    daemon = SubmitDaemon(str(tmpdir.join('daemon.sock')), queue_size=1)
+    daemon.queue.put(None)
+    client, server = socket.socketpair()
+    try:
+        send_message(client, dict(coverage='.coverage'))
+        daemon._accept(server)
+        assert dict(ok=False, busy=True, error='Daemon busy.') == read_message(client)
+    finally:
+        client.close()
+
+
+def test_other_user(tmpdir, monkeypatch):
+    if not sys.platform.startswith('linux'):
+        pytest.skip('Peer credentials are only checked on Linux.')
+    daemon = SubmitDaemon(str(tmpdir.join('daemon.sock')))
+    uid = os.getuid()
+    monkeypatch.setattr(os, 'getuid', lambda: uid + 1)
+    client, server = socket.socketpair()
+    try:
+        send_message(client, dict(coverage='.coverage', output='/etc/passwd'))
+        daemon._accept(server)
+        assert daemon.queue.empty()
+        with pytest.raises((socket.error, ValueError)):
+            read_message(client)  # Hung up on.
+    finally:
+        client.close()
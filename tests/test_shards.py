@@ -0,0 +1,83 @@
+from base64 import b64encode
+import json
+import os
+
+import pytest
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+import coveralls_multi_ci
+from coveralls_multi_ci import shard_source_files, submit
+
+ROOT = os.path.abspath(os.path.expanduser(os.path.dirname(__file__)))
+SOURCE_ROOT = os.path.join(ROOT, 'sample_project')
+METADATA = dict(run_at='2015-01-01 00:00:00 +0000', repo_token='abc', service_name='coveralls_multi_ci',
+                service_number='42')
+
+
+def test_shard_source_files(tmpdir):
+    source_files = list()
+    for index, size in enumerate([900, 500, 400, 300, 250, 100]):
+        path = tmpdir.join('f{0}.py'.format(index))
+        path.write('x' * size)
+        placeholder = 'PLACEHOLDER_{0}_'.format(b64encode(str(path).encode('ascii')).decode('ascii'))
+        source_files.append(dict(name=path.basename, source=placeholder, coverage=[1]))
+    overhead = len(json.dumps(dict(source_files[0], source='')))
+
+    shards = shard_source_files(source_files, 1000)
+    assert [['f0.py'], ['f1.py', 'f4.py'], ['f2.py', 'f3.py', 'f5.py']] == [[f['name'] for f in s] for _, s in shards]
+    assert [900 + overhead, 750 + 2 * overhead, 800 + 3 * overhead] == [s[0] for s in shards]
+
+    assert [source_files] == [s for _, s in shard_source_files(source_files, 10 ** 9)]
+    assert 6 == len(shard_source_files(source_files, 1))  # No more shards than files.
+    assert [] == shard_source_files([], 1000)
+
+
+def write_report(tmpdir):
+    report = tmpdir.join('coverage.json')
+    report.write(json.dumps(dict(meta=dict(version='7.0'), files={
+        'project/library/sub.py': dict(executed_lines=[1, 2, 3, 4], missing_lines=[6, 7]),
+        'project/main.py': dict(executed_lines=[1, 4, 5, 6], missing_lines=[8, 9]),
+        'project/__init__.py': dict(executed_lines=[], missing_lines=[]),
+    })))
+    return str(report)
+
+
+def test_submit_shards(tmpdir, api_server):
+    report = write_report(tmpdir)
+    submit(report, SOURCE_ROOT, dict(), str(tmpdir.join('payload.txt')), metadata=METADATA, shard_bytes=200, jobs=2)
+    assert ['coverage.json'] == [p.basename for p in tmpdir.listdir()]
+
+    payloads = [json.loads(b.splitlines()[3].decode('ascii')) for b in api_server.received.values()]
+    assert ['shard 1/3', 'shard 2/3', 'shard 3/3'] == sorted(p['flag_name'] for p in payloads)
+    assert all(p['parallel'] is True and p['service_number'] == '42' for p in payloads)
+    names = sorted(f['name'] for p in payloads for f in p['source_files'])
+    assert ['project/__init__.py', 'project/library/sub.py', 'project/main.py'] == names
+
+    assert 1 == len(api_server.webhooks)
+    query, body = api_server.webhooks[0]
+    assert dict(repo_token=['abc']) == parse_qs(query)
+    assert {'payload[build_num]': ['42'], 'payload[status]': ['done']} == parse_qs(body)
+
+    api_server.received.clear()
+    submit(report, SOURCE_ROOT, dict(), str(tmpdir.join('payload.txt')), metadata=METADATA, shard_bytes=10 ** 6)
+    payload = json.loads(list(api_server.received.values())[0].splitlines()[3].decode('ascii'))
+    assert 'parallel' not in payload  # Small enough for one job.
+    assert 1 == len(api_server.webhooks)
+
+
+def test_submit_shards_errors(tmpdir, api_server, monkeypatch):
+    report = write_report(tmpdir)
+    metadata = dict(METADATA)
+    metadata.pop('service_number')
+    with pytest.raises(RuntimeError):
+        submit(report, SOURCE_ROOT, dict(), str(tmpdir.join('payload.txt')), metadata=metadata, shard_bytes=200)
+    assert not api_server.received
+
+    monkeypatch.setattr(coveralls_multi_ci, 'API_URL', 'http://127.0.0.1:1/api/v1/jobs')  # Nothing listens there.
+    with pytest.raises(RuntimeError):
+        submit(report, SOURCE_ROOT, dict(), str(tmpdir.join('payload.txt')), metadata=METADATA, shard_bytes=200)
+    assert not api_server.webhooks
@@ -0,0 +1,65 @@
+import json
+import os
+
+from coveralls_multi_ci import (dump_json_to_disk, json_report, payload_json, payload_stats, shard_source_files,
+                                SpillList)
+
+ROOT = os.path.abspath(os.path.expanduser(os.path.dirname(__file__)))
+SOURCE_ROOT = os.path.join(ROOT, 'sample_project')
+
+
+def write_report(tmpdir):
+    report = tmpdir.join('coverage.json')
+    report.write(json.dumps(dict(meta=dict(version='7.0'), files={
+        'project/library/sub.py': dict(executed_lines=[1, 2, 3, 4], missing_lines=[6, 7]),
+        'project/main.py': dict(executed_lines=[1, 4, 5, 6], missing_lines=[8, 9]),
+        'project/__init__.py': dict(executed_lines=[], missing_lines=[]),
+        'project/library/__init__.py': dict(executed_lines=[], missing_lines=[]),
+    })))
+    return str(report)
+
+
+def test_spill_list():
+    entries = [dict(name='f{0}.py'.format(i), source='', coverage=[1, None, 0] * i) for i in range(10)]
+    spill_list = SpillList(2000)
+    for entry in entries:
+        spill_list.append(entry)
+    assert 10 == len(spill_list)
+    assert 0 < spill_list.spilled < 10  # About 600 bytes estimated per entry.
+    assert len(spill_list.entries) == 10 - spill_list.spilled
+    assert entries == list(spill_list)
+    assert [json.dumps(e) for e in entries] == list(spill_list.iter_json())
+    assert entries == list(spill_list)  # Iterating doesn't consume anything.
+
+    spill_list = SpillList(10 ** 6)
+    spill_list.append(entries[1])
+    assert (0, None, [entries[1]]) == (spill_list.spilled, spill_list.spill_file, list(spill_list))
+
+
+def test_payload_json():
+    payload = dict(service_name='coveralls_multi_ci', source_files=[dict(name='a.py', coverage=[1])], run_at='now')
+    pieces = list(payload_json(payload))
+    assert 3 == len(pieces)
+    assert json.dumps(payload) == ''.join(pieces)
+    assert json.dumps(dict(payload, source_files=[])) == ''.join(payload_json(dict(payload, source_files=[])))
+    assert ['{"service_name": "x"}'] == list(payload_json(dict(service_name='x')))
+
+
+def test_spilled_payload(tmpdir):
+    report = write_report(tmpdir)
+    in_memory = json_report(report, SOURCE_ROOT)
+    spilled = json_report(report, SOURCE_ROOT, max_memory=1)  # Every entry is spilled as soon as it's appended.
+    assert isinstance(spilled, SpillList)
+    assert (4, 4) == (len(spilled), spilled.spilled)
+    assert in_memory == list(spilled)
+
+    payload = dict(service_name='coveralls_multi_ci', run_at='2015-01-01 00:00:00 +0000')
+    dump_json_to_disk(dict(payload, source_files=in_memory), str(tmpdir.join('memory.txt')))
+    dump_json_to_disk(dict(payload, source_files=spilled), str(tmpdir.join('spilled.txt')))
+    assert tmpdir.join('memory.txt').read() == tmpdir.join('spilled.txt').read()
+    assert payload_stats(dict(payload, source_files=in_memory)) == payload_stats(dict(payload, source_files=spilled))
+    assert tmpdir.join('spilled.txt').size() == payload_stats(dict(payload, source_files=spilled))['payload_bytes']
+
+    shards = shard_source_files(spilled, 1)
+    assert sorted(in_memory, key=lambda f: f['name']) == sorted((f for _, s in shards for f in s),
+                                                                key=lambda f: f['name'])
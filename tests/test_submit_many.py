@@ -0,0 +1,53 @@
+import json
+import os
+
+import pytest
+
+import coveralls_multi_ci
+from coveralls_multi_ci import GenericCI, read_manifest, submit_many
+
+ROOT = os.path.abspath(os.path.expanduser(os.path.dirname(__file__)))
+
+
+def test_read_manifest(tmpdir):
+    manifest = tmpdir.join('manifest.json')
+    with pytest.raises(RuntimeError):
+        read_manifest(str(manifest), '/src', '/git')  # File does not exist.
+    manifest.write('{"coverage": ".coverage"}')
+    with pytest.raises(RuntimeError):
+        read_manifest(str(manifest), '/src', '/git')  # Not a list.
+    manifest.write('[{"source": "pkg1"}]')
+    with pytest.raises(RuntimeError):
+        read_manifest(str(manifest), '/src', '/git')  # No coverage key.
+
+    manifest.write('[{"coverage": "pkg1/.coverage", "source": "pkg1", "git": "..", "lcov": ["pkg1/c.info"]}, '
+                   '{"coverage": "/pkg2/.coverage"}]')
+    expected = [
+        dict(coverage=str(tmpdir.join('pkg1', '.coverage')), source=str(tmpdir.join('pkg1')),
+             git=str(tmpdir.dirpath()), lcov=[str(tmpdir.join('pkg1', 'c.info'))]),
+        dict(coverage='/pkg2/.coverage', source='/src', git='/git', lcov=[]),
+    ]
+    assert expected == read_manifest(str(manifest), '/src', '/git')
+
+
+def test_submit_many(tmpdir, api_server, monkeypatch):
+    monkeypatch.setattr(coveralls_multi_ci, 'select_ci', lambda: GenericCI)
+    monkeypatch.setattr(GenericCI, 'REPO_TOKEN', 'abc')
+    source_root = os.path.join(ROOT, 'sample_project')
+    entries = [
+        dict(coverage=os.path.join(source_root, 'coverage_project_full'), source=source_root, git=ROOT),
+        dict(coverage=os.path.join(source_root, 'coverage_script_full'), source=source_root, git=ROOT),
+        dict(coverage=os.path.join(source_root, 'dne'), source=source_root, git=ROOT),
+        dict(coverage=os.path.join(source_root, 'coverage_project_partial'), source=source_root, git=ROOT),
+    ]
+
+    results = submit_many(entries, str(tmpdir.join('payload.txt')), jobs=2)
+    assert [True, True, False, True] == [r['ok'] for r in results]
+    assert [e['coverage'] for e in entries] == [r['coverage'] for r in results]
+    assert results[2]['error']
+    assert 3 == len(api_server.received)
+    assert [] == tmpdir.listdir()
+
+    payloads = [json.loads(b.splitlines()[3].decode('ascii')) for b in api_server.received.values()]
+    assert [1, 4, 4] == sorted(len(p['source_files']) for p in payloads)
+    assert 1 == len(set(p['git']['head']['id'] for p in payloads))
@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+from coveralls_multi_ci import SubmitDaemon, Submitter
+from tests.fake_api import FakeAPIServer
+
+
+def write_project(tmpdir):
+    tmpdir.join('lib.py').write('def h():\n    return 3\n\nh()\n')
+    tmpdir.join('coverage.json').write(json.dumps(dict(meta=dict(version='7.0'), files={
+        'lib.py': dict(executed_lines=[1, 4], missing_lines=[2]),
+    })))
+
+
+def test_options(tmpdir):
+    submitter = Submitter({'--coverage': 'coverage.json', '--lcov': 'c.info, js.info', '--max-memory': '2'},
+                          environ=dict(), cwd=str(tmpdir))
+    assert str(tmpdir.join('coverage.json')) == submitter.coverage_file
+    assert (str(tmpdir), str(tmpdir)) == (submitter.repo_dir, submitter.source_root)
+    assert [str(tmpdir.join('c.info')), str(tmpdir.join('js.info'))] == submitter.lcov_files
+    assert (2000000, None, 4) == (submitter.max_memory, submitter.target_file, submitter.jobs)
+    assert submitter.fingerprints is None  # Identical submissions are only skipped with --fingerprints.
+    with pytest.raises(RuntimeError):
+        Submitter({'--heavy': 'generated=drop'})
+    with pytest.raises(RuntimeError):
+        Submitter(environ=dict()).inspect()  # No --output.
+
+
+def test_concurrent(tmpdir, repo_dir, api_server, monkeypatch):
+    write_project(tmpdir)
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmpdir.join('tmp').ensure(dir=True)))
+    environs = [dict(COVERALLS_REPO_TOKEN='token{0}'.format(i), CI_BUILD_NUMBER=str(i)) for i in range(7)]
+    environs.append(dict(CI='true', TRAVIS='true', TRAVIS_JOB_ID='777', TRAVIS_BRANCH='from_travis'))
+    options = {'--coverage': 'coverage.json', '--git': repo_dir, '--no-daemon': True}
+    submitters = [Submitter(options, environ=e, cwd=str(tmpdir), api_url=api_server.url) for e in environs]
+
+    pool = ThreadPool(16)
+    try:
+        pool.map(lambda i: submitters[i % len(submitters)].submit(), range(32))
+    finally:
+        pool.close()
+        pool.join()
+
+    payloads = [json.loads(b.splitlines()[3].decode('ascii')) for b in api_server.received.values()]
+    assert 32 == len(payloads)
+    by_job = dict()
+    for payload in payloads:
+        key = payload.get('repo_token'), payload.get('service_number'), payload['service_name']
+        by_job[key] = by_job.get(key, 0) + 1
+        assert ['lib.py'] == [f['name'] for f in payload['source_files']]
+        assert [1, 0, None, 1] == payload['source_files'][0]['coverage']
+    expected = dict((('token{0}'.format(i), str(i), 'coveralls_multi_ci'), 4) for i in range(7))
+    expected[(None, None, 'travis-ci')] = 4
+    assert expected == by_job
+    assert set(['from_travis']) == set(p['git']['branch'] for p in payloads if p['service_name'] == 'travis-ci')
+    assert [] == tmpdir.join('tmp').listdir()  # Payload files of every submission deleted.
+    assert 'COVERALLS_REPO_TOKEN' not in os.environ or os.environ['COVERALLS_REPO_TOKEN'] != 'token0'
+
+
+def test_shared_output(tmpdir, repo_dir, api_server):
+    write_project(tmpdir)
+    options = {'--coverage': 'coverage.json', '--git': repo_dir, '--no-daemon': True, '--output': 'payload.txt'}
+    submitter = Submitter(options, environ=dict(COVERALLS_REPO_TOKEN='abc'), cwd=str(tmpdir), api_url=api_server.url)
+    assert str(tmpdir.join('payload.txt')) == submitter.target_file
+
+    pool = ThreadPool(8)
+    try:
+        pool.map(lambda _: submitter.submit(), range(8))  # One at a time, each upload reads a complete file.
+    finally:
+        pool.close()
+        pool.join()
+    assert 8 == len(api_server.received)
+    assert not tmpdir.join('payload.txt').check()
+
+
+def test_daemon_api_url(tmpdir, repo_dir, api_server):
+    write_project(tmpdir)
+    other = FakeAPIServer().start()  # E.g. an enterprise install, not API_URL (api_server).
+    daemon = SubmitDaemon(str(tmpdir.join('daemon.sock')))
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.start()
+    try:
+        assert daemon.ready.wait(5)
+        options = {'--coverage': 'coverage.json', '--git': repo_dir, '--socket': 'daemon.sock'}
+        Submitter(options, environ=dict(COVERALLS_REPO_TOKEN='abc'), cwd=str(tmpdir), api_url=other.url).submit()
+    finally:
+        daemon.shutdown()
+        thread.join(5)
+        other.stop()
+    assert daemon.cache.misses  # Submitted by the daemon, not in-process.
+    assert 1 == len(other.received)
+    assert not api_server.received